@@ -0,0 +1,241 @@
+# analysis_jobs.py
+from bson.objectid import ObjectId
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+import os
+import threading
+import time
+import traceback
+
+# Job lifecycle: queued -> running (stage by stage) -> completed | failed
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the pending queue is at capacity."""
+
+
+class JobAlreadyActive(Exception):
+    """Raised when an identical job (same project and payload) is already queued or running."""
+
+    def __init__(self, job_id):
+        super().__init__(f"Job {job_id} is already active")
+        self.job_id = job_id
+
+
+def active_key(project_id, fingerprint):
+    """
+    Value of a job's activeKey while it is queued or running. A unique index over the
+    field (see indexes.py) lets Mongo reject a second active job for the same payload,
+    across all processes; the field is removed when the job finishes.
+    """
+    return f"{project_id}:{fingerprint}"
+
+
+class AnalysisJobManager:
+    """
+    Runs a pipeline function on a bounded thread pool and persists job state in Mongo,
+    so clients can poll for progress and jobs survive a restart.
+
+    The pipeline is called as runner(payload, on_stage, **options) and must return a
+    JSON-serializable result dict; on_stage(name) is called whenever the pipeline enters a
+    new stage, and options are the ones given to submit (stored with the job).
+    """
+
+    def __init__(self, collection, runner, max_workers=2, max_pending=50, stale_after_seconds=600):
+        self.collection = collection
+        self.runner = runner
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.stale_after_seconds = stale_after_seconds
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def _check_process(self):
+        """Start from a clean slate in a forked worker (must hold self._lock)."""
+        if self._executor_pid != os.getpid():
+            # The child inherits the executor object and counters, but not the threads.
+            self._executor = None
+            self._executor_pid = os.getpid()
+            self._pending = 0
+
+    def _get_executor(self):
+        with self._lock:
+            self._check_process()
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="analysis-job"
+                )
+            return self._executor
+
+    def submit(self, payload, project_id, fingerprint=None, options=None):
+        """
+        Persist a new queued job and schedule it. Returns the job id as a string.
+        With a fingerprint, raises JobAlreadyActive if the same payload already has a
+        queued or running job (in any process).
+        """
+        with self._lock:
+            self._check_process()
+            if self._pending >= self.max_pending:
+                raise JobQueueFull(f"{self._pending} analysis jobs already pending")
+            self._pending += 1
+        now = datetime.utcnow()
+        job_doc = {
+            "projectId": ObjectId(project_id),
+            "payload": payload,
+            "payloadFingerprint": fingerprint,
+            "options": options or {},
+            "status": JOB_QUEUED,
+            "stage": JOB_QUEUED,
+            "stageTimings": {},
+            "result": None,
+            "error": None,
+            "createdAt": now,
+            "updatedAt": now,
+        }
+        if fingerprint:
+            job_doc["activeKey"] = active_key(project_id, fingerprint)
+        try:
+            job_id = self.collection.insert_one(job_doc).inserted_id
+            self._get_executor().submit(self._run, job_id)
+        except DuplicateKeyError:
+            with self._lock:
+                self._pending -= 1
+            active = self.collection.find_one({"activeKey": job_doc["activeKey"]}, {"_id": 1})
+            if active is None:
+                # The other job finished in the meantime.
+                return self.submit(payload, project_id, fingerprint, options)
+            raise JobAlreadyActive(str(active["_id"]))
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return str(job_id)
+
+    def find_active(self, project_id, fingerprint):
+        """Return a queued or running job for the same project payload, if any."""
+        return self.collection.find_one({"activeKey": active_key(project_id, fingerprint)}, {"_id": 1})
+
+    def get(self, job_id):
+        """Return a job document (without its payload) or None."""
+        return self.collection.find_one({"_id": ObjectId(job_id)}, {"payload": 0})
+
+    def recover_pending_jobs(self):
+        """
+        Re-schedule jobs left behind by a previous process: queued jobs, and running
+        jobs that have not been updated for stale_after_seconds.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale_after_seconds)
+        try:
+            self.collection.update_many(
+                {"status": JOB_RUNNING, "updatedAt": {"$lt": cutoff}},
+                {"$set": {"status": JOB_QUEUED, "stage": JOB_QUEUED, "updatedAt": datetime.utcnow()}}
+            )
+            job_ids = [doc["_id"] for doc in self.collection.find({"status": JOB_QUEUED}, {"_id": 1})]
+        except Exception as e:
+            print("Error recovering analysis jobs:", e)
+            return 0
+        for job_id in job_ids:
+            with self._lock:
+                self._check_process()
+                self._pending += 1
+            self._get_executor().submit(self._run, job_id)
+        if job_ids:
+            print(f"Recovered {len(job_ids)} pending analysis job(s).")
+        return len(job_ids)
+
+    def _run(self, job_id):
+        try:
+            self._run_job(job_id)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _run_job(self, job_id):
+        # Claim the job atomically so a job is never run twice.
+        started_at = datetime.utcnow()
+        job = self.collection.find_one_and_update(
+            {"_id": job_id, "status": JOB_QUEUED},
+            {"$set": {"status": JOB_RUNNING, "startedAt": started_at, "updatedAt": started_at}}
+        )
+        if job is None:
+            return
+
+        timings = {}
+        current = {"stage": None, "started": time.monotonic()}
+
+        def close_stage():
+            if current["stage"] is not None:
+                timings[current["stage"]] = round(time.monotonic() - current["started"], 3)
+
+        def on_stage(stage):
+            close_stage()
+            current["stage"] = stage
+            current["started"] = time.monotonic()
+            self.collection.update_one(
+                {"_id": job_id},
+                {"$set": {"stage": stage, "stageTimings": timings, "updatedAt": datetime.utcnow()}}
+            )
+
+        try:
+            result = self.runner(job["payload"], on_stage, **(job.get("options") or {}))
+            close_stage()
+            finished_at = datetime.utcnow()
+            self.collection.update_one(
+                {"_id": job_id},
+                {
+                    "$set": {
+                        "status": JOB_COMPLETED,
+                        "stage": JOB_COMPLETED,
+                        "stageTimings": timings,
+                        "result": result,
+                        "finishedAt": finished_at,
+                        "updatedAt": finished_at
+                    },
+                    "$unset": {"activeKey": ""}
+                }
+            )
+        except Exception as e:
+            close_stage()
+            print(f"Analysis job {job_id} failed:", e)
+            traceback.print_exc()
+            finished_at = datetime.utcnow()
+            self.collection.update_one(
+                {"_id": job_id},
+                {
+                    "$set": {
+                        "status": JOB_FAILED,
+                        "stageTimings": timings,
+                        "error": str(e),
+                        "finishedAt": finished_at,
+                        "updatedAt": finished_at
+                    },
+                    "$unset": {"activeKey": ""}
+                }
+            )
+
+
+def serialize_job(job):
+    """Convert a job document into the JSON shape returned by the status endpoint."""
+    def iso(value):
+        return value.isoformat() + "Z" if isinstance(value, datetime) else None
+
+    return {
+        "jobId": str(job["_id"]),
+        "projectId": str(job.get("projectId")),
+        "status": job.get("status"),
+        "stage": job.get("stage"),
+        "stageTimings": job.get("stageTimings", {}),
+        "createdAt": iso(job.get("createdAt")),
+        "startedAt": iso(job.get("startedAt")),
+        "finishedAt": iso(job.get("finishedAt")),
+        "result": job.get("result"),
+        "error": job.get("error"),
+    }
@@ -1,37 +1,52 @@
 # app.py
 from flask import Blueprint, request, jsonify
-from pymongo import MongoClient
 from bson.objectid import ObjectId
 import os
 import json
-import re
 from datetime import datetime
-from dotenv import load_dotenv
-load_dotenv(".env.local")
-from google import genai
+from resources import db, gemini_client, lazy_executor
+from google.genai import types
 from flask_cors import CORS
-
-load_dotenv()
+from project_context import invalidate_project_context
+from prompt_builder import digest_raw_analysis
+from analysis_jobs import AnalysisJobManager, JobAlreadyActive, JobQueueFull, serialize_job
+from metrics import metrics
+from llm_cache import bypass_requested, generate_text
+from json_extraction import extract_json_from_text
+from gemini_gateway import GeminiUnavailable, unavailable_response
+from singleflight import SingleFlight, SingleFlightTimeout, request_key
+import time
+import hashlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pymongo.errors import BulkWriteError
 
 analyze_project_bp = Blueprint('analyze_project', __name__)
 CORS(analyze_project_bp)
 
-# MongoDB configuration: using your ProjectAutomation (or ProjectAutomation) database
-MONGO_URI = os.getenv("MONGO_URI")
-client_mongo = MongoClient(MONGO_URI)
-db = client_mongo["ProjectAutomation"]  # Change this name if your database is named differently
-
 # Collections for storing documents
 analysis_collection = db["analysis"]
 raw_collection = db["rawAnalysis"]
+analysis_jobs_collection = db["analysisJobs"]  # Async /analyze_project jobs
+
+# Async analysis job pool
+ANALYSIS_JOB_WORKERS = int(os.getenv("ANALYSIS_JOB_WORKERS", "2"))
+ANALYSIS_JOB_MAX_PENDING = int(os.getenv("ANALYSIS_JOB_MAX_PENDING", "50"))
+
+# Analysis mode: "two_pass" (free-text analysis, then a second call to extract JSON) or
+# "single_call" (one schema-constrained call returning both; falls back to two_pass on failure)
+ANALYSIS_MODE_TWO_PASS = "two_pass"
+ANALYSIS_MODE_SINGLE_CALL = "single_call"
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", ANALYSIS_MODE_TWO_PASS)
 
-# Google Gemini API configuration
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-gemini_client = genai.Client(api_key=GEMINI_API_KEY)
+# /analyze_projects: items analyzed at once (shared by all batches in this process), and batch size limit
+ANALYSIS_BATCH_CONCURRENCY = int(os.getenv("ANALYSIS_BATCH_CONCURRENCY", "4"))
+ANALYSIS_BATCH_MAX_ITEMS = int(os.getenv("ANALYSIS_BATCH_MAX_ITEMS", "50"))
 
-def generate_long_response(project_data):
+def generate_long_response(project_data, bypass=None):
     """
     1st AI call: Produce a long, multi-page analysis with no strict JSON constraints.
+    bypass=True (forced re-analysis) skips cached answers.
     """
     project_details = json.dumps(project_data, indent=2)
     prompt = (
@@ -41,31 +56,19 @@ def generate_long_response(project_data):
         f"Project details:\n{project_details}\n\n"
         "Feel free to be as thorough as possible. No strict format is required for this step."
     )
-    response = gemini_client.models.generate_content(
+    return generate_text(
+        gemini_client,
         model="gemini-2.0-flash",
         contents=prompt,
+        endpoint="analyze_project",
+        bypass=bypass,
     )
-    return response.text
 
-def extract_json_from_text(text):
-    """
-    Attempt to extract a JSON object from text using regex.
-    Returns a dictionary if successful, else None.
-    """
-    match = re.search(r'(\{.*\})', text, re.DOTALL)
-    if match:
-        json_str = match.group(1)
-        try:
-            return json.loads(json_str)
-        except Exception as e:
-            print("Error parsing extracted JSON:", e)
-            return None
-    return None
-
-def parse_into_structured_json(raw_text):
+def parse_into_structured_json(raw_text, bypass=None):
     """
     2nd AI call: Transform the raw text into a rich JSON object with many key–value pairs.
-    If direct parsing fails, attempts regex extraction as a fallback.
+    extract_json_from_text parses it directly when possible and otherwise falls back to the
+    largest (repairable) JSON object in the text.
     """
     parse_prompt = (
         "You are an assistant that converts long text into a rich JSON structure.\n"
@@ -84,28 +87,327 @@ def parse_into_structured_json(raw_text):
         "Return ONLY valid JSON. Do not include any extra text, markdown, or disclaimers.\n\n"
         f"Raw text:\n{raw_text}\n"
     )
-    parse_response = gemini_client.models.generate_content(
+    # Only responses that yield a JSON object are cached.
+    structured_text, extracted = generate_text(
+        gemini_client,
         model="gemini-2.0-flash",
         contents=parse_prompt,
+        endpoint="analyze_project",
+        bypass=bypass,
+        parse=lambda text: extract_json_from_text(text, endpoint="analyze_project"),
     )
-    structured_text = parse_response.text
     print("Structured text from Gemini:", structured_text)
 
-    # Try direct parsing first.
-    try:
-        structured_data = json.loads(structured_text)
-        if isinstance(structured_data, dict):
-            return structured_data
-    except Exception as e:
-        print("Direct JSON parsing failed:", e)
-
-    # Fallback: extract JSON block using regex.
-    extracted = extract_json_from_text(structured_text)
     if extracted:
         return extracted
 
     return {"error": "Second-pass parsing failed", "raw": structured_text}
 
+# Response schema for single-call mode. Gemini object schemas need explicit properties, so the
+# free-form objects (team structure, member recommendations) come back as arrays and are
+# folded into objects by normalize_single_call_analysis.
+STRUCTURED_ANALYSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "suggestedTime": {"type": "STRING"},
+        "suggestedBudget": {"type": "NUMBER", "nullable": True},
+        "riskAssessment": {"type": "STRING"},
+        "recommendedTeamStructure": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "role": {"type": "STRING"},
+                    "count": {"type": "INTEGER"},
+                    "responsibilities": {"type": "STRING"}
+                },
+                "required": ["role"]
+            }
+        },
+        "memberRecommendations": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "role": {"type": "STRING"},
+                    "recommendation": {"type": "STRING"}
+                },
+                "required": ["role", "recommendation"]
+            }
+        },
+        "phases": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "name": {"type": "STRING"},
+                    "duration": {"type": "STRING"},
+                    "description": {"type": "STRING"},
+                    "deliverables": {"type": "ARRAY", "items": {"type": "STRING"}}
+                },
+                "required": ["name"]
+            }
+        },
+        "potentialRisks": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "riskMitigation": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "risk": {"type": "STRING"},
+                    "mitigation": {"type": "STRING"}
+                },
+                "required": ["risk", "mitigation"]
+            }
+        },
+        "advancedIdeas": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "sdlcMethodology": {"type": "STRING"}
+    },
+    "required": [
+        "suggestedTime", "suggestedBudget", "riskAssessment", "recommendedTeamStructure",
+        "memberRecommendations", "phases", "potentialRisks", "riskMitigation",
+        "advancedIdeas", "sdlcMethodology"
+    ]
+}
+
+SINGLE_CALL_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "rawAnalysis": {"type": "STRING"},
+        "analysis": STRUCTURED_ANALYSIS_SCHEMA
+    },
+    "required": ["rawAnalysis", "analysis"]
+}
+
+def normalize_single_call_analysis(analysis):
+    """Fold the array-shaped team fields of a schema response back into the documented object shape."""
+    team = analysis.get("recommendedTeamStructure")
+    if isinstance(team, list):
+        analysis["recommendedTeamStructure"] = {
+            item.get("role", f"role{i + 1}"): {k: v for k, v in item.items() if k != "role"}
+            for i, item in enumerate(team) if isinstance(item, dict)
+        }
+    members = analysis.get("memberRecommendations")
+    if isinstance(members, list):
+        analysis["memberRecommendations"] = {
+            item.get("role", f"role{i + 1}"): item.get("recommendation", "")
+            for i, item in enumerate(members) if isinstance(item, dict)
+        }
+    return analysis
+
+def generate_single_call_analysis(project_data, bypass=None):
+    """
+    Single AI call: produce the long narrative analysis and the structured JSON together,
+    using a JSON response schema. Returns (raw_analysis, structured_data).
+    Raises ValueError if the response does not match the expected shape.
+    """
+    project_details = json.dumps(project_data, indent=2)
+    prompt = (
+        "You are an expert project management advisor.\n"
+        "Analyze this project and return a JSON object with two keys:\n"
+        "  - rawAnalysis: a very detailed, multi-page analysis as plain text. Discuss scope, budget, "
+        "timeline, risk factors, team structure, phases, potential pitfalls, advanced ideas, and anything relevant.\n"
+        "  - analysis: the structured summary of that same analysis, following the response schema. "
+        "suggestedBudget is a number; use null or empty values for anything that does not apply.\n\n"
+        f"Project details:\n{project_details}\n"
+    )
+    _, parsed = generate_text(
+        gemini_client,
+        model="gemini-2.0-flash",
+        contents=prompt,
+        config=types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=SINGLE_CALL_RESPONSE_SCHEMA,
+        ),
+        endpoint="analyze_project",
+        bypass=bypass,
+        parse=parse_single_call_response,
+    )
+    if parsed is None:
+        raise ValueError("Single-call response is missing rawAnalysis or analysis")
+    raw_analysis, structured_data = parsed
+    return raw_analysis, normalize_single_call_analysis(structured_data)
+
+def parse_single_call_response(response_text):
+    """(rawAnalysis, analysis) of a single-call response, or None if it does not have that shape."""
+    with metrics.stage("parse"):
+        try:
+            payload = json.loads(response_text)
+        except ValueError:
+            return None
+    raw_analysis = payload.get("rawAnalysis") if isinstance(payload, dict) else None
+    structured_data = payload.get("analysis") if isinstance(payload, dict) else None
+    if not raw_analysis or not isinstance(structured_data, dict):
+        return None
+    return raw_analysis, structured_data
+
+def project_fingerprint(project_data):
+    """Canonical SHA-256 fingerprint of a project payload (key order and whitespace insensitive)."""
+    canonical = json.dumps(project_data, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def find_unchanged_analysis(project_id, fingerprint):
+    """
+    Returns the latest stored analysis for the project if it was produced from a payload
+    with the same fingerprint, else None. Failed analyses (with an "error" key, e.g. a
+    second pass that could not be parsed) are never returned as unchanged.
+    """
+    with metrics.stage("mongo"):
+        latest = analysis_collection.find_one(
+            {"projectId": ObjectId(project_id), "analysis.error": {"$exists": False}},
+            sort=[("analysisTimestamp", -1)]
+        )
+    if latest and latest.get("payloadFingerprint") == fingerprint:
+        return latest
+    return None
+
+def generate_analysis(project_data, stage=None, on_raw=None, bypass=None):
+    """
+    The Gemini part of the pipeline: produce the raw analysis and its structured form.
+    In single_call mode (ANALYSIS_MODE) generation and parsing are one request; if that
+    request fails the two-pass path is used instead.
+    stage(name) is called as each stage starts; on_raw(raw_analysis) is called as soon as
+    the raw text exists (before the parsing pass in two-pass mode). bypass=True (a forced
+    re-analysis) skips the LLM cache.
+    Returns (raw_analysis, structured_data, mode).
+    """
+    stage = stage or (lambda name: None)
+    mode = ANALYSIS_MODE
+    started = time.perf_counter()
+
+    # Single-call mode: narrative and structured JSON from one schema-constrained request.
+    if mode == ANALYSIS_MODE_SINGLE_CALL:
+        stage("generating")
+        try:
+            raw_analysis, structured_data = generate_single_call_analysis(project_data, bypass)
+            metrics.observe("analysis_llm_seconds", time.perf_counter() - started, mode=mode)
+            metrics.increment("analysis_requests_total", mode=mode)
+            print("Single-call analysis generated.")
+            if on_raw:
+                on_raw(raw_analysis)
+            return raw_analysis, structured_data, mode
+        except GeminiUnavailable:
+            # The two-pass path would be rejected too.
+            raise
+        except Exception as e:
+            print("Single-call analysis failed, falling back to two-pass:", e)
+            metrics.increment("analysis_single_call_fallbacks_total")
+            mode = ANALYSIS_MODE_SINGLE_CALL + "_fallback"
+
+    # Step 1: Generate long raw analysis.
+    stage("generating")
+    generation_started = time.perf_counter()
+    raw_analysis = generate_long_response(project_data, bypass)
+    llm_seconds = time.perf_counter() - generation_started
+    print("Raw analysis generated.")
+    if on_raw:
+        on_raw(raw_analysis)
+
+    # Step 3: Transform raw analysis into a structured JSON.
+    stage("parsing")
+    parsing_started = time.perf_counter()
+    structured_data = parse_into_structured_json(raw_analysis, bypass)
+    llm_seconds += time.perf_counter() - parsing_started
+    print("Structured data parsed:", structured_data)
+    # In fallback mode this also excludes the failed single-call attempt.
+    metrics.observe("analysis_llm_seconds", llm_seconds, mode=mode)
+    metrics.increment("analysis_requests_total", mode=mode)
+    return raw_analysis, structured_data, mode
+
+def build_raw_analysis_doc(project_id, raw_analysis, fingerprint):
+    """rawAnalysis document; its _id is assigned up front so the analysis can reference it."""
+    return {
+        "_id": ObjectId(),
+        "projectId": ObjectId(project_id),
+        "rawAnalysis": raw_analysis,
+        # Compact outline sent to chat/assignment prompts instead of the full text
+        "rawAnalysisDigest": digest_raw_analysis(raw_analysis),
+        "payloadFingerprint": fingerprint,
+        "createdAt": datetime.utcnow()
+    }
+
+def build_analysis_doc(project_id, structured_data, mode, raw_analysis_id, fingerprint):
+    return {
+        "projectId": ObjectId(project_id),
+        "analysis": structured_data,  # Stored as individual fields in MongoDB document
+        "analysisMode": mode,
+        "rawAnalysisId": raw_analysis_id,
+        "payloadFingerprint": fingerprint,
+        "analysisTimestamp": datetime.utcnow()
+    }
+
+def unchanged_result(analysis_doc):
+    """Response fields for a stored analysis returned because the payload did not change."""
+    raw_analysis_id = analysis_doc.get("rawAnalysisId")
+    return {
+        "raw_analysis_id": str(raw_analysis_id) if raw_analysis_id else None,
+        "analysis_id": str(analysis_doc["_id"]),
+        "analysis": analysis_doc.get("analysis"),
+        "analysisMode": analysis_doc.get("analysisMode"),
+        "unchanged": True
+    }
+
+def run_analysis_pipeline(project_data, on_stage=None, bypass=None):
+    """
+    Runs the full analysis pipeline for one project payload:
+    generate raw analysis -> store raw -> parse into structured JSON -> store structured.
+    In single_call mode the parsing stage is skipped (see generate_analysis).
+    on_stage(name) is called as each stage starts (used for async job progress).
+    bypass=True (a forced re-analysis) skips the LLM cache.
+    Returns the document references and the structured analysis.
+    """
+    def stage(name):
+        if on_stage:
+            on_stage(name)
+
+    project_id = project_data["_id"]
+    fingerprint = project_fingerprint(project_data)
+    raw_doc = {}
+
+    # Step 2: Store the raw response (before parsing, so it survives a failed parse).
+    def store_raw(raw_analysis):
+        stage("storing_raw")
+        raw_doc.update(build_raw_analysis_doc(project_id, raw_analysis, fingerprint))
+        with metrics.stage("mongo"):
+            raw_collection.insert_one(raw_doc)
+        print("Raw analysis document inserted with ID:", raw_doc["_id"])
+
+    _, structured_data, mode = generate_analysis(project_data, stage, on_raw=store_raw, bypass=bypass)
+
+    # Step 4: Store the structured analysis.
+    stage("storing_analysis")
+    analysis_doc = build_analysis_doc(project_id, structured_data, mode, raw_doc["_id"], fingerprint)
+    with metrics.stage("mongo"):
+        analysis_result = analysis_collection.insert_one(analysis_doc)
+    print("Structured analysis document inserted with ID:", analysis_result.inserted_id)
+
+    # Cached chat/assignment context for this project is now stale.
+    invalidate_project_context(project_id)
+
+    return {
+        "raw_analysis_id": str(raw_doc["_id"]),
+        "analysis_id": str(analysis_result.inserted_id),
+        "analysis": structured_data,
+        "analysisMode": mode
+    }
+
+# Background job manager for the opt-in async mode of /analyze_project
+analysis_job_manager = AnalysisJobManager(
+    analysis_jobs_collection,
+    run_analysis_pipeline,
+    max_workers=ANALYSIS_JOB_WORKERS,
+    max_pending=ANALYSIS_JOB_MAX_PENDING
+)
+
+# Coalesces concurrent identical analyses (same project and payload) in this process
+analysis_flight = SingleFlight("analyze_project")
+
+def wants_async(req):
+    """Async mode is opt-in via ?async=true or a 'Prefer: respond-async' header."""
+    if req.args.get("async", "").lower() in ("1", "true", "yes"):
+        return True
+    return "respond-async" in req.headers.get("Prefer", "").lower()
+
 @analyze_project_bp.route("/analyze_project", methods=["POST"])
 def analyze_project():
     """
@@ -116,6 +418,11 @@ def analyze_project():
       4. Calls Gemini again to parse the raw text into a structured JSON,
       5. Stores the final structured JSON (as key–value pairs) in the analysis collection,
       6. Returns document references and the structured analysis.
+    With ?async=true (or 'Prefer: respond-async') the pipeline runs in the background
+    instead and the route returns 202 with a jobId to poll at GET /analyze_project/<job_id>.
+    If the payload is identical to the one behind the latest stored analysis, that analysis
+    is returned without calling Gemini, unless ?force=true (or "force": true) is given;
+    a forced analysis also skips the LLM response cache.
     """
     try:
         project_data = request.get_json()
@@ -125,43 +432,235 @@ def analyze_project():
         if "_id" not in project_data:
             return jsonify({"message": "Project _id is required to link analysis data."}), 400
 
+        # "force" is a request flag, not part of the project payload.
+        force = bool(project_data.pop("force", False)) or request.args.get("force", "").lower() in ("1", "true", "yes")
+
         project_id = project_data["_id"]
         print("Received project data for ID:", project_id)
 
-        # Step 1: Generate long raw analysis.
-        raw_analysis = generate_long_response(project_data)
-        print("Raw analysis generated.")
+        if not force:
+            unchanged = find_unchanged_analysis(project_id, project_fingerprint(project_data))
+            if unchanged:
+                print("Project payload unchanged; returning stored analysis:", unchanged["_id"])
+                metrics.increment("analysis_unchanged_total")
+                return jsonify({
+                    "message": "Project unchanged since last analysis; returning stored analysis",
+                    **unchanged_result(unchanged)
+                }), 200
 
-        # Step 2: Store the raw response.
-        raw_doc = {
-            "projectId": ObjectId(project_id),
-            "rawAnalysis": raw_analysis,
-            "createdAt": datetime.utcnow()
-        }
-        raw_result = raw_collection.insert_one(raw_doc)
-        print("Raw analysis document inserted with ID:", raw_result.inserted_id)
-
-        # Step 3: Transform raw analysis into a structured JSON.
-        structured_data = parse_into_structured_json(raw_analysis)
-        print("Structured data parsed:", structured_data)
-
-        # Step 4: Store the structured analysis.
-        analysis_doc = {
-            "projectId": ObjectId(project_id),
-            "analysis": structured_data,  # Stored as individual fields in MongoDB document
-            "analysisTimestamp": datetime.utcnow()
+        if wants_async(request):
+            # Reuse a queued/running job for the same payload instead of starting another;
+            # the unique activeKey index makes this hold across processes.
+            fingerprint = project_fingerprint(project_data)
+            try:
+                job_id = analysis_job_manager.submit(
+                    project_data, project_id, fingerprint, options={"bypass": True} if force else None
+                )
+            except JobAlreadyActive as e:
+                metrics.increment("single_flight_requests_total", group="analyze_project_async", role="follower")
+                return jsonify({
+                    "message": "Identical project analysis already in progress",
+                    "jobId": e.job_id,
+                    "statusUrl": f"/analyze_project/{e.job_id}"
+                }), 202
+            except JobQueueFull as e:
+                print("Analysis job queue full:", e)
+                return jsonify({"message": "Too many analyses in progress, please retry later"}), 503
+            return jsonify({
+                "message": "Project analysis started",
+                "jobId": job_id,
+                "statusUrl": f"/analyze_project/{job_id}"
+            }), 202
+
+        try:
+            result, shared = analysis_flight.do(
+                request_key("analyze_project", project_id, {"project": project_data, "force": force}),
+                lambda: run_analysis_pipeline(project_data, bypass=True if force else None)
+            )
+        except SingleFlightTimeout as e:
+            print("Coalesced analysis timed out:", e)
+            return jsonify({"message": "An identical analysis is still in progress, please retry later"}), 503
+
+        # Return document references and structured analysis.
+        response = jsonify({
+            "message": "Project analysis completed successfully",
+            **result
+        })
+        if shared:
+            response.headers["X-Coalesced"] = "true"
+        return response, 200
+
+    except GeminiUnavailable as e:
+        print("Gemini unavailable:", e)
+        return unavailable_response(e)
+    except Exception as e:
+        print("Error analyzing project:", e)
+        return jsonify({"message": "Internal Server Error"}), 500
+
+@analyze_project_bp.route("/analyze_project/<job_id>", methods=["GET"])
+def analyze_project_status(job_id):
+    """Reports status, current stage, per-stage timings and (when done) the result of an async analysis job."""
+    try:
+        if not ObjectId.is_valid(job_id):
+            return jsonify({"message": "Invalid job id"}), 400
+        job = analysis_job_manager.get(job_id)
+        if not job:
+            return jsonify({"message": "Job not found"}), 404
+        return jsonify(serialize_job(job)), 200
+    except Exception as e:
+        print("Error fetching analysis job:", e)
+        return jsonify({"message": "Internal Server Error"}), 500
+
+# Thread pool that caps concurrent batch analyses
+get_batch_executor = lazy_executor(
+    lambda: ThreadPoolExecutor(max_workers=ANALYSIS_BATCH_CONCURRENCY, thread_name_prefix="analysis-batch")
+)
+
+def generate_batch_item(project_data, bypass=None):
+    """Runs the Gemini part for one batch item. Returns (raw_doc, analysis_doc), ready to insert."""
+    project_id = project_data["_id"]
+    fingerprint = project_fingerprint(project_data)
+    raw_analysis, structured_data, mode = generate_analysis(project_data, bypass=bypass)
+    raw_doc = build_raw_analysis_doc(project_id, raw_analysis, fingerprint)
+    analysis_doc = build_analysis_doc(project_id, structured_data, mode, raw_doc["_id"], fingerprint)
+    return raw_doc, analysis_doc
+
+def insert_batch(collection, docs):
+    """
+    insert_many(ordered=False) so one bad document does not stop the others.
+    Returns {position in docs: error message} for the documents that were not written.
+    """
+    if not docs:
+        return {}
+    try:
+        with metrics.stage("mongo"):
+            collection.insert_many(docs, ordered=False)
+        return {}
+    except BulkWriteError as e:
+        return {err["index"]: err.get("errmsg", "Write failed") for err in e.details.get("writeErrors", [])}
+    except Exception as e:
+        return {i: str(e) for i in range(len(docs))}
+
+def run_analysis_batch(projects, force=False, bypass=False):
+    """
+    Analyze a list of project payloads. Generation runs concurrently on the batch pool;
+    the results are then written with one insert_many per collection. bypass=True (the
+    request's Cache-Control: no-cache) skips cached answers for every item; forced items
+    always skip them.
+    Returns one status entry per item, in input order; a failed item never fails the batch.
+    """
+    results = [None] * len(projects)
+    pending = []
+    forced = set()
+    seen = set()
+
+    def failed(i, project_id, error):
+        metrics.increment("analysis_batch_items_total", status="failed")
+        results[i] = {"index": i, "projectId": project_id, "status": "failed", "error": error}
+
+    for i, project_data in enumerate(projects):
+        if not isinstance(project_data, dict) or "_id" not in project_data:
+            failed(i, None, "Project _id is required to link analysis data.")
+            continue
+        project_id = str(project_data["_id"])
+        if not ObjectId.is_valid(project_id):
+            failed(i, project_id, "Invalid project _id")
+            continue
+        if project_id in seen:
+            failed(i, project_id, "Duplicate project _id in batch")
+            continue
+        seen.add(project_id)
+        item_force = bool(project_data.pop("force", False)) or force
+        if item_force:
+            forced.add(i)
+        else:
+            unchanged = find_unchanged_analysis(project_id, project_fingerprint(project_data))
+            if unchanged:
+                metrics.increment("analysis_batch_items_total", status="unchanged")
+                results[i] = {"index": i, "projectId": project_id, "status": "unchanged", **unchanged_result(unchanged)}
+                continue
+        pending.append(i)
+
+    # Items run in a copy of the caller's context, so their LLM cache results and stage
+    # timings are reported in this request's X-LLM-Cache / X-Stage-Timings headers.
+    futures = {
+        get_batch_executor().submit(
+            contextvars.copy_context().run, generate_batch_item, projects[i], True if i in forced else bypass
+        ): i
+        for i in pending
+    }
+    generated = []
+    for future in as_completed(futures):
+        i = futures[future]
+        try:
+            generated.append((i, *future.result()))
+        except Exception as e:
+            print(f"Batch analysis of item {i} failed:", e)
+            failed(i, str(projects[i]["_id"]), str(e))
+    generated.sort(key=lambda item: item[0])
+
+    # Raw analyses first; an analysis is only written if its raw analysis was.
+    raw_errors = insert_batch(raw_collection, [raw_doc for _, raw_doc, _ in generated])
+    stored = []
+    for position, (i, raw_doc, analysis_doc) in enumerate(generated):
+        if position in raw_errors:
+            failed(i, str(projects[i]["_id"]), raw_errors[position])
+        else:
+            stored.append((i, raw_doc, analysis_doc))
+    analysis_errors = insert_batch(analysis_collection, [analysis_doc for _, _, analysis_doc in stored])
+
+    for position, (i, raw_doc, analysis_doc) in enumerate(stored):
+        project_id = str(projects[i]["_id"])
+        if position in analysis_errors:
+            failed(i, project_id, analysis_errors[position])
+            continue
+        invalidate_project_context(project_id)
+        metrics.increment("analysis_batch_items_total", status="completed")
+        results[i] = {
+            "index": i,
+            "projectId": project_id,
+            "status": "completed",
+            "raw_analysis_id": str(raw_doc["_id"]),
+            "analysis_id": str(analysis_doc["_id"]),
+            "analysis": analysis_doc["analysis"],
+            "analysisMode": analysis_doc["analysisMode"]
         }
-        analysis_result = analysis_collection.insert_one(analysis_doc)
-        print("Structured analysis document inserted with ID:", analysis_result.inserted_id)
+    return results
+
+@analyze_project_bp.route("/analyze_projects", methods=["POST"])
+def analyze_projects():
+    """
+    Batch variant of /analyze_project. Accepts a JSON array of project payloads (each with
+    _id), or {"projects": [...], "force": true}. Items are analyzed concurrently, at most
+    ANALYSIS_BATCH_CONCURRENCY at a time, and unchanged projects are skipped unless forced.
+    Returns a status per item (completed / unchanged / failed) plus a summary.
+    """
+    try:
+        data = request.get_json()
+        force = request.args.get("force", "").lower() in ("1", "true", "yes")
+        if isinstance(data, dict):
+            force = force or bool(data.get("force", False))
+            data = data.get("projects")
+        if not isinstance(data, list) or not data:
+            return jsonify({"message": "A non-empty array of project payloads is required"}), 400
+        if len(data) > ANALYSIS_BATCH_MAX_ITEMS:
+            return jsonify({"message": f"At most {ANALYSIS_BATCH_MAX_ITEMS} projects per batch"}), 413
 
-        # Step 5: Return document references and structured analysis.
+        print(f"Received batch analysis of {len(data)} project(s)")
+        started = time.perf_counter()
+        # Resolved here: items are generated on pool threads, outside this request.
+        results = run_analysis_batch(data, force, bypass_requested())
+        metrics.observe("analysis_batch_seconds", time.perf_counter() - started)
+
+        summary = {"total": len(results)}
+        for status in ("completed", "unchanged", "failed"):
+            summary[status] = sum(1 for r in results if r["status"] == status)
         return jsonify({
-            "message": "Project analysis completed successfully",
-            "raw_analysis_id": str(raw_result.inserted_id),
-            "analysis_id": str(analysis_result.inserted_id),
-            "analysis": structured_data
+            "message": "Batch analysis finished",
+            "summary": summary,
+            "results": results
         }), 200
 
     except Exception as e:
-        print("Error analyzing project:", e)
+        print("Error analyzing project batch:", e)
         return jsonify({"message": "Internal Server Error"}), 500
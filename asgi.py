@@ -0,0 +1,358 @@
+# asgi.py
+"""
+ASGI entry point, e.g.:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 4
+
+The Gemini-bound chat routes (/chatbot, /chatbot/stream, the JSON chat of
+/chat_with_documents and /chat_with_documents/stream) run as async views on the SDK's
+async client and the async Mongo driver, so a request waiting on the model holds no
+thread. Every other request, including document uploads, goes to the Flask app from
+run.py through a WSGI bridge and behaves exactly as under waitress.
+"""
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+from a2wsgi import WSGIMiddleware
+from bson.objectid import ObjectId
+import contextlib
+import functools
+import os
+import time
+
+from run import app as flask_app, create_app
+import chatbot
+import chat_with_documents
+from gemini_gateway import GeminiUnavailable, gemini_gateway, retry_after_seconds
+from llm_cache import cache_headers, cache_results_var, generate_text_async
+from metrics import metrics, stage_route_var, stage_timings_header, stage_timings_var
+from project_context import get_project_context_async, SECTION_RAW_ANALYSIS
+from resources import gemini_client
+from streaming import StreamingCleaner, FENCE_BLOCK, FENCE_LINE, SSE_HEADERS, sse_event
+
+# Threads that serve the Flask routes behind the bridge
+ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "10"))
+
+GEMINI_MODEL = "gemini-2.0-flash"
+
+
+async def read_json(request):
+    """The JSON body of a request, or None if it is missing or invalid."""
+    try:
+        return await request.json()
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def cache_bypass_requested(request):
+    """Same rule as llm_cache.bypass_requested, for a Starlette request."""
+    return "no-cache" in request.headers.get("cache-control", "").lower()
+
+
+def track_llm_cache(view):
+    """Collect the LLM cache results of the view and report them in X-LLM-Cache headers."""
+    @functools.wraps(view)
+    async def endpoint(request):
+        token = cache_results_var.set([])
+        try:
+            response = await view(request)
+            response.headers.update(cache_headers(cache_results_var.get()))
+            return response
+        finally:
+            cache_results_var.reset(token)
+    return endpoint
+
+
+def track_stage_timings(view):
+    """
+    Starlette counterpart of metrics.record_request: records http_request_seconds and the
+    stages timed by the view (and what it calls) in X-Stage-Timings. For streams only the
+    stages before the first byte are in the header.
+    """
+    @functools.wraps(view)
+    async def endpoint(request):
+        started = time.perf_counter()
+        route = request.url.path
+        timings_token = stage_timings_var.set([])
+        route_token = stage_route_var.set(route)
+        try:
+            response = await view(request)
+            timings = stage_timings_var.get()
+            if timings:
+                response.headers["X-Stage-Timings"] = stage_timings_header(timings)
+            metrics.observe(
+                "http_request_seconds",
+                time.perf_counter() - started,
+                route=route,
+                method=request.method,
+                status=response.status_code
+            )
+            return response
+        finally:
+            stage_route_var.reset(route_token)
+            stage_timings_var.reset(timings_token)
+    return endpoint
+
+
+def unavailable_response(error):
+    """Starlette counterpart of gemini_gateway.unavailable_response."""
+    seconds = retry_after_seconds(error)
+    return JSONResponse(
+        {"message": "Service temporarily unavailable", "retryAfter": seconds},
+        status_code=503,
+        headers={"Retry-After": str(seconds)}
+    )
+
+
+def chat_fields(data, project_required):
+    """(project_id, user_email, query, conversation_id) from a chat payload."""
+    project_id = data.get("projectId") if project_required else (data.get("projectId") or str(ObjectId()))
+    return project_id, data.get("userEmail"), data.get("query"), data.get("conversationId")
+
+
+async def stream_answer(prompt, cleaner, endpoint):
+    """Yield cleaned answer text from a streamed generation, then the cleaner's remainder."""
+    async for chunk in gemini_gateway.generate_content_stream_async(gemini_client, GEMINI_MODEL, prompt, endpoint=endpoint):
+        text = cleaner.feed(chunk.text or "")
+        if text:
+            yield text
+    text = cleaner.finish()
+    if text:
+        yield text
+
+
+@track_stage_timings
+@track_llm_cache
+async def chatbot_view(request):
+    """Async /chatbot (same payload and response as chatbot.chatbot)."""
+    try:
+        data = await read_json(request)
+        if not data:
+            return JSONResponse({"message": "No data provided"}, status_code=400)
+
+        project_id, user_email, query, conversation_id = chat_fields(data, project_required=True)
+        if not project_id or not user_email or not query:
+            return JSONResponse({"message": "projectId, userEmail, and query are required"}, status_code=400)
+
+        context = await get_project_context_async(project_id, endpoint="chatbot")
+        prompt = chatbot.build_chatbot_prompt(context, query)
+        raw_answer = await generate_text_async(
+            gemini_client,
+            model=GEMINI_MODEL,
+            contents=prompt,
+            endpoint="chatbot",
+            bypass=cache_bypass_requested(request),
+        )
+        answer = chatbot.clean_response(raw_answer)
+
+        conversation_id = await chatbot.save_conversation_turn_async(conversation_id, project_id, user_email, query, answer)
+
+        return JSONResponse({
+            "message": "Query processed successfully",
+            "answer": answer,
+            "conversationId": conversation_id
+        })
+    except GeminiUnavailable as e:
+        print("Gemini unavailable:", e)
+        return unavailable_response(e)
+    except Exception as e:
+        print("Error processing chatbot query:", e)
+        return JSONResponse({"message": "Internal Server Error"}, status_code=500)
+
+
+@track_stage_timings
+async def chatbot_stream_view(request):
+    """Async /chatbot/stream (same Server-Sent Events as chatbot.chatbot_stream)."""
+    data = await read_json(request)
+    if not data:
+        return JSONResponse({"message": "No data provided"}, status_code=400)
+
+    project_id, user_email, query, conversation_id = chat_fields(data, project_required=True)
+    if not project_id or not user_email or not query:
+        return JSONResponse({"message": "projectId, userEmail, and query are required"}, status_code=400)
+
+    try:
+        context = await get_project_context_async(project_id, endpoint="chatbot")
+    except Exception as e:
+        print("Error fetching chatbot context:", e)
+        return JSONResponse({"message": "Internal Server Error"}, status_code=500)
+    prompt = chatbot.build_chatbot_prompt(context, query)
+
+    async def generate():
+        cleaner = StreamingCleaner(chatbot.clean_response_segment, fence_mode=FENCE_BLOCK, line_patterns=[r"disclaimer:"])
+        parts = []
+        try:
+            async for text in stream_answer(prompt, cleaner, "chatbot"):
+                parts.append(text)
+                yield sse_event("chunk", {"text": text})
+            answer = "".join(parts)
+            saved_id = await chatbot.save_conversation_turn_async(conversation_id, project_id, user_email, query, answer)
+            yield sse_event("done", {"answer": answer, "conversationId": saved_id})
+        except GeminiUnavailable as e:
+            print("Error streaming chatbot response:", e)
+            yield sse_event("error", {"message": "Service temporarily unavailable", "retryAfter": retry_after_seconds(e)})
+        except Exception as e:
+            print("Error streaming chatbot response:", e)
+            yield sse_event("error", {"message": "Internal Server Error"})
+
+    return StreamingResponse(generate(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+async def build_document_prompt_async(project_id, query, data):
+    """
+    Resolve the chat's documents and build its prompt. The project context comes from the
+    async driver; document loading and BM25 retrieval are CPU/GridFS work and run in a thread.
+    """
+    documents = await run_in_threadpool(
+        chat_with_documents.resolve_documents,
+        data.get("userEmail"),
+        data.get("projectId"),
+        chat_with_documents.requested_document_ids(data),
+        data.get("conversationId")
+    )
+    context = await get_project_context_async(project_id, exclude=(SECTION_RAW_ANALYSIS,), endpoint="chat_with_documents")
+    prompt, retrieval = await run_in_threadpool(chat_with_documents.build_document_prompt, project_id, query, documents, context)
+    return documents, prompt, retrieval
+
+
+@track_stage_timings
+@track_llm_cache
+async def chat_with_documents_view(request):
+    """Async JSON chat of /chat_with_documents (uploads are served by the Flask route)."""
+    try:
+        data = await read_json(request)
+        if not data:
+            return JSONResponse({"message": "No JSON data provided"}, status_code=400)
+
+        project_id, user_email, query, conversation_id = chat_fields(data, project_required=False)
+        if not user_email or not query:
+            return JSONResponse({"message": "userEmail and query are required"}, status_code=400)
+
+        try:
+            documents, prompt, retrieval = await build_document_prompt_async(project_id, query, data)
+        except chat_with_documents.DocumentNotFound as e:
+            return JSONResponse({"message": f"Document not found: {e}"}, status_code=404)
+
+        raw_answer = await generate_text_async(
+            gemini_client,
+            model=GEMINI_MODEL,
+            contents=prompt,
+            endpoint="chat_with_documents",
+            bypass=cache_bypass_requested(request),
+        )
+        answer = chat_with_documents.clean_response(raw_answer)
+
+        conversation_id = await chat_with_documents.save_conversation_turn_async(
+            conversation_id, project_id, user_email, documents, query, answer
+        )
+
+        return JSONResponse({
+            "message": "Query processed successfully",
+            "answer": answer,
+            "conversationId": conversation_id,
+            "retrieval": retrieval
+        })
+    except GeminiUnavailable as e:
+        print("Gemini unavailable:", e)
+        return unavailable_response(e)
+    except Exception as e:
+        print("Error in chat_with_documents:", e)
+        return JSONResponse({"message": "Internal Server Error", "error": str(e)}, status_code=500)
+
+
+@track_stage_timings
+async def chat_with_documents_stream_view(request):
+    """Async /chat_with_documents/stream (same Server-Sent Events as the Flask route)."""
+    data = await read_json(request)
+    if not data:
+        return JSONResponse({"message": "No JSON data provided"}, status_code=400)
+
+    project_id, user_email, query, conversation_id = chat_fields(data, project_required=False)
+    if not user_email or not query:
+        return JSONResponse({"message": "userEmail and query are required"}, status_code=400)
+
+    try:
+        documents, prompt, retrieval = await build_document_prompt_async(project_id, query, data)
+    except chat_with_documents.DocumentNotFound as e:
+        return JSONResponse({"message": f"Document not found: {e}"}, status_code=404)
+    except Exception as e:
+        print("Error building chat_with_documents prompt:", e)
+        return JSONResponse({"message": "Internal Server Error", "error": str(e)}, status_code=500)
+
+    async def generate():
+        cleaner = StreamingCleaner(chat_with_documents.clean_response_segment, fence_mode=FENCE_LINE)
+        parts = []
+        try:
+            async for text in stream_answer(prompt, cleaner, "chat_with_documents"):
+                parts.append(text)
+                yield sse_event("chunk", {"text": text})
+            answer = "".join(parts)
+            saved_id = await chat_with_documents.save_conversation_turn_async(
+                conversation_id, project_id, user_email, documents, query, answer
+            )
+            yield sse_event("done", {"answer": answer, "conversationId": saved_id, "retrieval": retrieval})
+        except GeminiUnavailable as e:
+            print("Error streaming chat_with_documents response:", e)
+            yield sse_event("error", {"message": "Service temporarily unavailable", "retryAfter": retry_after_seconds(e)})
+        except Exception as e:
+            print("Error streaming chat_with_documents response:", e)
+            yield sse_event("error", {"message": "Internal Server Error", "error": str(e)})
+
+    return StreamingResponse(generate(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Per-process startup of each uvicorn worker (indexes, analysis job recovery)."""
+    await run_in_threadpool(create_app)
+    yield
+
+
+async_app = Starlette(
+    lifespan=lifespan,
+    routes=[
+        Route("/chatbot", chatbot_view, methods=["POST"]),
+        Route("/chatbot/stream", chatbot_stream_view, methods=["POST"]),
+        Route("/chat_with_documents", chat_with_documents_view, methods=["POST"]),
+        Route("/chat_with_documents/stream", chat_with_documents_stream_view, methods=["POST"]),
+    ],
+    # Same CORS policy as run.py
+    middleware=[Middleware(
+        CORSMiddleware,
+        allow_origins=["http://localhost:3000"],
+        allow_credentials=True,
+        allow_headers=["Content-Type", "Authorization", "Cache-Control"],
+        expose_headers=["X-LLM-Cache", "X-LLM-Cache-Calls", "X-Coalesced", "Retry-After", "X-Stage-Timings"],
+        allow_methods=["GET", "POST", "DELETE", "OPTIONS"],
+    )],
+)
+
+wsgi_app = WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)
+
+ASYNC_ROUTES = {
+    ("POST", "/chatbot"),
+    ("POST", "/chatbot/stream"),
+    ("POST", "/chat_with_documents"),
+    ("POST", "/chat_with_documents/stream"),
+}
+
+
+def is_async_request(scope):
+    """True for requests served by the async views; uploads (multipart) stay on Flask."""
+    if (scope["method"], scope["path"]) not in ASYNC_ROUTES:
+        return False
+    if scope["path"] == "/chat_with_documents":
+        content_type = dict(scope["headers"]).get(b"content-type", b"")
+        return content_type.startswith(b"application/json")
+    return True
+
+
+async def app(scope, receive, send):
+    """Dispatch between the async chat views and the Flask app."""
+    if scope["type"] == "http" and not is_async_request(scope):
+        await wsgi_app(scope, receive, send)
+    else:
+        await async_app(scope, receive, send)
@@ -0,0 +1,110 @@
+# benchmark_json_extraction.py
+"""
+Compares json_extraction.extract_json_from_text with the regex fallback it replaced
+('\\{.*\\}' with DOTALL) on synthetic model outputs the size of real analysis and
+assignment responses. Usage:
+
+    python benchmark_json_extraction.py [--kb 60] [--repeat 20]
+"""
+import argparse
+import json
+import random
+import re
+import time
+from json_extraction import extract_json_from_text
+
+PHASES = ["Discovery", "Design", "Build", "Integration", "Testing", "Launch", "Support"]
+
+
+def legacy_extract(text):
+    """The fallback removed from app.py / task_assignment_automator.py."""
+    cleaned_text = re.sub(r'```(json)?|```', '', text)
+    match = re.search(r'(\{.*\})', cleaned_text, re.DOTALL)
+    if match:
+        try:
+            return json.loads(match.group(1))
+        except Exception:
+            return None
+    return None
+
+
+def prose(rng, size):
+    words = ["scope", "budget", "timeline", "risk", "team", "phase", "quality", "delivery", "{", "}", "\"quoted\""]
+    out = []
+    length = 0
+    while length < size:
+        sentence = " ".join(rng.choice(words) for _ in range(14)).capitalize() + ". "
+        out.append(sentence)
+        length += len(sentence)
+    return "".join(out)
+
+
+def analysis_object(rng, kb):
+    """A structured analysis padded with long text fields until it is about kb kilobytes."""
+    analysis = {
+        "suggestedTime": "6 months",
+        "suggestedBudget": 120000,
+        "riskAssessment": "",
+        "phases": [{"name": name, "details": ""} for name in PHASES],
+        "potentialRisks": [],
+        "sdlcMethodology": "Agile",
+    }
+    filler = max(1, kb * 1024 // (len(PHASES) + 2))
+    analysis["riskAssessment"] = prose(rng, filler).replace("{", "(").replace("}", ")")
+    for phase in analysis["phases"]:
+        phase["details"] = prose(rng, filler).replace("{", "(").replace("}", ")")
+    analysis["potentialRisks"] = [f"Risk {i}" for i in range(50)]
+    return analysis
+
+
+def cases(rng, kb):
+    """(name, text) pairs of realistic and defective outputs."""
+    body = json.dumps(analysis_object(rng, kb), indent=2)
+    intro = prose(rng, 400).replace("{", "").replace("}", "")
+    trailing_commas = body.replace("\n  ]", ",\n  ]").replace("\n}", ",\n}")
+    smart = body.replace('"suggestedTime"', "“suggestedTime”")
+    return [
+        ("clean", body),
+        ("fenced", "```json\n" + body + "\n```"),
+        ("prose_around", intro + "\n" + body + "\nLet me know if you need anything else {or more}."),
+        ("braces_in_prose", "Use {placeholders} like {this}. " + body + " Done {here}."),
+        ("trailing_commas", trailing_commas),
+        ("smart_quotes", smart),
+        ("truncated", body[: int(len(body) * 0.8)]),
+        # Opening braces without a match make the greedy regex rescan the rest of the text from each one.
+        ("unbalanced_braces", "{ " * 2000 + prose(rng, kb * 1024).replace("}", "")),
+    ]
+
+
+def timed(function, text, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = function(text)
+    return result, (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON extraction from model output.")
+    parser.add_argument("--kb", type=int, default=60, help="approximate size of each output in KB")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per case")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    rows = []
+    for name, text in cases(rng, args.kb):
+        legacy, legacy_ms = timed(legacy_extract, text, args.repeat)
+        current, current_ms = timed(extract_json_from_text, text, args.repeat)
+        rows.append({
+            "case": name,
+            "sizeKB": round(len(text) / 1024, 1),
+            "legacyParsed": isinstance(legacy, dict),
+            "legacyMs": round(legacy_ms, 2),
+            "parsed": isinstance(current, dict),
+            "ms": round(current_ms, 2),
+        })
+    print(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,98 +1,181 @@
-from flask import Blueprint, request, jsonify
-from pymongo import MongoClient
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from bson.objectid import ObjectId
-import os
-import json
 import re
-from datetime import datetime
-from dotenv import load_dotenv
-load_dotenv(".env.local")
-from google import genai
-import PyPDF2
+from resources import db, async_collection, gemini_client
+from project_context import get_project_context, get_raw_analysis_text, SECTION_RAW_ANALYSIS
+from prompt_builder import log_prompt_sizes
+from document_retrieval import BM25Index, retrieve_context, DOC_CONTEXT_TOKEN_BUDGET
+from document_store import save_document, load_document, latest_document_id, list_documents, delete_document
+from pdf_extraction import PdfLimitExceeded, spool_to_disk, remove_spooled, extract_text_from_pdf_file
+from upload_jobs import start_pdf_upload_job, get_upload_job
+from ttl_cache import TTLCache
+import hashlib
+from urllib.parse import quote
+from llm_cache import generate_text
+from gemini_gateway import GeminiUnavailable, gemini_gateway, retry_after_seconds, unavailable_response
+from metrics import metrics
+from conversation_store import AsyncConversationStore, ConversationStore, conversation_messages_response
+from streaming import StreamingCleaner, FENCE_LINE, SSE_HEADERS, sse_event
 
 chat_with_documents_bp = Blueprint('chat_with_documents', __name__)
 from flask_cors import CORS
 CORS(chat_with_documents_bp)
 
-# MongoDB configuration
-MONGO_URI = os.getenv("MONGO_URI")
-client_mongo = MongoClient(MONGO_URI)
-db = client_mongo["ProjectAutomation"]
-
 # Collections
-projects_collection = db["projects"]
-analysis_collection = db["analysis"]
-raw_collection = db["rawAnalysis"]
 conversation_collection = db["chatWithDocuments"]  # For doc-based chats
+conversation_buckets_collection = db["chatWithDocumentsBuckets"]  # Message buckets
 
-# Gemini API configuration
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-gemini_client = genai.Client(api_key=GEMINI_API_KEY)
+conversation_store = ConversationStore(conversation_collection, conversation_buckets_collection)
+# Same collections on the async driver, for the ASGI routes (asgi.py)
+async_conversation_store = AsyncConversationStore(
+    async_collection("chatWithDocuments"),
+    async_collection("chatWithDocumentsBuckets")
+)
 
-# In-memory storage for document text
-uploaded_documents = {}  # Example: {"global": "document text"}
+# Retrieval indexes over a project's raw analysis, keyed by (projectId, text hash)
+raw_analysis_indexes = TTLCache(64, 600)
 
-def extract_text_from_pdf(file_stream):
-    """Extract text from a PDF file using PyPDF2."""
-    reader = PyPDF2.PdfReader(file_stream)
-    text = ""
-    for page in reader.pages:
-        page_text = page.extract_text() or ""
-        text += page_text + "\n"
-    return text.strip()
+def clean_response_segment(text):
+    """Applies the clean_response substitutions without trimming whitespace (used when streaming)."""
+    cleaned = re.sub(r"```[\s\S]*?\n", "", text)  # remove code fence blocks
+    cleaned = re.sub(r"```", "", cleaned)
+    cleaned = re.sub(r"\*+", "", cleaned)         # remove extra asterisks
+    return cleaned
 
-def fetch_project_context(project_id):
+def clean_response(text):
     """
-    Fetch and merge context from projects, analysis, and rawAnalysis.
-    Returns a combined context string.
+    Cleans the raw response text from Gemini:
+    - Removes code fences, markdown, extra asterisks, etc.
     """
-    context_parts = []
-    try:
-        project = projects_collection.find_one({"_id": ObjectId(project_id)})
-    except Exception as e:
-        project = None
-
-    if project:
-        proj_copy = dict(project)
-        proj_copy.pop("_id", None)
-        context_parts.append("Project Details:\n" + json.dumps(proj_copy, default=str, indent=2))
-    
-    analysis = analysis_collection.find_one(
-        {"projectId": ObjectId(project_id)},
-        sort=[("analysisTimestamp", -1)]
+    return clean_response_segment(text).strip()
+
+def get_raw_analysis_index(project_id):
+    """BM25 index over the project's latest raw analysis (None if there is none)."""
+    raw_text = get_raw_analysis_text(project_id)
+    if not raw_text:
+        return None
+    key = (str(project_id), hashlib.sha1(raw_text.encode("utf-8")).hexdigest())
+    index = raw_analysis_indexes.get(key)
+    if index is None:
+        index = BM25Index(raw_text, source="rawAnalysis")
+        raw_analysis_indexes.set(key, index)
+    return index
+
+class DocumentNotFound(Exception):
+    """Raised when a chat references a document the user does not have."""
+
+def conversation_document_ids(conversation_id, user_email):
+    """documentIds stored on the user's conversation, as strings (None if it is not found)."""
+    if not conversation_id or not ObjectId.is_valid(conversation_id):
+        return None
+    conversation = conversation_collection.find_one(
+        {"_id": ObjectId(conversation_id), "userEmail": user_email},
+        {"documentIds": 1}
     )
-    if analysis and analysis.get("analysis"):
-        context_parts.append(
-            "Structured Analysis:\n" + json.dumps(analysis.get("analysis"), default=str, indent=2)
+    if conversation is None:
+        return None
+    return [str(document_id) for document_id in conversation.get("documentIds") or []]
+
+def resolve_documents(user_email, project_id, document_ids, conversation_id=None):
+    """
+    Load the documents a chat turn refers to. Without explicit documentIds, a follow-up turn
+    keeps the documents its conversation was started with; otherwise the user's most recent
+    upload for the project is used (if any). Documents must belong to the user and, when
+    project_id is given, to that project. Only the referenced documents are loaded.
+    """
+    with metrics.stage("mongo"):
+        if not document_ids:
+            document_ids = conversation_document_ids(conversation_id, user_email)
+        if not document_ids:
+            latest = latest_document_id(user_email, project_id)
+            document_ids = [latest] if latest else []
+        documents = []
+        for document_id in document_ids:
+            document = load_document(user_email, project_id, document_id)
+            if document is None:
+                raise DocumentNotFound(document_id)
+            documents.append(document)
+    return documents
+
+def requested_document_ids(data):
+    """documentIds (list) or documentId (string) from a chat payload."""
+    document_ids = data.get("documentIds") or []
+    if data.get("documentId"):
+        document_ids = [data.get("documentId")] + list(document_ids)
+    return document_ids
+
+def build_document_prompt(project_id, query, documents, context=None):
+    """
+    Combines the project context (empty if project not found) with the chunks of the
+    referenced documents and the raw analysis that are most relevant to the query.
+    `context` may be passed in when it was already fetched (see asgi.py).
+    Returns (prompt, retrieval details).
+    """
+    if context is None:
+        context = get_project_context(project_id, exclude=(SECTION_RAW_ANALYSIS,), endpoint="chat_with_documents")
+
+    # Append only the relevant excerpts instead of the whole documents and raw analysis
+    raw_analysis_index = get_raw_analysis_index(project_id)
+    with metrics.stage("retrieval"):
+        excerpts, retrieval = retrieve_context(
+            [document.index for document in documents] + [raw_analysis_index],
+            query
         )
-    
-    raw_analysis = raw_collection.find_one(
-        {"projectId": ObjectId(project_id)},
-        sort=[("createdAt", -1)]
+    if excerpts:
+        context += "\n\nRelevant Excerpts (uploaded documents and raw analysis):\n" + excerpts
+    excerpt_tokens = sum(item["tokens"] for item in retrieval)
+    log_prompt_sizes(
+        "chat_with_documents",
+        [{"section": "Relevant Excerpts", "tokens": excerpt_tokens, "sentTokens": excerpt_tokens}],
+        DOC_CONTEXT_TOKEN_BUDGET
     )
-    if raw_analysis and raw_analysis.get("rawAnalysis"):
-        context_parts.append("Raw Analysis:\n" + raw_analysis.get("rawAnalysis"))
-    
-    return "\n\n".join(context_parts)
 
-def clean_response(text):
+    # Construct prompt for Gemini
+    prompt = (
+        f"Project Context:\n{context}\n\n"
+        f"User Query: {query}\n\n"
+        "Answer:"
+    )
+    return prompt, retrieval
+
+def save_conversation_turn(conversation_id, project_id, user_email, documents, query, answer):
     """
-    Cleans the raw response text from Gemini:
-    - Removes code fences, markdown, extra asterisks, etc.
+    Appends a user/assistant turn to the conversation, creating the conversation if needed.
+    New conversations reference their documents' stored content by hash instead of copying it.
+    Returns the conversation id as a string.
     """
-    cleaned = re.sub(r"```[\s\S]*?\n", "", text)  # remove code fence blocks
-    cleaned = re.sub(r"```", "", cleaned)
-    cleaned = re.sub(r"\*+", "", cleaned)         # remove extra asterisks
-    return cleaned.strip()
+    return conversation_store.save_turn(
+        conversation_id, query, answer,
+        lambda: new_conversation_fields(project_id, user_email, documents)
+    )
+
+async def save_conversation_turn_async(conversation_id, project_id, user_email, documents, query, answer):
+    """save_conversation_turn on the async driver (ASGI routes)."""
+    return await async_conversation_store.save_turn(
+        conversation_id, query, answer,
+        lambda: new_conversation_fields(project_id, user_email, documents)
+    )
+
+def new_conversation_fields(project_id, user_email, documents):
+    """Fields of a new conversation; documents are referenced by id and content hash."""
+    return {
+        "projectId": ObjectId(project_id),
+        "userEmail": user_email,
+        "documentIds": [ObjectId(document.document_id) for document in documents],
+        "documentContentIds": [document.content_id for document in documents]
+    }
 
 @chat_with_documents_bp.route("/chat_with_documents", methods=["POST"])
 def chat_with_documents():
     """
     Handles:
-      1) Document upload (if a file is sent via multipart/form-data)
+      1) Document upload (if a file is sent via multipart/form-data with a 'userEmail'
+         field and optional 'projectId'). PDFs sent with async=true are extracted in the
+         background; the 202 response carries a jobId to poll.
       2) Chat with the document (if a JSON body with 'query' and 'userEmail' is provided)
       
-    If a projectId is not provided in the JSON payload, a new one is generated.
+    Chats use the documents named by 'documentId'/'documentIds', or else those of the
+    conversation ('conversationId'), or else the user's latest upload for the project. If a projectId is not provided in the JSON payload, a new one is generated.
     """
     try:
         # 1) If a file is uploaded, process it
@@ -101,20 +184,49 @@ def chat_with_documents():
             filename = file.filename.lower()
             if not filename:
                 return jsonify({"message": "No file selected"}), 400
+            upload_email = request.form.get("userEmail")
+            upload_project_id = request.form.get("projectId") or None
+            if not upload_email:
+                return jsonify({"message": "userEmail is required to upload a document"}), 400
 
             if filename.endswith(".pdf"):
-                document_text = extract_text_from_pdf(file)
+                # Spool to disk, then extract page batches in parallel worker processes.
+                try:
+                    pdf_path = spool_to_disk(file.stream)
+                except PdfLimitExceeded as e:
+                    return jsonify({"message": str(e)}), 413
+                if request.form.get("async", "").lower() in ("1", "true", "yes"):
+                    try:
+                        job_id = start_pdf_upload_job(pdf_path, filename, upload_email, upload_project_id)
+                    except Exception:
+                        # The job removes the spooled file when it ends; it never started.
+                        remove_spooled(pdf_path)
+                        raise
+                    return jsonify({
+                        "message": f"File '{filename}' is being processed",
+                        "jobId": job_id,
+                        "statusUrl": f"/chat_with_documents/uploads/{job_id}?userEmail={quote(upload_email)}"
+                    }), 202
+                try:
+                    with metrics.stage("pdf_extract"):
+                        document_text = extract_text_from_pdf_file(pdf_path)
+                except PdfLimitExceeded as e:
+                    return jsonify({"message": str(e)}), 413
+                finally:
+                    remove_spooled(pdf_path)
             elif filename.endswith(".txt"):
                 document_text = file.read().decode("utf-8", errors="ignore")
             else:
                 return jsonify({"message": "Unsupported file type (only PDF or TXT)"}), 400
 
-            # For demonstration, store in memory
-            uploaded_documents["global"] = document_text
+            with metrics.stage("mongo"):
+                document = save_document(upload_email, upload_project_id, filename, document_text)
 
             return jsonify({
                 "message": f"File '{filename}' processed successfully!",
-                "documentLength": len(document_text)
+                "documentId": document.document_id,
+                "documentLength": len(document_text),
+                "chunkCount": len(document.index.chunks)
             }), 200
 
         # 2) Otherwise, process JSON-based chat request
@@ -131,64 +243,150 @@ def chat_with_documents():
         if not user_email or not query:
             return jsonify({"message": "userEmail and query are required"}), 400
 
-        # Fetch project context if available (empty if project not found)
-        context = fetch_project_context(project_id)
-        
-        # Append document text if available
-        doc_text = uploaded_documents.get("global", "")
-        if doc_text:
-            context += "\n\nDocument Content:\n" + doc_text
-
-        # Construct prompt for Gemini
-        prompt = (
-            f"Project Context:\n{context}\n\n"
-            f"User Query: {query}\n\n"
-            "Answer:"
-        )
+        try:
+            documents = resolve_documents(user_email, data.get("projectId"), requested_document_ids(data), conversation_id)
+        except DocumentNotFound as e:
+            return jsonify({"message": f"Document not found: {e}"}), 404
+
+        prompt, retrieval = build_document_prompt(project_id, query, documents)
 
-        response = gemini_client.models.generate_content(
+        raw_answer = generate_text(
+            gemini_client,
             model="gemini-2.0-flash",
             contents=prompt,
+            endpoint="chat_with_documents",
         )
-        raw_answer = response.text
         answer = clean_response(raw_answer)
 
-        # Prepare conversation log entries
-        query_entry = {
-            "timestamp": datetime.utcnow(),
-            "role": "user",
-            "message": query
-        }
-        answer_entry = {
-            "timestamp": datetime.utcnow(),
-            "role": "assistant",
-            "message": answer
-        }
-
-        # If conversationId exists, update; otherwise, create a new conversation document.
-        if conversation_id:
-            conv_id = ObjectId(conversation_id)
-            conversation_collection.update_one(
-                {"_id": conv_id},
-                {"$push": {"messages": {"$each": [query_entry, answer_entry]}}}
-            )
-        else:
-            conversation_doc = {
-                "projectId": ObjectId(project_id),
-                "userEmail": user_email,
-                "documentContent": doc_text,
-                "messages": [query_entry, answer_entry],
-                "createdAt": datetime.utcnow()
-            }
-            conv_result = conversation_collection.insert_one(conversation_doc)
-            conversation_id = str(conv_result.inserted_id)
+        conversation_id = save_conversation_turn(conversation_id, project_id, user_email, documents, query, answer)
 
         return jsonify({
             "message": "Query processed successfully",
             "answer": answer,
-            "conversationId": conversation_id
+            "conversationId": conversation_id,
+            "retrieval": retrieval
         }), 200
 
+    except GeminiUnavailable as e:
+        print("Gemini unavailable:", e)
+        return unavailable_response(e)
     except Exception as e:
         print("Error in chat_with_documents:", e)
         return jsonify({"message": "Internal Server Error", "error": str(e)}), 500
+
+@chat_with_documents_bp.route("/chat_with_documents/stream", methods=["POST"])
+def chat_with_documents_stream():
+    """
+    Streaming variant of the JSON chat path of /chat_with_documents (same payload).
+    Responds with Server-Sent Events:
+      - "chunk": {"text": ...} cleaned answer text as it is generated
+      - "done":  {"answer": ..., "conversationId": ..., "retrieval": [...]} once the conversation is stored
+      - "error": {"message": ...} if generation or storage fails mid-stream
+    Document uploads still go through /chat_with_documents.
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"message": "No JSON data provided"}), 400
+
+    # If no projectId is provided, generate a new one.
+    project_id = data.get("projectId") or str(ObjectId())
+    user_email = data.get("userEmail")
+    query = data.get("query")
+    conversation_id = data.get("conversationId")
+
+    if not user_email or not query:
+        return jsonify({"message": "userEmail and query are required"}), 400
+
+    try:
+        documents = resolve_documents(user_email, data.get("projectId"), requested_document_ids(data), conversation_id)
+        prompt, retrieval = build_document_prompt(project_id, query, documents)
+    except DocumentNotFound as e:
+        return jsonify({"message": f"Document not found: {e}"}), 404
+    except Exception as e:
+        print("Error building chat_with_documents prompt:", e)
+        return jsonify({"message": "Internal Server Error", "error": str(e)}), 500
+
+    def generate():
+        cleaner = StreamingCleaner(clean_response_segment, fence_mode=FENCE_LINE)
+        parts = []
+        try:
+            for chunk in gemini_gateway.generate_content_stream(
+                gemini_client,
+                model="gemini-2.0-flash",
+                contents=prompt,
+                endpoint="chat_with_documents",
+            ):
+                text = cleaner.feed(chunk.text or "")
+                if text:
+                    parts.append(text)
+                    yield sse_event("chunk", {"text": text})
+            text = cleaner.finish()
+            if text:
+                parts.append(text)
+                yield sse_event("chunk", {"text": text})
+
+            answer = "".join(parts)
+            saved_id = save_conversation_turn(conversation_id, project_id, user_email, documents, query, answer)
+            yield sse_event("done", {"answer": answer, "conversationId": saved_id, "retrieval": retrieval})
+        except GeminiUnavailable as e:
+            print("Error streaming chat_with_documents response:", e)
+            yield sse_event("error", {"message": "Service temporarily unavailable", "retryAfter": retry_after_seconds(e)})
+        except Exception as e:
+            print("Error streaming chat_with_documents response:", e)
+            yield sse_event("error", {"message": "Internal Server Error", "error": str(e)})
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=SSE_HEADERS)
+
+@chat_with_documents_bp.route("/chat_with_documents/documents", methods=["GET"])
+def chat_with_documents_list():
+    """Lists a user's uploaded documents (query params: userEmail, optional projectId)."""
+    try:
+        user_email = request.args.get("userEmail")
+        if not user_email:
+            return jsonify({"message": "userEmail is required"}), 400
+        documents = list_documents(user_email, request.args.get("projectId") or None)
+        return jsonify({"documents": documents}), 200
+    except Exception as e:
+        print("Error listing documents:", e)
+        return jsonify({"message": "Internal Server Error", "error": str(e)}), 500
+
+@chat_with_documents_bp.route("/chat_with_documents/documents/<document_id>", methods=["DELETE"])
+def chat_with_documents_delete(document_id):
+    """Deletes one of a user's uploaded documents (query param: userEmail)."""
+    try:
+        user_email = request.args.get("userEmail")
+        if not user_email:
+            return jsonify({"message": "userEmail is required"}), 400
+        if not delete_document(user_email, None, document_id):
+            return jsonify({"message": "Document not found"}), 404
+        return jsonify({"message": "Document deleted", "documentId": document_id}), 200
+    except Exception as e:
+        print("Error deleting document:", e)
+        return jsonify({"message": "Internal Server Error", "error": str(e)}), 500
+
+@chat_with_documents_bp.route("/chat_with_documents/uploads/<job_id>", methods=["GET"])
+def chat_with_documents_upload_status(job_id):
+    """Reports progress (pagesDone/pageCount) and the resulting documentId of an async PDF upload."""
+    try:
+        user_email = request.args.get("userEmail")
+        if not user_email:
+            return jsonify({"message": "userEmail is required"}), 400
+        job = get_upload_job(job_id, user_email)
+        if not job:
+            return jsonify({"message": "Upload job not found"}), 404
+        return jsonify(job), 200
+    except Exception as e:
+        print("Error fetching upload job:", e)
+        return jsonify({"message": "Internal Server Error", "error": str(e)}), 500
+
+@chat_with_documents_bp.route("/chat_with_documents/conversations/<conversation_id>/messages", methods=["GET"])
+def chat_with_documents_conversation_messages(conversation_id):
+    """
+    Returns the most recent messages of a conversation, oldest first.
+    Query params: userEmail (required), limit (default 20), before (cursor from a previous page).
+    """
+    try:
+        return conversation_messages_response(conversation_store, conversation_id)
+    except Exception as e:
+        print("Error fetching chat_with_documents messages:", e)
+        return jsonify({"message": "Internal Server Error", "error": str(e)}), 500
@@ -1,60 +1,47 @@
 # chatbot.py
-from flask import Blueprint, request, jsonify
-from pymongo import MongoClient
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from bson.objectid import ObjectId
-import os
-import json
 import re
-from datetime import datetime
-from dotenv import load_dotenv
-load_dotenv(".env.local")
-from google import genai
+from resources import db, async_collection, gemini_client
+from project_context import get_project_context
+from llm_cache import generate_text
+from gemini_gateway import GeminiUnavailable, gemini_gateway, retry_after_seconds, unavailable_response
+from conversation_store import AsyncConversationStore, ConversationStore, conversation_messages_response
+from streaming import StreamingCleaner, FENCE_BLOCK, SSE_HEADERS, sse_event
 
 chatbot_bp = Blueprint('chatbot', __name__)
 
-# MongoDB configuration: using your ProjectAutomation database
-MONGO_URI = os.getenv("MONGO_URI")
-client_mongo = MongoClient(MONGO_URI)
-db = client_mongo["ProjectAutomation"]
-
 # Collections for storing documents
-projects_collection = db["projects"]
-analysis_collection = db["analysis"]
-raw_collection = db["rawAnalysis"]
 conversation_collection = db["chatbotConversation"]
+conversation_buckets_collection = db["chatbotConversationBuckets"]  # Message buckets
 
-# Google Gemini API configuration
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-gemini_client = genai.Client(api_key=GEMINI_API_KEY)
+conversation_store = ConversationStore(conversation_collection, conversation_buckets_collection)
+# Same collections on the async driver, for the ASGI routes (asgi.py)
+async_conversation_store = AsyncConversationStore(
+    async_collection("chatbotConversation"),
+    async_collection("chatbotConversationBuckets")
+)
 
-def fetch_project_context(project_id):
+def clean_response_segment(text):
     """
-    Fetch and merge data from the projects, analysis, and rawAnalysis collections.
-    Returns a combined context string for the project.
+    Applies the clean_response substitutions without trimming whitespace.
+    Used directly by the streaming route, which sees the answer in pieces.
     """
-    context_parts = []
+    # 1) Remove disclaimers (common pattern: "disclaimer: ...")
+    cleaned = re.sub(r"(disclaimer:.*?)(?=\n|$)", "", text, flags=re.IGNORECASE)
 
-    project = projects_collection.find_one({"_id": ObjectId(project_id)})
-    if project:
-        proj_copy = dict(project)
-        proj_copy.pop("_id", None)
-        context_parts.append("Project Details:\n" + json.dumps(proj_copy, default=str, indent=2))
-    
-    analysis = analysis_collection.find_one(
-        {"projectId": ObjectId(project_id)},
-        sort=[("analysisTimestamp", -1)]
-    )
-    if analysis and analysis.get("analysis"):
-        context_parts.append("Structured Analysis:\n" + json.dumps(analysis.get("analysis"), default=str, indent=2))
-    
-    raw_analysis = raw_collection.find_one(
-        {"projectId": ObjectId(project_id)},
-        sort=[("createdAt", -1)]
-    )
-    if raw_analysis and raw_analysis.get("rawAnalysis"):
-        context_parts.append("Raw Analysis:\n" + raw_analysis.get("rawAnalysis"))
-    
-    return "\n\n".join(context_parts)
+    # 2) Remove triple backticks and code fences
+    cleaned = re.sub(r"```[\s\S]*?```", "", cleaned)  # block fences
+    cleaned = re.sub(r"`+", "", cleaned)              # single or triple backticks
+
+    # 3) Remove double-asterisks (often used for bold in Markdown)
+    cleaned = re.sub(r"\*\*", "", cleaned)
+
+    # 4) Remove leftover repeated asterisks if they appear
+    #    (this is optional—only do this if you're sure you don't want bullet asterisks)
+    cleaned = re.sub(r"\*{2,}", "", cleaned)
+
+    return cleaned
 
 def clean_response(text):
     """
@@ -65,24 +52,41 @@ def clean_response(text):
     4. Remove repeated asterisks.
     5. Strip leading/trailing whitespace.
     """
-    # 1) Remove disclaimers (common pattern: "disclaimer: ...")
-    cleaned = re.sub(r"(disclaimer:.*?)(?=\n|$)", "", text, flags=re.IGNORECASE)
+    return clean_response_segment(text).strip()
 
-    # 2) Remove triple backticks and code fences
-    cleaned = re.sub(r"```[\s\S]*?```", "", cleaned)  # block fences
-    cleaned = re.sub(r"`+", "", cleaned)              # single or triple backticks
+def build_chatbot_prompt(context, query):
+    """Construct a stricter prompt to guide formatting."""
+    return f"""
+You are a helpful AI assistant that responds in a clean, concise, well-formatted text.
+Please do not include triple backticks or disclaimers. 
+Use headings, bullet points, or short paragraphs as needed. 
+Avoid excessive asterisks or markdown fences.
 
-    # 3) Remove double-asterisks (often used for bold in Markdown)
-    cleaned = re.sub(r"\*\*", "", cleaned)
+Project Context:
+{context}
 
-    # 4) Remove leftover repeated asterisks if they appear
-    #    (this is optional—only do this if you're sure you don't want bullet asterisks)
-    cleaned = re.sub(r"\*{2,}", "", cleaned)
+User Query:
+{query}
 
-    # 5) Trim whitespace
-    cleaned = cleaned.strip()
+Answer:
+"""
 
-    return cleaned
+def save_conversation_turn(conversation_id, project_id, user_email, query, answer):
+    """
+    Appends a user/assistant turn to the conversation, creating the conversation if needed.
+    Returns the conversation id as a string.
+    """
+    return conversation_store.save_turn(
+        conversation_id, query, answer,
+        lambda: {"projectId": ObjectId(project_id), "userEmail": user_email}
+    )
+
+async def save_conversation_turn_async(conversation_id, project_id, user_email, query, answer):
+    """save_conversation_turn on the async driver (ASGI routes)."""
+    return await async_conversation_store.save_turn(
+        conversation_id, query, answer,
+        lambda: {"projectId": ObjectId(project_id), "userEmail": user_email}
+    )
 
 @chatbot_bp.route("/chatbot", methods=["POST"])
 def chatbot():
@@ -112,61 +116,21 @@ def chatbot():
             return jsonify({"message": "projectId, userEmail, and query are required"}), 400
 
         # Fetch combined project context.
-        context = fetch_project_context(project_id)
-
-        # Construct a stricter prompt to guide formatting:
-        prompt = f"""
-You are a helpful AI assistant that responds in a clean, concise, well-formatted text.
-Please do not include triple backticks or disclaimers. 
-Use headings, bullet points, or short paragraphs as needed. 
-Avoid excessive asterisks or markdown fences.
-
-Project Context:
-{context}
-
-User Query:
-{query}
+        context = get_project_context(project_id, endpoint="chatbot")
 
-Answer:
-"""
+        prompt = build_chatbot_prompt(context, query)
 
         # Call Gemini API.
-        response = gemini_client.models.generate_content(
+        raw_answer = generate_text(
+            gemini_client,
             model="gemini-2.0-flash",
             contents=prompt,
+            endpoint="chatbot",
         )
         # Clean the answer to remove any extraneous delimiters, disclaimers, etc.
-        raw_answer = response.text
         answer = clean_response(raw_answer)
 
-        # Prepare conversation entries.
-        query_entry = {
-            "timestamp": datetime.utcnow(),
-            "role": "user",
-            "message": query
-        }
-        answer_entry = {
-            "timestamp": datetime.utcnow(),
-            "role": "assistant",
-            "message": answer
-        }
-
-        # Save conversation history.
-        if conversation_id:
-            conv_id = ObjectId(conversation_id)
-            conversation_collection.update_one(
-                {"_id": conv_id},
-                {"$push": {"messages": {"$each": [query_entry, answer_entry]}}}
-            )
-        else:
-            conversation_doc = {
-                "projectId": ObjectId(project_id),
-                "userEmail": user_email,
-                "messages": [query_entry, answer_entry],
-                "createdAt": datetime.utcnow()
-            }
-            conv_result = conversation_collection.insert_one(conversation_doc)
-            conversation_id = str(conv_result.inserted_id)
+        conversation_id = save_conversation_turn(conversation_id, project_id, user_email, query, answer)
 
         return jsonify({
             "message": "Query processed successfully",
@@ -174,6 +138,80 @@ Answer:
             "conversationId": conversation_id
         }), 200
 
+    except GeminiUnavailable as e:
+        print("Gemini unavailable:", e)
+        return unavailable_response(e)
     except Exception as e:
         print("Error processing chatbot query:", e)
         return jsonify({"message": "Internal Server Error"}), 500
+
+@chatbot_bp.route("/chatbot/stream", methods=["POST"])
+def chatbot_stream():
+    """
+    Streaming variant of /chatbot (same JSON payload).
+    Responds with Server-Sent Events:
+      - "chunk": {"text": ...} cleaned answer text as it is generated
+      - "done":  {"answer": ..., "conversationId": ...} once the conversation is stored
+      - "error": {"message": ...} if generation or storage fails mid-stream
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"message": "No data provided"}), 400
+
+    project_id = data.get("projectId")
+    user_email = data.get("userEmail")
+    query = data.get("query")
+    conversation_id = data.get("conversationId")  # Optional
+
+    if not project_id or not user_email or not query:
+        return jsonify({"message": "projectId, userEmail, and query are required"}), 400
+
+    try:
+        context = get_project_context(project_id, endpoint="chatbot")
+    except Exception as e:
+        print("Error fetching chatbot context:", e)
+        return jsonify({"message": "Internal Server Error"}), 500
+    prompt = build_chatbot_prompt(context, query)
+
+    def generate():
+        cleaner = StreamingCleaner(clean_response_segment, fence_mode=FENCE_BLOCK, line_patterns=[r"disclaimer:"])
+        parts = []
+        try:
+            for chunk in gemini_gateway.generate_content_stream(
+                gemini_client,
+                model="gemini-2.0-flash",
+                contents=prompt,
+                endpoint="chatbot",
+            ):
+                text = cleaner.feed(chunk.text or "")
+                if text:
+                    parts.append(text)
+                    yield sse_event("chunk", {"text": text})
+            text = cleaner.finish()
+            if text:
+                parts.append(text)
+                yield sse_event("chunk", {"text": text})
+
+            answer = "".join(parts)
+            saved_id = save_conversation_turn(conversation_id, project_id, user_email, query, answer)
+            yield sse_event("done", {"answer": answer, "conversationId": saved_id})
+        except GeminiUnavailable as e:
+            print("Error streaming chatbot response:", e)
+            yield sse_event("error", {"message": "Service temporarily unavailable", "retryAfter": retry_after_seconds(e)})
+        except Exception as e:
+            print("Error streaming chatbot response:", e)
+            yield sse_event("error", {"message": "Internal Server Error"})
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=SSE_HEADERS)
+
+@chatbot_bp.route("/chatbot/conversations/<conversation_id>/messages", methods=["GET"])
+def chatbot_conversation_messages(conversation_id):
+    """
+    Returns the most recent messages of a conversation, oldest first.
+    Query params: userEmail (required), limit (default 20), before (cursor from a previous page).
+    """
+    try:
+        return conversation_messages_response(conversation_store, conversation_id)
+    except Exception as e:
+        print("Error fetching chatbot messages:", e)
+        return jsonify({"message": "Internal Server Error"}), 500
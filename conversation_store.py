@@ -0,0 +1,273 @@
+# conversation_store.py
+from flask import jsonify, request
+from pymongo import ReturnDocument
+from bson.objectid import ObjectId
+from datetime import datetime
+import os
+from metrics import metrics
+
+# Messages per bucket document
+CONVERSATION_BUCKET_SIZE = int(os.getenv("CONVERSATION_BUCKET_SIZE", "50"))
+CONVERSATION_PAGE_MAX = 200
+
+
+class ConversationStore:
+    """
+    Conversation history split into fixed-size message buckets.
+
+    The conversation document only holds metadata and a messageCount; every message gets a
+    sequence number and is pushed into bucket seq // bucket_size of the buckets collection,
+    so an append costs the same no matter how long the conversation is.
+    Conversations written before bucketing keep their embedded 'messages' array; those
+    messages are numbered 0..legacyMessageCount-1 and are read from the array.
+    """
+
+    def __init__(self, conversations, buckets, bucket_size=CONVERSATION_BUCKET_SIZE):
+        self.conversations = conversations
+        self.buckets = buckets
+        self.bucket_size = bucket_size
+
+    def _bucket_push(self, conversation_id, start_seq, entries):
+        """(filter, update) that adds entries, numbered from start_seq, to their bucket."""
+        messages = [dict(entry, seq=start_seq + i) for i, entry in enumerate(entries)]
+        return (
+            {"conversationId": conversation_id, "bucket": start_seq // self.bucket_size},
+            {
+                "$push": {"messages": {"$each": messages}},
+                "$inc": {"count": len(messages)},
+                "$setOnInsert": {"createdAt": datetime.utcnow()}
+            }
+        )
+
+    @staticmethod
+    def _new_conversation(fields, entries):
+        now = datetime.utcnow()
+        return dict(fields, messageCount=len(entries), legacyMessageCount=0, createdAt=now, updatedAt=now)
+
+    @staticmethod
+    def _reserve(count):
+        """Pipeline update that reserves `count` sequence numbers (initializing legacy conversations)."""
+        legacy_count = {"$size": {"$ifNull": ["$messages", []]}}
+        return [{"$set": {
+            "legacyMessageCount": {"$ifNull": ["$legacyMessageCount", legacy_count]},
+            "messageCount": {"$add": [{"$ifNull": ["$messageCount", legacy_count]}, count]},
+            "updatedAt": datetime.utcnow()
+        }}]
+
+    def _push(self, conversation_id, start_seq, entries):
+        self.buckets.update_one(*self._bucket_push(conversation_id, start_seq, entries), upsert=True)
+
+    def create(self, fields, entries):
+        """
+        Create a conversation with its first messages. Returns the new id as a string.
+        The first bucket is written before the conversation document, so a conversation is
+        never visible without its messages (a failed insert leaves only an unreachable bucket).
+        """
+        conversation_id = ObjectId()
+        self._push(conversation_id, 0, entries)
+        self.conversations.insert_one(dict(self._new_conversation(fields, entries), _id=conversation_id))
+        return str(conversation_id)
+
+    def append(self, conversation_id, entries):
+        """
+        Append messages to a conversation (no-op for an unknown id).
+        One counter update reserves the sequence numbers, one upsert pushes into the bucket
+        (creating it if it does not exist yet).
+        """
+        conv_id = ObjectId(conversation_id)
+        conversation = self.conversations.find_one_and_update(
+            {"_id": conv_id},
+            self._reserve(len(entries)),
+            projection={"messageCount": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if conversation is None:
+            return
+        self._push(conv_id, conversation["messageCount"] - len(entries), entries)
+
+    def save_turn(self, conversation_id, query, answer, new_fields):
+        """
+        Append a user/assistant turn to the conversation, or create one from new_fields()
+        when there is no conversation_id yet. Returns the conversation id as a string.
+        """
+        entries = conversation_turn(query, answer)
+        with metrics.stage("mongo"):
+            if conversation_id:
+                self.append(conversation_id, entries)
+                return conversation_id
+            return self.create(new_fields(), entries)
+
+    # History reads (the GET routes are served by Flask, so only the sync store reads).
+
+    @staticmethod
+    def _counts_pipeline(conv_id, user_email):
+        return [
+            {"$match": {"_id": conv_id, "userEmail": user_email}},
+            {"$project": {
+                "legacy": {"$ifNull": ["$legacyMessageCount", {"$size": {"$ifNull": ["$messages", []]}}]},
+                "total": "$messageCount"
+            }}
+        ]
+
+    @staticmethod
+    def _counts_from_rows(rows):
+        """(messageCount, legacyMessageCount) of a conversation, or None if it is not the user's."""
+        if not rows:
+            return None
+        legacy = rows[0]["legacy"]
+        total = rows[0].get("total")
+        return (total if total is not None else legacy), legacy
+
+    def _counts(self, conv_id, user_email):
+        return self._counts_from_rows(list(self.conversations.aggregate(self._counts_pipeline(conv_id, user_email))))
+
+    def _buckets_query(self, conv_id, end):
+        """(filter, projection) of the buckets holding messages with seq < end."""
+        return (
+            {"conversationId": conv_id, "bucket": {"$lte": (end - 1) // self.bucket_size}},
+            {"messages": 1}
+        )
+
+    @staticmethod
+    def _add_bucket(messages, bucket, end, limit):
+        """Prepend the messages of a bucket (read newest bucket first) with seq < end, up to limit."""
+        in_range = sorted((m for m in bucket.get("messages", []) if m["seq"] < end), key=lambda m: m["seq"])
+        return in_range[-(limit - len(messages)):] + messages
+
+    @staticmethod
+    def _legacy_range(messages, end, legacy, limit):
+        """(start, count) of the embedded legacy messages still needed, or None."""
+        if len(messages) >= limit or legacy <= 0:
+            return None
+        legacy_end = min(end, legacy) if not messages else min(messages[0]["seq"], legacy)
+        count = min(limit - len(messages), legacy_end)
+        return (legacy_end - count, count) if count > 0 else None
+
+    @staticmethod
+    def _page(messages, doc=None, start=0):
+        """(messages, next_cursor), with the legacy messages of `doc` from `start` prepended."""
+        if doc is not None:
+            messages = [dict(m, seq=start + i) for i, m in enumerate(doc.get("messages", []))] + messages
+        next_cursor = messages[0]["seq"] if messages and messages[0]["seq"] > 0 else None
+        return messages, next_cursor
+
+    def recent(self, conversation_id, user_email, limit=20, before=None):
+        """
+        Up to `limit` messages with seq < before (default: the newest), oldest first.
+        Returns (messages, next_cursor) where next_cursor is the `before` value for the
+        previous page, or None when the start of the conversation has been reached.
+        Returns None if the conversation does not exist or belongs to another user.
+        """
+        conv_id = ObjectId(conversation_id)
+        counts = self._counts(conv_id, user_email)
+        if counts is None:
+            return None
+        total, legacy = counts
+        limit = max(1, min(limit, CONVERSATION_PAGE_MAX))
+        end = total if before is None else max(0, min(before, total))
+
+        messages = []
+        if end > legacy:
+            for bucket in self.buckets.find(*self._buckets_query(conv_id, end)).sort("bucket", -1):
+                messages = self._add_bucket(messages, bucket, end, limit)
+                if len(messages) >= limit:
+                    break
+
+        legacy_range = self._legacy_range(messages, end, legacy, limit)
+        if legacy_range is None:
+            return self._page(messages)
+        start, count = legacy_range
+        doc = self.conversations.find_one({"_id": conv_id}, {"messages": {"$slice": [start, count]}})
+        return self._page(messages, doc, start)
+
+
+class AsyncConversationStore(ConversationStore):
+    """
+    ConversationStore on async (AsyncMongoClient) collections, for the ASGI chat routes.
+    Same document layout; only the write path (create / append / save_turn) is provided,
+    as coroutines. History is read through the sync ConversationStore.
+    """
+
+    async def _push(self, conversation_id, start_seq, entries):
+        await self.buckets.update_one(*self._bucket_push(conversation_id, start_seq, entries), upsert=True)
+
+    async def create(self, fields, entries):
+        conversation_id = ObjectId()
+        await self._push(conversation_id, 0, entries)
+        await self.conversations.insert_one(dict(self._new_conversation(fields, entries), _id=conversation_id))
+        return str(conversation_id)
+
+    async def append(self, conversation_id, entries):
+        conv_id = ObjectId(conversation_id)
+        conversation = await self.conversations.find_one_and_update(
+            {"_id": conv_id},
+            self._reserve(len(entries)),
+            projection={"messageCount": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if conversation is None:
+            return
+        await self._push(conv_id, conversation["messageCount"] - len(entries), entries)
+
+    async def save_turn(self, conversation_id, query, answer, new_fields):
+        entries = conversation_turn(query, answer)
+        with metrics.stage("mongo"):
+            if conversation_id:
+                await self.append(conversation_id, entries)
+                return conversation_id
+            return await self.create(new_fields(), entries)
+
+
+def conversation_turn(query, answer):
+    """Conversation entries for one user/assistant turn."""
+    query_entry = {
+        "timestamp": datetime.utcnow(),
+        "role": "user",
+        "message": query
+    }
+    answer_entry = {
+        "timestamp": datetime.utcnow(),
+        "role": "assistant",
+        "message": answer
+    }
+    return [query_entry, answer_entry]
+
+
+def serialize_messages(messages):
+    """JSON shape of stored messages for the history endpoints."""
+    return [
+        {
+            "seq": m.get("seq"),
+            "role": m.get("role"),
+            "message": m.get("message"),
+            "timestamp": m["timestamp"].isoformat() + "Z" if isinstance(m.get("timestamp"), datetime) else m.get("timestamp")
+        }
+        for m in messages
+    ]
+
+
+def conversation_messages_response(store, conversation_id):
+    """
+    Body of the GET .../conversations/<conversation_id>/messages routes: the most recent
+    messages, oldest first. Query params: userEmail (required), limit (default 20),
+    before (cursor from a previous page).
+    """
+    user_email = request.args.get("userEmail")
+    if not user_email:
+        return jsonify({"message": "userEmail is required"}), 400
+    if not ObjectId.is_valid(conversation_id):
+        return jsonify({"message": "Invalid conversation id"}), 400
+    limit = request.args.get("limit", 20, type=int)
+    before = request.args.get("before", None, type=int)
+    with metrics.stage("mongo"):
+        page = store.recent(conversation_id, user_email, limit, before)
+    if page is None:
+        return jsonify({"message": "Conversation not found"}), 404
+    messages, next_cursor = page
+    with metrics.stage("serialize"):
+        response = jsonify({
+            "conversationId": conversation_id,
+            "messages": serialize_messages(messages),
+            "nextCursor": next_cursor
+        })
+    return response, 200
@@ -0,0 +1,110 @@
+# dedupe_documents.py
+"""
+Backfill and garbage collection for content-addressed document storage.
+
+  1. Conversations in chatWithDocuments that still embed their document text in
+     'documentContent' get it replaced by a 'documentContentIds' reference.
+  2. Contents that no upload or conversation references any more, and that have not been
+     used for the grace period, are deleted (delete_document only removes the record).
+
+Each distinct text is stored once. Usage:
+
+    python dedupe_documents.py [--dry-run] [--grace-seconds N]
+"""
+import argparse
+import json
+import os
+from datetime import datetime, timedelta
+from document_store import (
+    db, content_hash, store_content, content_in_use, content_files_collection,
+    conversations_collection, CONTENT_BUCKET
+)
+
+# Unreferenced contents are kept this long after their last use, so a save that found the
+# content just before its record was deleted elsewhere can still insert its own record
+CONTENT_GC_GRACE_SECONDS = int(os.getenv("CONTENT_GC_GRACE_SECONDS", "3600"))
+
+
+def _is_stored(content_id, seen):
+    return content_id in seen or content_files_collection.find_one({"_id": content_id}, {"_id": 1}) is not None
+
+
+def migrate_conversations(dry_run, seen, report):
+    cursor = conversations_collection.find(
+        {"documentContent": {"$exists": True}},
+        {"documentContent": 1},
+        batch_size=50
+    )
+    for conversation in cursor:
+        text = conversation.get("documentContent") or ""
+        size = len(text.encode("utf-8"))
+        report["conversationsMigrated"] += 1
+        report["bytesBefore"] += size
+
+        content_ids = []
+        if text:
+            content_id = content_hash(text)
+            if dry_run:
+                created = not _is_stored(content_id, seen)
+            else:
+                content_id, created = store_content(text)
+            if created:
+                report["bytesAfter"] += size
+                report["contentsStored"] += 1
+            seen.add(content_id)
+            content_ids.append(content_id)
+
+        if not dry_run:
+            conversations_collection.update_one(
+                {"_id": conversation["_id"]},
+                {"$set": {"documentContentIds": content_ids}, "$unset": {"documentContent": ""}}
+            )
+
+
+def collect_unreferenced_contents(dry_run, grace_seconds, report):
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    # store_content sets lastUsedAt whenever it reuses content; contents stored before that
+    # field existed have none and are only kept while referenced.
+    stale = {"$or": [
+        {"metadata.lastUsedAt": {"$lt": cutoff}},
+        {"metadata.lastUsedAt": {"$exists": False}}
+    ]}
+    chunks_collection = db[f"{CONTENT_BUCKET}.chunks"]
+    for file_doc in content_files_collection.find(stale, {"_id": 1, "length": 1}, batch_size=50):
+        content_id = file_doc["_id"]
+        if content_in_use(content_id):
+            continue
+        if not dry_run:
+            # Only delete if nothing touched the content since it was selected.
+            if content_files_collection.delete_one(dict(stale, _id=content_id)).deleted_count == 0:
+                continue
+            chunks_collection.delete_many({"files_id": content_id})
+        report["contentsDeleted"] += 1
+        report["bytesDeleted"] += file_doc.get("length", 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deduplicate stored document text by content hash.")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    parser.add_argument("--grace-seconds", type=int, default=CONTENT_GC_GRACE_SECONDS,
+                        help="keep unreferenced contents used within this many seconds")
+    args = parser.parse_args()
+
+    report = {
+        "dryRun": args.dry_run,
+        "conversationsMigrated": 0,
+        "contentsStored": 0,
+        "bytesBefore": 0,
+        "bytesAfter": 0,
+        "contentsDeleted": 0,
+        "bytesDeleted": 0,
+    }
+    seen = set()
+    migrate_conversations(args.dry_run, seen, report)
+    collect_unreferenced_contents(args.dry_run, args.grace_seconds, report)
+    report["bytesReclaimed"] = report["bytesBefore"] - report["bytesAfter"]
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
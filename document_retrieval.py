@@ -0,0 +1,127 @@
+# document_retrieval.py
+from collections import Counter
+import math
+import os
+import re
+
+# Chunking and retrieval configuration
+DOC_CHUNK_WORDS = int(os.getenv("DOC_CHUNK_WORDS", "200"))
+DOC_CHUNK_OVERLAP_WORDS = int(os.getenv("DOC_CHUNK_OVERLAP_WORDS", "40"))
+DOC_RETRIEVAL_TOP_K = int(os.getenv("DOC_RETRIEVAL_TOP_K", "8"))
+DOC_CONTEXT_TOKEN_BUDGET = int(os.getenv("DOC_CONTEXT_TOKEN_BUDGET", "3000"))
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+WORD_PATTERN = re.compile(r"\S+")
+
+
+def tokenize(text):
+    """Lowercased alphanumeric terms used for indexing and querying."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def estimate_tokens(text):
+    """Rough model token count (about four characters per token)."""
+    return max(1, len(text) // 4)
+
+
+def chunk_text(text, chunk_words=DOC_CHUNK_WORDS, overlap_words=DOC_CHUNK_OVERLAP_WORDS):
+    """
+    Split text into overlapping windows of roughly chunk_words words.
+    Returns the chunks as strings, in document order.
+    """
+    words = WORD_PATTERN.findall(text)
+    if not words:
+        return []
+    step = max(1, chunk_words - overlap_words)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+
+class BM25Index:
+    """
+    Local lexical index over the chunks of one text. Built once (e.g. at upload time),
+    then queried per chat turn; needs no external service.
+    """
+
+    def __init__(self, text, source="document"):
+        self.source = source
+        self.chunks = chunk_text(text)
+        self.term_freqs = [Counter(tokenize(chunk)) for chunk in self.chunks]
+        self.lengths = [sum(tf.values()) for tf in self.term_freqs]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        doc_freq = Counter()
+        for tf in self.term_freqs:
+            doc_freq.update(tf.keys())
+        n = len(self.chunks)
+        self.idf = {
+            term: math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for term, df in doc_freq.items()
+        }
+
+    def score(self, query):
+        """BM25 score of every chunk for the query, as a list aligned with self.chunks."""
+        terms = [t for t in set(tokenize(query)) if t in self.idf]
+        scores = [0.0] * len(self.chunks)
+        if not terms or not self.avg_length:
+            return scores
+        for i, tf in enumerate(self.term_freqs):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[i] / self.avg_length)
+            total = 0.0
+            for term in terms:
+                freq = tf.get(term)
+                if freq:
+                    total += self.idf[term] * freq * (BM25_K1 + 1) / (freq + norm)
+            scores[i] = total
+        return scores
+
+    def search(self, query, top_k=DOC_RETRIEVAL_TOP_K):
+        """Top-k (chunk_id, score) pairs, best first; chunks with a zero score are skipped."""
+        scores = self.score(query)
+        ranked = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+        return [(i, scores[i]) for i in ranked[:top_k] if scores[i] > 0]
+
+
+def retrieve_context(indexes, query, top_k=DOC_RETRIEVAL_TOP_K, token_budget=DOC_CONTEXT_TOKEN_BUDGET):
+    """
+    Pick the most relevant chunks across several indexes within a token budget.
+    Returns (context text, retrieval details) where the details list source, chunkId,
+    score and token estimate for every chunk that was sent.
+    """
+    candidates = []
+    for index in indexes:
+        if index is None:
+            continue
+        for chunk_id, score in index.search(query, top_k):
+            candidates.append((score, index, chunk_id))
+    candidates.sort(key=lambda c: c[0], reverse=True)
+    if not candidates:
+        # Nothing matched lexically (e.g. "summarize this"): fall back to the opening chunks.
+        for index in indexes:
+            if index is not None:
+                candidates.extend((0.0, index, chunk_id) for chunk_id in range(min(top_k, len(index.chunks))))
+
+    selected = []
+    used_tokens = 0
+    for score, index, chunk_id in candidates[:top_k]:
+        tokens = estimate_tokens(index.chunks[chunk_id])
+        if used_tokens + tokens > token_budget:
+            continue
+        used_tokens += tokens
+        selected.append((index, chunk_id, score, tokens))
+
+    # Present chunks grouped by source and in document order so the model sees coherent text.
+    selected.sort(key=lambda s: (s[0].source, s[1]))
+    parts = [f"[{index.source} #{chunk_id}]\n{index.chunks[chunk_id]}" for index, chunk_id, _, _ in selected]
+    details = [
+        {"source": index.source, "chunkId": chunk_id, "score": round(score, 4), "tokens": tokens}
+        for index, chunk_id, score, tokens in selected
+    ]
+    return "\n\n".join(parts), details
@@ -0,0 +1,252 @@
+# document_store.py
+from bson.objectid import ObjectId
+from collections import OrderedDict
+from datetime import datetime
+import gridfs
+import hashlib
+import os
+import threading
+from resources import db, get_db, LazyResource
+from document_retrieval import BM25Index
+from metrics import metrics
+
+# Document text is stored once per distinct content in GridFS, under its SHA-256 hash
+# (documentContents.files / documentContents.chunks). Each upload gets a small metadata
+# record in the documents collection that points at the content by hash.
+# Contents are never deleted inline: dedupe_documents.py removes the ones nothing references
+# once they have not been used (metadata.lastUsedAt) for a grace period.
+CONTENT_BUCKET = "documentContents"
+contents_bucket = LazyResource(lambda: gridfs.GridFSBucket(get_db(), bucket_name=CONTENT_BUCKET), label=CONTENT_BUCKET)
+content_files_collection = db[f"{CONTENT_BUCKET}.files"]
+documents_collection = db["documents"]
+# Conversations reference content by hash too (see chat_with_documents)
+conversations_collection = db["chatWithDocuments"]
+
+# Upper bound for the in-memory content cache (text plus its retrieval index)
+DOCUMENT_CACHE_MAX_BYTES = int(os.getenv("DOCUMENT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def content_hash(text):
+    """Content address of a document's text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class DocumentContent:
+    """The text of a document loaded into memory, with its retrieval index."""
+
+    def __init__(self, content_id, text):
+        self.content_id = content_id
+        self.text = text
+        self.index = BM25Index(text, source=f"document:{content_id[:12]}")
+        # Rough footprint: the text itself plus the chunk copies and term counts of the index.
+        self.size = len(text.encode("utf-8")) * 3
+
+
+class StoredDocument:
+    """An uploaded document: its metadata record plus the (shared) content."""
+
+    def __init__(self, document_id, user_email, project_id, filename, content):
+        self.document_id = document_id
+        self.user_email = user_email
+        self.project_id = project_id
+        self.filename = filename
+        self.content = content
+
+    @property
+    def content_id(self):
+        return self.content.content_id
+
+    @property
+    def text(self):
+        return self.content.text
+
+    @property
+    def index(self):
+        return self.content.index
+
+
+class ContentCache:
+    """Thread-safe LRU of DocumentContent keyed by content hash, bounded by approximate size in bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # content_id -> DocumentContent
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, content_id):
+        with self._lock:
+            content = self._entries.get(content_id)
+            if content is not None:
+                self._entries.move_to_end(content_id)
+            return content
+
+    def put(self, content):
+        if content.size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(content.content_id, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._entries[content.content_id] = content
+            self._bytes += content.size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                metrics.increment("document_cache_evictions_total")
+
+    def stats(self):
+        with self._lock:
+            return {"contents": len(self._entries), "bytes": self._bytes, "maxBytes": self.max_bytes}
+
+
+# Only content is cached per process: it is immutable under its hash. Upload records are
+# always read from Mongo (one find_one by _id), so a delete in any worker takes effect at once.
+content_cache = ContentCache(DOCUMENT_CACHE_MAX_BYTES)
+
+
+def _touch_content(content_id):
+    """Mark existing content as just used, so the GC leaves it alone. False if it does not exist."""
+    result = content_files_collection.update_one(
+        {"_id": content_id},
+        {"$set": {"metadata.lastUsedAt": datetime.utcnow()}}
+    )
+    return result.matched_count > 0
+
+
+def store_content(text):
+    """
+    Store text under its content hash unless an identical copy already exists (which is then
+    marked as used). Returns (content id, True if a new copy was written).
+    """
+    content_id = content_hash(text)
+    if _touch_content(content_id):
+        return content_id, False
+    now = datetime.utcnow()
+    try:
+        contents_bucket.upload_from_stream_with_id(
+            content_id,
+            content_id,
+            text.encode("utf-8"),
+            metadata={"textLength": len(text), "storedAt": now, "lastUsedAt": now}
+        )
+    except Exception:
+        # A concurrent upload of the same content may have won the race.
+        if _touch_content(content_id):
+            return content_id, False
+        raise
+    return content_id, True
+
+
+def load_content(content_id):
+    """DocumentContent for a hash, from memory or GridFS (None if it does not exist)."""
+    content = content_cache.get(content_id)
+    if content is not None:
+        metrics.increment("document_cache_requests_total", result="hit")
+        return content
+    metrics.increment("document_cache_requests_total", result="miss")
+    try:
+        data = contents_bucket.open_download_stream(content_id).read()
+    except gridfs.errors.NoFile:
+        return None
+    content = DocumentContent(content_id, data.decode("utf-8", errors="ignore"))
+    content_cache.put(content)
+    return content
+
+
+def save_document(user_email, project_id, filename, text):
+    """Persist an uploaded document for (userEmail, projectId). Returns the StoredDocument."""
+    content_id, _ = store_content(text)
+    content = content_cache.get(content_id)
+    if content is None:
+        content = DocumentContent(content_id, text)
+        content_cache.put(content)
+    record = {
+        "userEmail": user_email,
+        "projectId": project_id,
+        "filename": filename,
+        "contentId": content_id,
+        "textLength": len(text),
+        "uploadedAt": datetime.utcnow()
+    }
+    document_id = documents_collection.insert_one(record).inserted_id
+    record["_id"] = document_id
+    return StoredDocument(str(document_id), user_email, project_id, filename, content)
+
+
+def _find_record(user_email, project_id, document_id):
+    record = documents_collection.find_one({"_id": ObjectId(document_id)})
+    if record is None:
+        return None
+    if record.get("userEmail") != user_email:
+        return None
+    if project_id is not None and record.get("projectId") != project_id:
+        return None
+    return record
+
+
+def load_document(user_email, project_id, document_id):
+    """
+    Return the StoredDocument if it belongs to the user (and project, when given), else None.
+    Only that document's content is loaded (from memory when cached, else from GridFS).
+    """
+    if not ObjectId.is_valid(document_id):
+        return None
+    record = _find_record(user_email, project_id, document_id)
+    if not record:
+        return None
+    content = load_content(record["contentId"])
+    if content is None:
+        return None
+    return StoredDocument(document_id, record.get("userEmail"), record.get("projectId"), record.get("filename"), content)
+
+
+def latest_document_id(user_email, project_id):
+    """Id of the user's most recent upload for the project (None if there is none)."""
+    record = documents_collection.find_one(
+        {"userEmail": user_email, "projectId": project_id},
+        {"_id": 1},
+        sort=[("uploadedAt", -1)]
+    )
+    return str(record["_id"]) if record else None
+
+
+def list_documents(user_email, project_id=None):
+    """Metadata of the user's documents, newest first (optionally for one project)."""
+    query = {"userEmail": user_email}
+    if project_id is not None:
+        query["projectId"] = project_id
+    cursor = documents_collection.find(query).sort("uploadedAt", -1)
+    return [
+        {
+            "documentId": str(record["_id"]),
+            "filename": record.get("filename"),
+            "projectId": record.get("projectId"),
+            "contentId": record.get("contentId"),
+            "textLength": record.get("textLength"),
+            "uploadedAt": record["uploadedAt"].isoformat() + "Z" if record.get("uploadedAt") else None
+        }
+        for record in cursor
+    ]
+
+
+def content_in_use(content_id):
+    """True while any upload record or conversation still references the content."""
+    if documents_collection.find_one({"contentId": content_id}, {"_id": 1}):
+        return True
+    return conversations_collection.find_one({"documentContentIds": content_id}, {"_id": 1}) is not None
+
+
+def delete_document(user_email, project_id, document_id):
+    """
+    Delete one of the user's documents. Returns False if the document does not exist or is
+    not theirs. Only the record is removed; its content is left to the grace-period GC in
+    dedupe_documents.py, since a concurrent save may be about to reference it again.
+    """
+    if not ObjectId.is_valid(document_id):
+        return False
+    record = _find_record(user_email, project_id, document_id)
+    if not record:
+        return False
+    documents_collection.delete_one({"_id": record["_id"]})
+    return True
@@ -0,0 +1,395 @@
+# gemini_gateway.py
+from flask import jsonify
+import asyncio
+import math
+import os
+import random
+import threading
+import time
+import httpx
+from document_retrieval import estimate_tokens
+from metrics import metrics
+from resources import GEMINI_TIMEOUT_MS
+
+# Quota: requests and (estimated prompt) tokens per minute; 0 disables a limit
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "60"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))
+# Longest a call may wait for quota before it is rejected instead of queued
+GEMINI_MAX_QUEUE_SECONDS = float(os.getenv("GEMINI_MAX_QUEUE_SECONDS", "30"))
+# Retries of retryable errors (429, 5xx, timeouts, connection errors), full-jitter backoff
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+GEMINI_RETRY_BASE_SECONDS = float(os.getenv("GEMINI_RETRY_BASE_SECONDS", "1"))
+GEMINI_RETRY_MAX_SECONDS = float(os.getenv("GEMINI_RETRY_MAX_SECONDS", "20"))
+# Circuit breaker: open after this many consecutive failures, try again after the cool-down
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))
+GEMINI_BREAKER_COOLDOWN_SECONDS = float(os.getenv("GEMINI_BREAKER_COOLDOWN_SECONDS", "30"))
+# Per-call timeout. Sync calls get it from the client's HTTP timeout (GEMINI_TIMEOUT_MS in
+# resources.py); async calls are additionally cancelled after this long.
+GEMINI_CALL_TIMEOUT_SECONDS = GEMINI_TIMEOUT_MS / 1000 if GEMINI_TIMEOUT_MS > 0 else None
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# usage_metadata fields counted in gemini_tokens_total{kind}
+TOKEN_USAGE_FIELDS = (
+    ("prompt", "prompt_token_count"),
+    ("output", "candidates_token_count"),
+    ("total", "total_token_count")
+)
+
+BREAKER_CLOSED = "closed"
+BREAKER_HALF_OPEN = "half_open"
+BREAKER_OPEN = "open"
+BREAKER_STATE_VALUES = {BREAKER_CLOSED: 0, BREAKER_HALF_OPEN: 1, BREAKER_OPEN: 2}
+
+
+class GeminiUnavailable(Exception):
+    """
+    Raised without calling the API when the circuit is open or the call would wait longer
+    than GEMINI_MAX_QUEUE_SECONDS for quota. retry_after is a hint in seconds.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def retry_after_seconds(error):
+    """Whole seconds for a Retry-After header."""
+    return max(1, math.ceil(error.retry_after))
+
+
+def unavailable_response(error):
+    """Flask 503 response for a GeminiUnavailable error."""
+    response = jsonify({"message": "Service temporarily unavailable", "retryAfter": retry_after_seconds(error)})
+    return response, 503, {"Retry-After": str(retry_after_seconds(error))}
+
+
+def is_retryable(error):
+    """True for quota, server-side, timeout and connection errors."""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, httpx.TimeoutException, httpx.TransportError)):
+        return True
+    return getattr(error, "code", None) in RETRYABLE_STATUS
+
+
+def retry_delay(attempt):
+    """Full-jitter exponential backoff for the given retry number (0-based)."""
+    return random.uniform(0, min(GEMINI_RETRY_MAX_SECONDS, GEMINI_RETRY_BASE_SECONDS * (2 ** attempt)))
+
+
+class TokenBucket:
+    """
+    Per-minute budget that refills continuously. reserve() always takes the amount and
+    returns how long the caller must wait for the bucket to be back in credit.
+    """
+
+    def __init__(self, name, per_minute):
+        self.name = name
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.capacity > 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        if not self.enabled:
+            return 0.0
+        with self._lock:
+            self._refill()
+            self.level -= min(amount, self.capacity)
+            wait = max(0.0, -self.level / self.rate)
+            metrics.set_gauge("gemini_rate_available", round(self.level, 1), bucket=self.name)
+            return wait
+
+    def refund(self, amount):
+        """Give back an amount (a reservation that was not used, or an over-estimate)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._refill()
+            self.level = min(self.capacity, self.level + min(amount, self.capacity))
+
+
+class CircuitBreaker:
+    """
+    Closed: calls pass. After `failures` consecutive failures it opens and rejects calls for
+    `cooldown` seconds; then one trial call is let through (half-open), which closes it on
+    success or re-opens it on failure.
+    """
+
+    def __init__(self, failures, cooldown):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = BREAKER_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+        self._publish()
+
+    def _publish(self):
+        metrics.set_gauge("gemini_circuit_state", BREAKER_STATE_VALUES[self.state])
+        metrics.set_gauge("gemini_consecutive_failures", self.consecutive_failures)
+
+    def _set_state(self, state):
+        if state != self.state:
+            print(f"Gemini circuit breaker: {self.state} -> {state}")
+            metrics.increment("gemini_circuit_transitions_total", to=state)
+            self.state = state
+
+    def before_call(self):
+        """Raise GeminiUnavailable if the call must not be made now."""
+        with self._lock:
+            if self.state == BREAKER_OPEN:
+                remaining = self.opened_at + self.cooldown - time.monotonic()
+                if remaining > 0:
+                    raise GeminiUnavailable("Gemini circuit is open", retry_after=remaining)
+                self._set_state(BREAKER_HALF_OPEN)
+            if self.state == BREAKER_HALF_OPEN:
+                if self.trial_in_flight:
+                    raise GeminiUnavailable("Gemini circuit is half-open", retry_after=1.0)
+                self.trial_in_flight = True
+            self._publish()
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self.trial_in_flight = False
+            self._set_state(BREAKER_CLOSED)
+            self._publish()
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.trial_in_flight = False
+            if self.state == BREAKER_HALF_OPEN or self.consecutive_failures >= self.failures:
+                self._set_state(BREAKER_OPEN)
+                self.opened_at = time.monotonic()
+            self._publish()
+
+    def release(self):
+        """The call ended without telling anything about API health (e.g. a 4xx)."""
+        with self._lock:
+            self.trial_in_flight = False
+
+
+class GeminiGateway:
+    """
+    Single path for Gemini calls: rate limiting (requests and tokens per minute), retry with
+    jittered exponential backoff, a circuit breaker and per-call timeouts. Sync and async
+    variants share the limiter and breaker; streaming calls are retried only until the
+    first chunk has been received.
+    """
+
+    def __init__(self):
+        self.requests = TokenBucket("requests", GEMINI_RPM)
+        self.tokens = TokenBucket("tokens", GEMINI_TPM)
+        self.breaker = CircuitBreaker(GEMINI_BREAKER_FAILURES, GEMINI_BREAKER_COOLDOWN_SECONDS)
+
+    # Shared steps of the sync and async retry loops
+
+    def _reserve(self, tokens, endpoint):
+        """Check the breaker and take quota. Returns the time to wait before calling."""
+        self.breaker.before_call()
+        wait = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+        if wait > GEMINI_MAX_QUEUE_SECONDS:
+            self.requests.refund(1)
+            self.tokens.refund(tokens)
+            self.breaker.release()
+            metrics.increment("gemini_calls_total", endpoint=endpoint, outcome="rate_limited")
+            raise GeminiUnavailable("Gemini request quota exhausted", retry_after=wait)
+        if wait > 0:
+            metrics.observe("gemini_rate_limit_wait_seconds", wait, endpoint=endpoint)
+        return wait
+
+    def _on_success(self, result, tokens, endpoint, started):
+        self.breaker.record_success()
+        metrics.observe("gemini_call_seconds", time.perf_counter() - started, endpoint=endpoint)
+        metrics.increment("gemini_calls_total", endpoint=endpoint, outcome="ok")
+        usage = getattr(result, "usage_metadata", None)
+        total = getattr(usage, "total_token_count", None) if usage else None
+        for kind, field in TOKEN_USAGE_FIELDS:
+            count = getattr(usage, field, None) if usage else None
+            if count:
+                metrics.increment("gemini_tokens_total", count, endpoint=endpoint, kind=kind)
+        if total:
+            # Settle the estimate against what the call actually used.
+            if total > tokens:
+                self.tokens.reserve(total - tokens)
+            else:
+                self.tokens.refund(tokens - total)
+
+    def _on_error(self, error, attempt, endpoint):
+        """Record a failed attempt. Returns the backoff delay, or re-raises when giving up."""
+        if not is_retryable(error):
+            self.breaker.release()
+            metrics.increment("gemini_calls_total", endpoint=endpoint, outcome="error")
+            raise error
+        self.breaker.record_failure()
+        if attempt >= GEMINI_MAX_RETRIES:
+            metrics.increment("gemini_calls_total", endpoint=endpoint, outcome="error")
+            raise error
+        delay = retry_delay(attempt)
+        print(f"Gemini call failed ({error}); retry {attempt + 1}/{GEMINI_MAX_RETRIES} in {delay:.1f}s")
+        metrics.increment("gemini_retries_total", endpoint=endpoint)
+        return delay
+
+    # Calls
+
+    def generate_content(self, client, model, contents, config=None, endpoint="default"):
+        """client.models.generate_content with limiting, retries and the circuit breaker."""
+        with metrics.stage("gemini"):
+            return self._generate_content(client, model, contents, config, endpoint)
+
+    def _generate_content(self, client, model, contents, config, endpoint):
+        tokens = estimate_tokens(str(contents))
+        attempt = 0
+        while True:
+            wait = self._reserve(tokens, endpoint)
+            settled = False
+            try:
+                time.sleep(wait)
+                started = time.perf_counter()
+                try:
+                    result = client.models.generate_content(model=model, contents=contents, config=config)
+                except Exception as e:
+                    settled = True
+                    delay = self._on_error(e, attempt, endpoint)
+                else:
+                    settled = True
+                    self._on_success(result, tokens, endpoint, started)
+                    return result
+            finally:
+                if not settled:
+                    # Interrupted before an outcome: free the half-open trial slot.
+                    self.breaker.release()
+            time.sleep(delay)
+            attempt += 1
+
+    async def generate_content_async(self, client, model, contents, config=None, endpoint="default"):
+        """Async variant on client.aio, cancelled after GEMINI_CALL_TIMEOUT_SECONDS."""
+        with metrics.stage("gemini"):
+            return await self._generate_content_async(client, model, contents, config, endpoint)
+
+    async def _generate_content_async(self, client, model, contents, config, endpoint):
+        tokens = estimate_tokens(str(contents))
+        attempt = 0
+        while True:
+            wait = self._reserve(tokens, endpoint)
+            settled = False
+            try:
+                await asyncio.sleep(wait)
+                started = time.perf_counter()
+                try:
+                    result = await asyncio.wait_for(
+                        client.aio.models.generate_content(model=model, contents=contents, config=config),
+                        GEMINI_CALL_TIMEOUT_SECONDS
+                    )
+                except Exception as e:
+                    settled = True
+                    delay = self._on_error(e, attempt, endpoint)
+                else:
+                    settled = True
+                    self._on_success(result, tokens, endpoint, started)
+                    return result
+            finally:
+                if not settled:
+                    # Cancelled before an outcome: free the half-open trial slot.
+                    self.breaker.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def generate_content_stream(self, client, model, contents, config=None, endpoint="default"):
+        """
+        Generator over client.models.generate_content_stream chunks (retried until the first chunk).
+        If the consumer stops early (client disconnected), the breaker is released, not failed.
+        """
+        tokens = estimate_tokens(str(contents))
+        attempt = 0
+        while True:
+            wait = self._reserve(tokens, endpoint)
+            settled = False
+            try:
+                time.sleep(wait)
+                started = time.perf_counter()
+                try:
+                    stream = iter(client.models.generate_content_stream(model=model, contents=contents, config=config))
+                    first = next(stream, None)
+                except Exception as e:
+                    settled = True
+                    delay = self._on_error(e, attempt, endpoint)
+                else:
+                    last = first
+                    try:
+                        if first is not None:
+                            yield first
+                        for last in stream:
+                            yield last
+                    except Exception:
+                        settled = True
+                        self.breaker.record_failure()
+                        metrics.increment("gemini_calls_total", endpoint=endpoint, outcome="error")
+                        raise
+                    settled = True
+                    self._on_success(last, tokens, endpoint, started)
+                    return
+            finally:
+                if not settled:
+                    # Closed (GeneratorExit) or interrupted before an outcome.
+                    self.breaker.release()
+            time.sleep(delay)
+            attempt += 1
+
+    async def generate_content_stream_async(self, client, model, contents, config=None, endpoint="default"):
+        """
+        Async generator over client.aio stream chunks (retried until the first chunk).
+        If the consumer stops early or the task is cancelled, the breaker is released, not failed.
+        """
+        tokens = estimate_tokens(str(contents))
+        attempt = 0
+        while True:
+            wait = self._reserve(tokens, endpoint)
+            settled = False
+            try:
+                await asyncio.sleep(wait)
+                started = time.perf_counter()
+                try:
+                    stream = await asyncio.wait_for(
+                        client.aio.models.generate_content_stream(model=model, contents=contents, config=config),
+                        GEMINI_CALL_TIMEOUT_SECONDS
+                    )
+                    first = await asyncio.wait_for(anext(stream, None), GEMINI_CALL_TIMEOUT_SECONDS)
+                except Exception as e:
+                    settled = True
+                    delay = self._on_error(e, attempt, endpoint)
+                else:
+                    last = first
+                    try:
+                        if first is not None:
+                            yield first
+                        async for last in stream:
+                            yield last
+                    except Exception:
+                        settled = True
+                        self.breaker.record_failure()
+                        metrics.increment("gemini_calls_total", endpoint=endpoint, outcome="error")
+                        raise
+                    settled = True
+                    self._on_success(last, tokens, endpoint, started)
+                    return
+            finally:
+                if not settled:
+                    # Closed (GeneratorExit) or cancelled before an outcome.
+                    self.breaker.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+gemini_gateway = GeminiGateway()
@@ -0,0 +1,86 @@
+# indexes.py
+from pymongo import ASCENDING, DESCENDING
+import os
+import pymongo
+from resources import db, get_mongo_client
+
+# Upper bound for the reachability check done before creating the indexes
+INDEX_PING_TIMEOUT_SECONDS = float(os.getenv("INDEX_PING_TIMEOUT_SECONDS", "3"))
+
+# Indexes the service relies on, per collection: (keys, options)
+MANAGED_INDEXES = {
+    # Latest structured analysis per project (project context, /analyze_project).
+    "analysis": [
+        ([("projectId", ASCENDING), ("analysisTimestamp", DESCENDING)], {"name": "projectId_analysisTimestamp"}),
+    ],
+    # Latest raw analysis per project (project context).
+    "rawAnalysis": [
+        ([("projectId", ASCENDING), ("createdAt", DESCENDING)], {"name": "projectId_createdAt"}),
+    ],
+    # Async analysis job recovery scans by status; at most one queued/running job per
+    # (project, payload): activeKey only exists while a job is active (analysis_jobs.py).
+    "analysisJobs": [
+        ([("status", ASCENDING), ("updatedAt", ASCENDING)], {"name": "status_updatedAt"}),
+        ([("activeKey", ASCENDING)], {
+            "name": "activeKey_unique",
+            "unique": True,
+            "partialFilterExpression": {"activeKey": {"$exists": True}}
+        }),
+    ],
+    # Expire cached LLM responses at their expiresAt time.
+    "llmResponseCache": [
+        ([("expiresAt", ASCENDING)], {"name": "expiresAt_ttl", "expireAfterSeconds": 0}),
+    ],
+    # Per-user document listing, "latest upload for this project", and content reference checks.
+    "documents": [
+        ([("userEmail", ASCENDING), ("projectId", ASCENDING), ("uploadedAt", DESCENDING)], {"name": "userEmail_projectId_uploadedAt"}),
+        ([("contentId", ASCENDING)], {"name": "contentId"}),
+    ],
+    # Content reference checks before deleting stored document text.
+    "chatWithDocuments": [
+        ([("documentContentIds", ASCENDING)], {"name": "documentContentIds"}),
+    ],
+    # Expire old upload job records after a week.
+    "uploadJobs": [
+        ([("createdAt", ASCENDING)], {"name": "createdAt_ttl", "expireAfterSeconds": 7 * 24 * 3600}),
+    ],
+    # One bucket per (conversation, bucket number); history pages read buckets newest first.
+    "chatbotConversationBuckets": [
+        ([("conversationId", ASCENDING), ("bucket", DESCENDING)], {"name": "conversationId_bucket", "unique": True}),
+    ],
+    "chatWithDocumentsBuckets": [
+        ([("conversationId", ASCENDING), ("bucket", DESCENDING)], {"name": "conversationId_bucket", "unique": True}),
+    ],
+    # Per-member assignment upserts in /assign_tasks; task queries (task_queries.py) filter
+    # by member or project plus task status/deadline (multikey over the tasks array).
+    "teamAssignments": [
+        ([("email", ASCENDING), ("projectId", ASCENDING)], {"name": "email_projectId"}),
+        ([("email", ASCENDING), ("tasks.status", ASCENDING), ("tasks.deadline", ASCENDING)], {"name": "email_tasksStatus_tasksDeadline"}),
+        ([("projectId", ASCENDING), ("tasks.status", ASCENDING), ("tasks.deadline", ASCENDING)], {"name": "projectId_tasksStatus_tasksDeadline"}),
+        ([("projectId", ASCENDING), ("tasks.deadline", ASCENDING)], {"name": "projectId_tasksDeadline"}),
+    ],
+}
+
+
+def ensure_indexes():
+    """
+    Create the managed indexes if they do not exist yet.
+    create_index is idempotent, so this is safe to call on every startup.
+    Mongo is pinged once first (INDEX_PING_TIMEOUT_SECONDS); if it is unreachable the
+    indexes are skipped instead of every create_index waiting out the server selection
+    timeout, so the API still starts quickly without Mongo. Other failures are logged.
+    Returns False if the indexes were skipped.
+    """
+    try:
+        with pymongo.timeout(INDEX_PING_TIMEOUT_SECONDS):
+            get_mongo_client().admin.command("ping")
+    except Exception as e:
+        print("MongoDB unreachable, skipping index creation:", e)
+        return False
+    for collection_name, indexes in MANAGED_INDEXES.items():
+        for keys, options in indexes:
+            try:
+                db[collection_name].create_index(keys, **options)
+            except Exception as e:
+                print(f"Error ensuring index {options.get('name')} on {collection_name}:", e)
+    return True
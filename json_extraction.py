@@ -0,0 +1,209 @@
+# json_extraction.py
+"""
+Pull a JSON object out of free-form model output.
+
+The scanner walks the text once, tracking brace/bracket depth and JSON strings, and
+records every balanced top-level object as a candidate. Candidates are tried
+largest-first, first as-is and then after repairing the defects models commonly
+produce (code fences, trailing commas, smart quotes, Python literals, output cut off
+before the closing braces). Total work is linear in the length of the text.
+"""
+import json
+import re
+from metrics import metrics
+
+SMART_OPEN = "“„"
+SMART_CLOSE = "”"
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+CLOSERS = {"{": "}", "[": "]"}
+
+
+def strip_code_fences(text):
+    """Remove a leading ```json line and a trailing ``` fence."""
+    text = text.strip()
+    if text.startswith("```"):
+        newline = text.find("\n")
+        text = text[newline + 1:] if newline != -1 else ""
+    if text.endswith("```"):
+        text = text[:-3]
+    return text.strip()
+
+
+def find_json_candidates(text):
+    """
+    Spans (start, end, complete) of object candidates, largest first.
+    Complete candidates are balanced top-level {...} blocks. If the text ends inside an
+    object (truncated output), that object is returned with complete=False, along with the
+    balanced objects nested in it, since the opening brace may have been stray prose.
+    """
+    candidates = []
+    stack = []      # [opening char, start index, completed child object spans]
+    in_string = False
+    escaped = False
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == "{" or (char == "[" and stack):
+            stack.append([char, i, []])
+        elif not stack:
+            continue
+        elif char == '"':
+            in_string = True
+        elif char in "}]":
+            if CLOSERS[stack[-1][0]] != char:
+                continue    # stray closer; leave it to the repair pass
+            opener, start, _ = stack.pop()
+            if opener != "{":
+                continue
+            if stack:
+                stack[-1][2].append((start, i + 1, True))
+            else:
+                candidates.append((start, i + 1, True))
+    if stack:
+        candidates.append((stack[0][1], len(text), False))
+        for frame in stack:
+            candidates.extend(frame[2])
+    candidates.sort(key=lambda span: span[0] - span[1])
+    return candidates
+
+
+def repair_json(candidate):
+    """
+    Fix common defects of model-written JSON in one pass: smart-quoted strings, trailing
+    commas, Python True/False/None, and unterminated strings, arrays and objects.
+    """
+    out = []
+    stack = []
+    quote = None        # closing character of the string being copied
+    escaped = False
+    i = 0
+    n = len(candidate)
+    while i < n:
+        char = candidate[i]
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote or (quote == SMART_CLOSE and char in SMART_CLOSE + '"' and _ends_string(candidate, i + 1)):
+                quote = None
+                char = '"'
+            elif char == '"':
+                char = '\\"'    # plain quote inside a smart-quoted string
+            out.append(char)
+            i += 1
+            continue
+        if char == '"':
+            quote = '"'
+        elif char in SMART_OPEN or char == SMART_CLOSE:
+            quote = SMART_CLOSE
+            char = '"'
+        elif char in "{[":
+            stack.append(char)
+        elif char in "}]":
+            if stack and CLOSERS[stack[-1]] == char:
+                stack.pop()
+            _drop_trailing_comma(out)
+        elif char == ",":
+            j = i + 1
+            while j < n and candidate[j].isspace():
+                j += 1
+            if j < n and candidate[j] in "}]":
+                i += 1
+                continue
+        elif char.isalpha():
+            j = i
+            while j < n and candidate[j].isalpha():
+                j += 1
+            word = candidate[i:j]
+            out.append(PYTHON_LITERALS.get(word, word))
+            i = j
+            continue
+        out.append(char)
+        i += 1
+
+    # Truncated output: close whatever is still open.
+    if quote:
+        if escaped:
+            out.pop()
+        out.append('"')
+    if stack:
+        _drop_dangling(out)
+        out.extend(CLOSERS[opener] for opener in reversed(stack))
+    return "".join(out)
+
+
+def _ends_string(text, position):
+    """True if the next non-space character can follow a closed JSON string."""
+    while position < len(text) and text[position].isspace():
+        position += 1
+    return position >= len(text) or text[position] in ",:}]"
+
+
+def _drop_trailing_comma(out):
+    j = len(out) - 1
+    while j >= 0 and out[j].isspace():
+        j -= 1
+    if j >= 0 and out[j] == ",":
+        del out[j]
+
+
+def _drop_dangling(out):
+    """Before closing a truncated document: drop a trailing comma, or a key without a value."""
+    text = "".join(out).rstrip()
+    text = re.sub(r',\s*"(?:[^"\\]|\\.)*"\s*:?$|,$|:$', "", text)
+    if text.endswith(":"):
+        text = text[:-1]
+    out[:] = [text]
+
+
+def _loads(text):
+    try:
+        return json.loads(text, strict=False)
+    except (ValueError, RecursionError):    # RecursionError: deeply nested output
+        return None
+
+
+def extract_json_from_text(text, required_key=None, endpoint="default"):
+    """
+    Returns the largest JSON object in text (repairing it if needed), or None.
+    With required_key, only objects that have that key are accepted. The outcome is
+    counted in json_extraction_total{endpoint, outcome}.
+    """
+    if not text:
+        return None
+    with metrics.stage("parse"):
+        outcome, value = _extract(text, required_key)
+    metrics.increment("json_extraction_total", endpoint=endpoint, outcome=outcome)
+    if value is None:
+        print("No JSON object could be extracted from text of length", len(text))
+    return value
+
+
+def _extract(text, required_key):
+    """(outcome, value): direct, candidate, repaired, truncated, or failed with None."""
+
+    def accept(value):
+        return isinstance(value, dict) and bool(value) and (required_key is None or required_key in value)
+
+    stripped = strip_code_fences(text)
+    value = _loads(stripped)
+    if accept(value):
+        return "direct", value
+
+    for start, end, complete in find_json_candidates(stripped):
+        candidate = stripped[start:end]
+        value = _loads(candidate) if complete else None
+        if accept(value):
+            return "candidate", value
+        value = _loads(repair_json(candidate))
+        if accept(value):
+            return ("repaired" if complete else "truncated"), value
+
+    return "failed", None
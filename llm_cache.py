@@ -0,0 +1,223 @@
+# llm_cache.py
+from flask import Blueprint, g, has_request_context, request
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+import hashlib
+import json
+import os
+import re
+from resources import db, async_collection
+from metrics import metrics
+from gemini_gateway import gemini_gateway
+from ttl_cache import TTLCache
+
+llm_cache_bp = Blueprint('llm_cache', __name__)
+
+# Second cache tier; expired entries are removed by a TTL index on expiresAt (see indexes.py)
+llm_cache_collection = db["llmResponseCache"]
+async_llm_cache_collection = async_collection("llmResponseCache")  # ASGI routes
+
+# Cache configuration
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", "86400"))
+LLM_CACHE_MEMORY_SIZE = int(os.getenv("LLM_CACHE_MEMORY_SIZE", "256"))
+# Endpoints whose generations are cached (chat endpoints are opt-in), and explicit opt-outs.
+LLM_CACHE_ENDPOINTS = {e.strip() for e in os.getenv("LLM_CACHE_ENDPOINTS", "analyze_project,assign_tasks").split(",") if e.strip()}
+LLM_CACHE_DISABLED_ENDPOINTS = {e.strip() for e in os.getenv("LLM_CACHE_DISABLED_ENDPOINTS", "").split(",") if e.strip()}
+
+memory_cache = TTLCache(LLM_CACHE_MEMORY_SIZE, LLM_CACHE_TTL_SECONDS)
+
+# Per-request cache results outside a Flask request (ASGI routes, see asgi.py)
+cache_results_var = ContextVar("llm_cache_results", default=None)
+
+# Values reported in the X-LLM-Cache response header
+CACHE_HIT = "HIT"
+CACHE_MISS = "MISS"
+CACHE_BYPASS = "BYPASS"
+
+
+def normalize_prompt(contents):
+    """Normalize line endings and trailing whitespace so cosmetic differences share a cache entry."""
+    if not isinstance(contents, str):
+        contents = json.dumps(contents, sort_keys=True, default=str)
+    contents = contents.replace("\r\n", "\n")
+    contents = re.sub(r"[ \t]+\n", "\n", contents)
+    return contents.strip()
+
+
+def config_fingerprint(config):
+    """Stable representation of a generation config (dict or SDK pydantic model)."""
+    if config is None:
+        return None
+    if hasattr(config, "model_dump"):
+        config = config.model_dump(exclude_none=True, mode="json")
+    return json.loads(json.dumps(config, sort_keys=True, default=str))
+
+
+def cache_key(model, contents, config=None):
+    """Content address of a generation: hash of model + normalized prompt + generation config."""
+    material = json.dumps(
+        {"model": model, "prompt": normalize_prompt(contents), "config": config_fingerprint(config)},
+        sort_keys=True
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def cache_enabled_for(endpoint):
+    if not LLM_CACHE_ENABLED or endpoint in LLM_CACHE_DISABLED_ENDPOINTS:
+        return False
+    return endpoint in LLM_CACHE_ENDPOINTS
+
+
+def bypass_requested():
+    """Clients can skip cached answers with a 'Cache-Control: no-cache' request header."""
+    if not has_request_context():
+        return False
+    return "no-cache" in request.headers.get("Cache-Control", "").lower()
+
+
+def _record(endpoint, result):
+    metrics.increment("llm_cache_requests_total", endpoint=endpoint, result=result)
+    header_value = CACHE_HIT if result.startswith("hit") else result.upper()
+    if has_request_context():
+        g.setdefault("llm_cache_results", []).append(header_value)
+    else:
+        results = cache_results_var.get()
+        if results is not None:
+            results.append(header_value)
+
+
+def _cache_document(key, model, endpoint, text):
+    now = datetime.utcnow()
+    return {
+        "_id": key,
+        "model": model,
+        "endpoint": endpoint,
+        "text": text,
+        "createdAt": now,
+        "expiresAt": now + timedelta(seconds=LLM_CACHE_TTL_SECONDS)
+    }
+
+
+def _parse(text, parse):
+    """(accepted, result) for a response text: the text itself, or (text, parse(text)) with `parse`."""
+    if parse is None:
+        return bool(text), text
+    value = parse(text) if text else None
+    return value is not None, (text, value)
+
+
+def generate_text(client, model, contents, config=None, endpoint="default", bypass=None, parse=None):
+    """
+    Returns the response text for a generate_content call, served from the in-process LRU
+    tier or the Mongo tier when an identical request (model, prompt, config) was seen before.
+    `bypass` skips cached answers (default: the request's Cache-Control header), e.g. when
+    retrying because the cached answer was unusable.
+
+    With `parse` (the caller's parser, returning None for an unusable answer) the result is
+    (text, parse(text)), and only answers the parser accepts are cached: a malformed response
+    is never replayed, and a cached one it rejects is generated again.
+    """
+    if not cache_enabled_for(endpoint):
+        response = gemini_gateway.generate_content(client, model, contents, config, endpoint=endpoint)
+        _record(endpoint, "bypass")
+        return _parse(response.text, parse)[1]
+
+    key = cache_key(model, contents, config)
+    if bypass is None:
+        bypass = bypass_requested()
+    if not bypass:
+        text = memory_cache.get(key)
+        tier = "hit_memory"
+        if text is None:
+            try:
+                doc = llm_cache_collection.find_one({"_id": key, "expiresAt": {"$gt": datetime.utcnow()}})
+            except Exception as e:
+                print("Error reading LLM cache:", e)
+                doc = None
+            text = doc["text"] if doc else None
+            tier = "hit_mongo"
+        if text is not None:
+            accepted, result = _parse(text, parse)
+            if accepted:
+                memory_cache.set(key, text)
+                _record(endpoint, tier)
+                return result
+            print("Cached LLM response rejected by the caller; generating again")
+
+    response = gemini_gateway.generate_content(client, model, contents, config, endpoint=endpoint)
+    text = response.text
+    _record(endpoint, "bypass" if bypass else "miss")
+    accepted, result = _parse(text, parse)
+    if accepted:
+        memory_cache.set(key, text)
+        try:
+            llm_cache_collection.replace_one({"_id": key}, _cache_document(key, model, endpoint, text), upsert=True)
+        except Exception as e:
+            print("Error writing LLM cache:", e)
+    return result
+
+
+async def generate_text_async(client, model, contents, config=None, endpoint="default", bypass=False, parse=None):
+    """
+    Async counterpart of generate_text for the ASGI routes: uses the SDK's async client
+    (client.aio) and the async Mongo driver, sharing the in-process tier and cache keys.
+    `bypass` replaces the Flask request header check.
+    """
+    if not cache_enabled_for(endpoint):
+        response = await gemini_gateway.generate_content_async(client, model, contents, config, endpoint=endpoint)
+        _record(endpoint, "bypass")
+        return _parse(response.text, parse)[1]
+
+    key = cache_key(model, contents, config)
+    if not bypass:
+        text = memory_cache.get(key)
+        tier = "hit_memory"
+        if text is None:
+            try:
+                doc = await async_llm_cache_collection.find_one({"_id": key, "expiresAt": {"$gt": datetime.utcnow()}})
+            except Exception as e:
+                print("Error reading LLM cache:", e)
+                doc = None
+            text = doc["text"] if doc else None
+            tier = "hit_mongo"
+        if text is not None:
+            accepted, result = _parse(text, parse)
+            if accepted:
+                memory_cache.set(key, text)
+                _record(endpoint, tier)
+                return result
+            print("Cached LLM response rejected by the caller; generating again")
+
+    response = await gemini_gateway.generate_content_async(client, model, contents, config, endpoint=endpoint)
+    text = response.text
+    _record(endpoint, "bypass" if bypass else "miss")
+    accepted, result = _parse(text, parse)
+    if accepted:
+        memory_cache.set(key, text)
+        try:
+            await async_llm_cache_collection.replace_one({"_id": key}, _cache_document(key, model, endpoint, text), upsert=True)
+        except Exception as e:
+            print("Error writing LLM cache:", e)
+    return result
+
+
+def cache_headers(results):
+    """X-LLM-Cache headers for a request's cache results: HIT only if every generation was served from cache."""
+    if not results:
+        return {}
+    if all(r == CACHE_HIT for r in results):
+        summary = CACHE_HIT
+    elif CACHE_MISS in results:
+        summary = CACHE_MISS
+    else:
+        summary = CACHE_BYPASS
+    return {"X-LLM-Cache": summary, "X-LLM-Cache-Calls": ",".join(results)}
+
+
+@llm_cache_bp.after_app_request
+def add_cache_header(response):
+    """Report LLM cache usage for the request (see cache_headers)."""
+    for name, value in cache_headers(g.get("llm_cache_results")).items():
+        response.headers[name] = value
+    return response
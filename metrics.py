@@ -0,0 +1,229 @@
+# metrics.py
+from flask import Blueprint, Response, g, has_request_context, jsonify, request
+from contextlib import contextmanager
+from contextvars import ContextVar
+import bisect
+import math
+import re
+import threading
+import time
+
+metrics_bp = Blueprint('metrics', __name__)
+
+# Histogram bucket upper bounds (seconds) for every latency metric
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Per-request stage timings outside a Flask request (ASGI routes, see asgi.py)
+stage_timings_var = ContextVar("stage_timings", default=None)
+# Route label for stages timed outside a Flask request (set by asgi.py per request)
+stage_route_var = ContextVar("stage_route", default="background")
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class MetricsRegistry:
+    """
+    In-process counters, gauges and latency histograms (count / total / min / max plus
+    LATENCY_BUCKETS counts), keyed by metric name plus labels. Thread-safe; one registry is
+    shared by all blueprints. Each process has its own registry.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._latencies = {}
+
+    def increment(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """Record the current value of something that goes up and down (e.g. a state)."""
+        key = _key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            stats = self._latencies.get(key)
+            if stats is None:
+                stats = self._latencies[key] = [0, 0.0, seconds, seconds, [0] * (len(LATENCY_BUCKETS) + 1)]
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = min(stats[2], seconds)
+            stats[3] = max(stats[3], seconds)
+            stats[4][bucket] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Time the enclosed block and record it with observe()."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @contextmanager
+    def stage(self, stage, **labels):
+        """
+        Time one stage of request handling (mongo, gemini, parse, ...). Recorded in the
+        stage_seconds histogram under the current route, and added to the request's
+        X-Stage-Timings header.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            timings = _current_stage_timings()
+            if timings is not None:
+                timings.append((stage, seconds))
+            self.observe("stage_seconds", seconds, route=_current_route(), stage=stage, **labels)
+
+    def snapshot(self):
+        """JSON-friendly view of every counter, gauge and latency summary."""
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            gauges = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._gauges.items())
+            ]
+            latencies = [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": count,
+                    "totalSeconds": round(total, 6),
+                    "avgSeconds": round(total / count, 6),
+                    "minSeconds": round(low, 6),
+                    "maxSeconds": round(high, 6),
+                }
+                for (name, labels), (count, total, low, high, _) in sorted(self._latencies.items())
+            ]
+        return {"counters": counters, "gauges": gauges, "latencies": latencies}
+
+    def prometheus_text(self):
+        """All metrics in the Prometheus text exposition format (latencies as histograms)."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            latencies = [(key, list(stats[:2]), list(stats[4])) for key, stats in sorted(self._latencies.items())]
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            name = _metric_name(name)
+            declare(name, "counter")
+            lines.append(f"{name}{_label_text(labels)} {_number(value)}")
+        for (name, labels), value in gauges:
+            name = _metric_name(name)
+            declare(name, "gauge")
+            lines.append(f"{name}{_label_text(labels)} {_number(value)}")
+        for (name, labels), (count, total), buckets in latencies:
+            name = _metric_name(name)
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS + (math.inf,), buckets):
+                cumulative += bucket_count
+                le = "+Inf" if bound == math.inf else _number(bound)
+                lines.append(f"{name}_bucket{_label_text(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_label_text(labels)} {_number(total)}")
+            lines.append(f"{name}_count{_label_text(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _metric_name(name):
+    return re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (re.sub(r"[^a-zA-Z0-9_]", "_", k), str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        return repr(value) if math.isfinite(value) else ("+Inf" if value > 0 else "-Inf" if value < 0 else "NaN")
+    return str(value)
+
+
+def _current_stage_timings():
+    if has_request_context():
+        return g.setdefault("stage_timings", [])
+    return stage_timings_var.get()
+
+
+def _current_route():
+    """Route template of the current Flask request (e.g. /tasks/by_member), or 'background'."""
+    if has_request_context():
+        rule = request.url_rule
+        return rule.rule if rule is not None else "unmatched"
+    return stage_route_var.get()
+
+
+def stage_timings_header(timings):
+    """X-Stage-Timings value: total milliseconds per stage, in first-seen order (name;dur=ms, ...)."""
+    totals = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
+
+
+metrics = MetricsRegistry()
+
+
+@metrics_bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@metrics_bp.after_app_request
+def record_request(response):
+    """Record the request latency and report the stage timings in X-Stage-Timings."""
+    started = g.get("request_started")
+    if started is not None:
+        rule = request.url_rule
+        metrics.observe(
+            "http_request_seconds",
+            time.perf_counter() - started,
+            route=rule.rule if rule is not None else "unmatched",
+            method=request.method,
+            status=response.status_code
+        )
+    timings = g.get("stage_timings")
+    if timings:
+        response.headers["X-Stage-Timings"] = stage_timings_header(timings)
+    return response
+
+
+@metrics_bp.route("/stats", methods=["GET"])
+def stats():
+    """Expose the in-process counters, gauges and latency summaries as JSON."""
+    return jsonify(metrics.snapshot()), 200
+
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Expose this process's metrics in the Prometheus text format."""
+    return Response(metrics.prometheus_text(), mimetype="text/plain; version=0.0.4; charset=utf-8")
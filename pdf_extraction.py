@@ -0,0 +1,117 @@
+# pdf_extraction.py
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import tempfile
+import PyPDF2
+from resources import lazy_executor
+
+# Extraction limits and parallelism
+PDF_MAX_BYTES = int(os.getenv("PDF_MAX_BYTES", str(50 * 1024 * 1024)))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "2000"))
+PDF_PAGE_BATCH_SIZE = int(os.getenv("PDF_PAGE_BATCH_SIZE", "25"))
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 2)))
+
+SPOOL_CHUNK_BYTES = 1024 * 1024
+
+
+class PdfLimitExceeded(Exception):
+    """Raised when an upload is larger than PDF_MAX_BYTES or has more than PDF_MAX_PAGES pages."""
+
+
+# Process pool for page extraction. "spawn" keeps workers free of the parent's threads and
+# open Mongo sockets. Workers re-import the main script, so run.py does its startup only in
+# create_app/__main__ (importing resources here connects to nothing).
+get_process_pool = lazy_executor(
+    lambda: ProcessPoolExecutor(
+        max_workers=PDF_EXTRACT_WORKERS,
+        mp_context=multiprocessing.get_context("spawn")
+    )
+)
+
+
+def spool_to_disk(file_stream, max_bytes=PDF_MAX_BYTES):
+    """
+    Copy an uploaded file stream to a temporary file in fixed-size chunks, enforcing the
+    byte limit as it goes. Returns the path; the caller removes it (see remove_spooled).
+    """
+    fd, path = tempfile.mkstemp(suffix=".pdf", prefix="upload-")
+    written = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = file_stream.read(SPOOL_CHUNK_BYTES)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise PdfLimitExceeded(f"File is larger than {max_bytes} bytes")
+                out.write(chunk)
+    except Exception:
+        remove_spooled(path)
+        raise
+    return path
+
+
+def remove_spooled(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def count_pages(path, max_pages=PDF_MAX_PAGES):
+    """Number of pages in the spooled PDF; raises PdfLimitExceeded above max_pages."""
+    with open(path, "rb") as f:
+        page_count = len(PyPDF2.PdfReader(f).pages)
+    if page_count > max_pages:
+        raise PdfLimitExceeded(f"PDF has {page_count} pages (limit {max_pages})")
+    return page_count
+
+
+def extract_page_range(path, start, end):
+    """Extract the text of pages [start, end) of a PDF file. Runs inside a pool worker."""
+    with open(path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        return [(reader.pages[i].extract_text() or "") for i in range(start, end)]
+
+
+def iter_pdf_pages(path, page_count, batch_size=PDF_PAGE_BATCH_SIZE):
+    """
+    Yield page texts in order. Small documents are read in-process; larger ones are split
+    into page-range batches extracted in parallel by the process pool, with at most
+    twice the worker count of batches in flight.
+    """
+    if page_count <= batch_size:
+        for text in extract_page_range(path, 0, page_count):
+            yield text
+        return
+
+    pool = get_process_pool()
+    ranges = [(start, min(start + batch_size, page_count)) for start in range(0, page_count, batch_size)]
+    max_in_flight = max(1, PDF_EXTRACT_WORKERS * 2)
+    in_flight = []
+    next_range = 0
+    while in_flight or next_range < len(ranges):
+        while next_range < len(ranges) and len(in_flight) < max_in_flight:
+            start, end = ranges[next_range]
+            in_flight.append(pool.submit(extract_page_range, path, start, end))
+            next_range += 1
+        for text in in_flight.pop(0).result():
+            yield text
+
+
+def extract_text_from_pdf_file(path, on_progress=None):
+    """
+    Extract the full text of a spooled PDF, joining pages once at the end.
+    on_progress(pages_done, page_count) is called after every batch worth of pages.
+    """
+    page_count = count_pages(path)
+    if on_progress:
+        on_progress(0, page_count)
+    pages = []
+    for text in iter_pdf_pages(path, page_count):
+        pages.append(text)
+        if on_progress and (len(pages) % PDF_PAGE_BATCH_SIZE == 0 or len(pages) == page_count):
+            on_progress(len(pages), page_count)
+    return "\n".join(pages).strip()
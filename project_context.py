@@ -0,0 +1,255 @@
+# project_context.py
+from flask import Blueprint, jsonify
+from bson.objectid import ObjectId
+import os
+import json
+import threading
+from ttl_cache import TTLCache
+from prompt_builder import build_context, digest_raw_analysis, PROMPT_CONTEXT_TOKEN_BUDGET
+from metrics import metrics
+from resources import db, get_async_db
+
+project_context_bp = Blueprint('project_context', __name__)
+
+# Collections the context is built from
+projects_collection = db["projects"]
+analysis_collection = db["analysis"]
+raw_collection = db["rawAnalysis"]
+
+# Cache configuration (entries are keyed by projectId). The cache is per process: with
+# several workers (WEB_WORKERS, uvicorn --workers) an invalidation only reaches the worker
+# that wrote the new analysis, and the others may serve the previous context for up to
+# PROJECT_CONTEXT_CACHE_TTL seconds.
+PROJECT_CONTEXT_CACHE_SIZE = int(os.getenv("PROJECT_CONTEXT_CACHE_SIZE", "256"))
+PROJECT_CONTEXT_CACHE_TTL = float(os.getenv("PROJECT_CONTEXT_CACHE_TTL", "300"))
+
+context_cache = TTLCache(PROJECT_CONTEXT_CACHE_SIZE, PROJECT_CONTEXT_CACHE_TTL)
+
+# Builds in flight per project: key -> [builds, invalidation generation]. A build stores its
+# result only if the project was not invalidated while it was loading, so it cannot write
+# pre-invalidation data back. Entries are dropped when the last build of a project ends.
+_builds_in_flight = {}
+_builds_lock = threading.Lock()
+
+
+def project_context_pipeline(object_id):
+    """
+    Aggregation that returns the project plus its latest analysis and latest raw analysis
+    in a single round trip. Starts from a one-document $documents stage so the
+    analysis lookups still work when the project itself is missing.
+    Requires MongoDB 5.1+ ($documents, and $lookup with localField plus pipeline).
+    """
+    return [
+        {"$documents": [{"projectId": object_id}]},
+        {"$lookup": {
+            "from": projects_collection.name,
+            "localField": "projectId",
+            "foreignField": "_id",
+            "pipeline": [{"$limit": 1}],
+            "as": "project"
+        }},
+        {"$lookup": {
+            "from": analysis_collection.name,
+            "localField": "projectId",
+            "foreignField": "projectId",
+            "pipeline": [
+                {"$sort": {"analysisTimestamp": -1}},
+                {"$limit": 1},
+                {"$project": {"analysis": 1}}
+            ],
+            "as": "analysis"
+        }},
+        {"$lookup": {
+            "from": raw_collection.name,
+            "localField": "projectId",
+            "foreignField": "projectId",
+            "pipeline": [
+                {"$sort": {"createdAt": -1}},
+                {"$limit": 1},
+                {"$project": {"rawAnalysis": 1, "rawAnalysisDigest": 1}}
+            ],
+            "as": "rawAnalysis"
+        }},
+    ]
+
+
+def load_project_documents(project_id):
+    """
+    Load (project, latest analysis, latest raw analysis) for a project with one aggregation.
+    Any of the three may be None.
+    """
+    try:
+        object_id = ObjectId(project_id)
+    except Exception:
+        return None, None, None
+
+    with metrics.stage("mongo"):
+        return _split_row(list(db.aggregate(project_context_pipeline(object_id))))
+
+
+async def load_project_documents_async(project_id):
+    """load_project_documents on the async Mongo driver (used by asgi.py)."""
+    try:
+        object_id = ObjectId(project_id)
+    except Exception:
+        return None, None, None
+
+    with metrics.stage("mongo"):
+        cursor = await get_async_db().aggregate(project_context_pipeline(object_id))
+        return _split_row(await cursor.to_list())
+
+
+def _split_row(results):
+    if not results:
+        return None, None, None
+    row = results[0]
+    project = row["project"][0] if row.get("project") else None
+    analysis = row["analysis"][0] if row.get("analysis") else None
+    raw_analysis = row["rawAnalysis"][0] if row.get("rawAnalysis") else None
+    return project, analysis, raw_analysis
+
+
+# Section titles used in the combined context
+SECTION_PROJECT = "Project Details"
+SECTION_ANALYSIS = "Structured Analysis"
+SECTION_RAW_ANALYSIS = "Raw Analysis"
+
+# Order in which sections are given room when the context has to be cut to a budget
+SECTION_PRIORITY = (SECTION_PROJECT, SECTION_ANALYSIS, SECTION_RAW_ANALYSIS)
+
+
+class ProjectContext:
+    """Cached context of a project: the prompt sections plus the full raw analysis text."""
+
+    def __init__(self, sections, raw_analysis):
+        self.sections = sections
+        self.raw_analysis = raw_analysis
+
+
+def build_project_context_sections(project_id):
+    """
+    Merge data from the projects, analysis, and rawAnalysis collections.
+    Returns a ProjectContext whose sections are empty if nothing is found.
+    JSON is serialized compactly and the raw analysis is represented by its stored digest
+    (computed here for raw analyses saved before digests existed).
+    """
+    return context_from_documents(*load_project_documents(project_id))
+
+
+def context_from_documents(project, analysis, raw_analysis):
+    """Build the ProjectContext from the documents returned by load_project_documents."""
+    sections = []
+    if project:
+        proj_copy = dict(project)
+        proj_copy.pop("_id", None)
+        sections.append((SECTION_PROJECT, json.dumps(proj_copy, default=str)))
+
+    if analysis and analysis.get("analysis"):
+        sections.append((SECTION_ANALYSIS, json.dumps(analysis.get("analysis"), default=str)))
+
+    raw_text = raw_analysis.get("rawAnalysis") if raw_analysis else None
+    if raw_text:
+        digest = raw_analysis.get("rawAnalysisDigest") or digest_raw_analysis(raw_text)
+        sections.append((SECTION_RAW_ANALYSIS, digest))
+
+    return ProjectContext(tuple(sections), raw_text)
+
+
+def _begin_build(key):
+    """Register a context build for the project; returns the generation it started at."""
+    with _builds_lock:
+        entry = _builds_in_flight.setdefault(key, [0, 0])
+        entry[0] += 1
+        return entry[1]
+
+
+def _end_build(key, generation, context):
+    """
+    Finish a build: cache its context (None for a failed build) unless the project was
+    invalidated since the build began.
+    """
+    with _builds_lock:
+        entry = _builds_in_flight[key]
+        if context is not None and entry[1] == generation:
+            context_cache.set(key, context)
+        entry[0] -= 1
+        if entry[0] == 0:
+            del _builds_in_flight[key]
+
+
+def _get_cached_context(project_id):
+    key = str(project_id)
+    context = context_cache.get(key)
+    if context is not None:
+        return context
+    generation = _begin_build(key)
+    try:
+        context = build_project_context_sections(project_id)
+    finally:
+        _end_build(key, generation, context)
+    return context
+
+
+async def _get_cached_context_async(project_id):
+    key = str(project_id)
+    context = context_cache.get(key)
+    if context is not None:
+        return context
+    generation = _begin_build(key)
+    try:
+        context = context_from_documents(*await load_project_documents_async(project_id))
+    finally:
+        _end_build(key, generation, context)
+    return context
+
+
+def get_project_context_sections(project_id):
+    """
+    Return the context sections for a project, served from the cache when possible.
+    The returned tuple is shared with the cache and must not be modified.
+    """
+    return _get_cached_context(project_id).sections
+
+
+def get_raw_analysis_text(project_id):
+    """Full text of the project's latest raw analysis (None if there is none), from the cache."""
+    return _get_cached_context(project_id).raw_analysis
+
+
+def get_project_context(project_id, exclude=(), endpoint="default", budget=PROMPT_CONTEXT_TOKEN_BUDGET):
+    """
+    Return the combined context string for a project, fitted into a token budget,
+    optionally leaving out sections by title. Section sizes are logged per endpoint.
+    """
+    return _fit_context(get_project_context_sections(project_id), exclude, endpoint, budget)
+
+
+async def get_project_context_async(project_id, exclude=(), endpoint="default", budget=PROMPT_CONTEXT_TOKEN_BUDGET):
+    """get_project_context for the ASGI routes; shares the same cache."""
+    context = await _get_cached_context_async(project_id)
+    return _fit_context(context.sections, exclude, endpoint, budget)
+
+
+def _fit_context(sections, exclude, endpoint, budget):
+    sections = [(title, text) for title, text in sections if title not in exclude]
+    context, _ = build_context(endpoint, sections, budget, SECTION_PRIORITY)
+    return context
+
+
+def invalidate_project_context(project_id):
+    """
+    Drop the cached context for a project (call after writing new analysis data). Builds
+    still in flight will not cache their result. Only this process's cache is affected.
+    """
+    key = str(project_id)
+    with _builds_lock:
+        entry = _builds_in_flight.get(key)
+        if entry is not None:
+            entry[1] += 1
+        context_cache.invalidate(key)
+
+
+@project_context_bp.route("/project_context/cache_stats", methods=["GET"])
+def project_context_cache_stats():
+    """Expose hit/miss counters of the project context cache."""
+    return jsonify(context_cache.stats()), 200
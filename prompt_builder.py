@@ -0,0 +1,111 @@
+# prompt_builder.py
+import os
+import re
+from document_retrieval import estimate_tokens
+from metrics import metrics
+
+# Token budget for the project context pasted into chat and assignment prompts
+PROMPT_CONTEXT_TOKEN_BUDGET = int(os.getenv("PROMPT_CONTEXT_TOKEN_BUDGET", "4000"))
+# Size of the raw analysis digest stored next to each raw analysis
+RAW_ANALYSIS_DIGEST_TOKENS = int(os.getenv("RAW_ANALYSIS_DIGEST_TOKENS", "800"))
+
+TRUNCATION_MARKER = "\n[... truncated to fit the prompt budget]"
+
+HEADING_PATTERN = re.compile(r"^(#{1,6}\s+.+|\*\*[^*]+\*\*:?|[A-Z][A-Za-z0-9 ,&/()-]{2,60}:)$")
+BULLET_PATTERN = re.compile(r"^([-*•]|\d+[.)])\s+")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def _first_sentence(text, max_chars=240):
+    parts = SENTENCE_END.split(text, maxsplit=1)
+    sentence = parts[0].strip()
+    if len(sentence) > max_chars:
+        sentence = sentence[:max_chars].rsplit(" ", 1)[0] + "..."
+    return sentence
+
+
+def digest_raw_analysis(raw_text, max_tokens=RAW_ANALYSIS_DIGEST_TOKENS):
+    """
+    Compact outline of a raw analysis: its headings plus the first sentence of every
+    paragraph and bullet, with markdown emphasis removed, cut to max_tokens.
+    Computed once when the raw analysis is stored so chat turns do not resend the full text.
+    """
+    if not raw_text:
+        return ""
+    lines = []
+    for line in raw_text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if HEADING_PATTERN.match(line):
+            lines.append(re.sub(r"[#*]+", "", line).strip().rstrip(":") + ":")
+            continue
+        bullet = BULLET_PATTERN.match(line)
+        sentence = _first_sentence(re.sub(r"\*+", "", line[bullet.end():] if bullet else line))
+        if sentence:
+            lines.append(("- " if bullet else "") + sentence)
+    return truncate_to_tokens("\n".join(lines), max_tokens)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text to roughly max_tokens, at a line boundary when one is close enough."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    max_chars = max(0, max_tokens * 4 - len(TRUNCATION_MARKER))
+    cut = text[:max_chars]
+    newline = cut.rfind("\n")
+    if newline > max_chars // 2:
+        cut = cut[:newline]
+    return cut.rstrip() + TRUNCATION_MARKER
+
+
+def fit_sections(sections, budget=PROMPT_CONTEXT_TOKEN_BUDGET, priority=()):
+    """
+    Fit (title, text) sections into a token budget. Sections are served in priority
+    order (titles listed in `priority` first, then the rest in their given order);
+    each takes what it needs from the remaining budget and is truncated when it does not fit.
+    Returns the fitted sections in their original order plus a size report per section.
+    """
+    rank = {title: i for i, title in enumerate(priority)}
+    order = sorted(range(len(sections)), key=lambda i: (rank.get(sections[i][0], len(rank)), i))
+    remaining = budget
+    fitted = [None] * len(sections)
+    report = [None] * len(sections)
+    for i in order:
+        title, text = sections[i]
+        header_tokens = estimate_tokens(title) + 1
+        tokens = estimate_tokens(text)
+        if remaining - header_tokens <= 0:
+            kept, kept_tokens = "", 0
+        elif header_tokens + tokens <= remaining:
+            kept, kept_tokens = text, tokens
+        else:
+            kept = truncate_to_tokens(text, remaining - header_tokens)
+            kept_tokens = estimate_tokens(kept)
+        if kept:
+            remaining -= header_tokens + kept_tokens
+            fitted[i] = (title, kept)
+        report[i] = {"section": title, "tokens": tokens, "sentTokens": kept_tokens}
+    return [s for s in fitted if s is not None], report
+
+
+def log_prompt_sizes(endpoint, report, budget=None):
+    """Print and record the per-section token counts of a prompt."""
+    for entry in report:
+        metrics.increment("prompt_section_tokens_total", entry["sentTokens"], endpoint=endpoint, section=entry["section"])
+        if entry["sentTokens"] < entry["tokens"]:
+            metrics.increment("prompt_sections_truncated_total", endpoint=endpoint, section=entry["section"])
+    sizes = ", ".join(f"{e['section']}={e['sentTokens']}/{e['tokens']}" for e in report)
+    total = sum(e["sentTokens"] for e in report)
+    limit = f" (budget {budget})" if budget is not None else ""
+    print(f"Prompt sizes for {endpoint}: {sizes}; total {total} tokens{limit}")
+
+
+def build_context(endpoint, sections, budget=PROMPT_CONTEXT_TOKEN_BUDGET, priority=()):
+    """
+    Join (title, text) sections into one context string that fits the token budget,
+    logging the size of every section. Returns (context, size report).
+    """
+    fitted, report = fit_sections(sections, budget, priority)
+    log_prompt_sizes(endpoint, report, budget)
+    return "\n\n".join(f"{title}:\n{text}" for title, text in fitted), report
@@ -0,0 +1,345 @@
+# resources.py
+from flask import Blueprint, jsonify
+from pymongo import AsyncMongoClient, MongoClient, monitoring
+from pymongo.read_concern import ReadConcern
+from pymongo.write_concern import WriteConcern
+import os
+import threading
+import time
+import pymongo
+from dotenv import load_dotenv
+load_dotenv(".env.local")
+load_dotenv()
+from google import genai
+from google.genai import types
+
+health_bp = Blueprint('health', __name__)
+
+# MongoDB configuration: using your ProjectAutomation database
+MONGO_URI = os.getenv("MONGO_URI")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "ProjectAutomation")
+MONGO_APP_NAME = os.getenv("MONGO_APP_NAME", "ProjectAutomationFlaskAPI")
+# Connection pool and timeouts (0 means "no limit" for the socket and wait-queue timeouts)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "0"))
+# Read/write concerns; unset means the server defaults
+MONGO_WRITE_CONCERN = os.getenv("MONGO_WRITE_CONCERN")  # e.g. "1" or "majority"
+MONGO_READ_CONCERN = os.getenv("MONGO_READ_CONCERN")    # e.g. "local" or "majority"
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+
+# Google Gemini API configuration
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_TIMEOUT_MS = int(os.getenv("GEMINI_TIMEOUT_MS", "120000"))  # per call; 0 disables
+
+# Upper bound for the Mongo ping done by /health
+HEALTH_PING_TIMEOUT_SECONDS = float(os.getenv("HEALTH_PING_TIMEOUT_SECONDS", "2"))
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts connection pool events of one MongoClient, for /health."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {
+            "connectionsCreated": 0,
+            "connectionsClosed": 0,
+            "checkedOut": 0,
+            "checkOutFailures": 0,
+            "poolsCleared": 0,
+        }
+
+    def _add(self, name, value=1):
+        with self._lock:
+            self.counts[name] += value
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._add("poolsCleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._add("connectionsCreated")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add("connectionsClosed")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._add("checkOutFailures")
+
+    def connection_checked_out(self, event):
+        self._add("checkedOut")
+
+    def connection_checked_in(self, event):
+        self._add("checkedOut", -1)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        counts["open"] = counts["connectionsCreated"] - counts["connectionsClosed"]
+        counts["idle"] = counts["open"] - counts["checkedOut"]
+        return counts
+
+
+def mongo_client_options():
+    """Keyword arguments for MongoClient built from the MONGO_* settings."""
+    options = {
+        "appname": MONGO_APP_NAME,
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "readPreference": MONGO_READ_PREFERENCE,
+    }
+    if MONGO_SOCKET_TIMEOUT_MS > 0:
+        options["socketTimeoutMS"] = MONGO_SOCKET_TIMEOUT_MS
+    if MONGO_WAIT_QUEUE_TIMEOUT_MS > 0:
+        options["waitQueueTimeoutMS"] = MONGO_WAIT_QUEUE_TIMEOUT_MS
+    return options
+
+
+def _database_options():
+    options = {}
+    if MONGO_WRITE_CONCERN:
+        w = int(MONGO_WRITE_CONCERN) if MONGO_WRITE_CONCERN.isdigit() else MONGO_WRITE_CONCERN
+        options["write_concern"] = WriteConcern(w=w)
+    if MONGO_READ_CONCERN:
+        options["read_concern"] = ReadConcern(MONGO_READ_CONCERN)
+    return options
+
+
+_lock = threading.Lock()
+_pid = None
+_generation = 0
+_mongo_client = None
+_pool_listener = None
+_async_mongo_client = None
+_async_pool_listener = None
+_gemini_client = None
+
+
+def _check_process():
+    """Forget clients inherited from a parent process (must hold _lock)."""
+    global _pid, _generation, _mongo_client, _pool_listener, _async_mongo_client, _async_pool_listener, _gemini_client
+    if _pid != os.getpid():
+        # Sockets and monitor threads do not survive a fork; the child builds its own clients.
+        _pid = os.getpid()
+        _generation += 1
+        _mongo_client = None
+        _pool_listener = None
+        _async_mongo_client = None
+        _async_pool_listener = None
+        _gemini_client = None
+
+
+def get_mongo_client():
+    """The process-wide MongoClient, created on first use and re-created after a fork."""
+    global _mongo_client, _pool_listener
+    with _lock:
+        _check_process()
+        if _mongo_client is None:
+            _pool_listener = PoolStatsListener()
+            _mongo_client = MongoClient(MONGO_URI, event_listeners=[_pool_listener], **mongo_client_options())
+            print(f"MongoClient created in process {_pid} (maxPoolSize={MONGO_MAX_POOL_SIZE})")
+        return _mongo_client
+
+
+def get_db():
+    """The ProjectAutomation database on the shared client."""
+    return get_mongo_client().get_database(MONGO_DB_NAME, **_database_options())
+
+
+def get_async_mongo_client():
+    """
+    The process-wide AsyncMongoClient used by the ASGI entry point (asgi.py), created on
+    first use. Shares the MONGO_* pool and timeout settings with the synchronous client.
+    """
+    global _async_mongo_client, _async_pool_listener
+    with _lock:
+        _check_process()
+        if _async_mongo_client is None:
+            _async_pool_listener = PoolStatsListener()
+            _async_mongo_client = AsyncMongoClient(MONGO_URI, event_listeners=[_async_pool_listener], **mongo_client_options())
+            print(f"AsyncMongoClient created in process {_pid} (maxPoolSize={MONGO_MAX_POOL_SIZE})")
+        return _async_mongo_client
+
+
+def get_async_db():
+    """The ProjectAutomation database on the shared async client."""
+    return get_async_mongo_client().get_database(MONGO_DB_NAME, **_database_options())
+
+
+def get_gemini_client():
+    """The process-wide Gemini client, created on first use and re-created after a fork."""
+    global _gemini_client
+    with _lock:
+        _check_process()
+        if _gemini_client is None:
+            http_options = types.HttpOptions(timeout=GEMINI_TIMEOUT_MS) if GEMINI_TIMEOUT_MS > 0 else None
+            _gemini_client = genai.Client(api_key=GEMINI_API_KEY, http_options=http_options)
+        return _gemini_client
+
+
+def client_generation():
+    """Changes whenever the clients are replaced (fork or reset_clients)."""
+    with _lock:
+        _check_process()
+        return _generation
+
+
+def reset_clients():
+    """
+    Drop this process's clients so the next use creates fresh ones. Closes the Mongo
+    client only when it was created by this process. The async client is only dropped,
+    since closing it has to be awaited on its event loop.
+    """
+    global _generation, _mongo_client, _pool_listener, _async_mongo_client, _async_pool_listener, _gemini_client
+    with _lock:
+        owned = _pid == os.getpid()
+        _check_process()
+        if owned and _mongo_client is not None:
+            _mongo_client.close()
+        _generation += 1
+        _mongo_client = None
+        _pool_listener = None
+        _async_mongo_client = None
+        _async_pool_listener = None
+        _gemini_client = None
+
+
+class LazyResource:
+    """
+    Stand-in for a client-bound object (collection, GridFS bucket, Gemini client) that is
+    built on first attribute access and rebuilt when the underlying clients change.
+    Lets modules keep module-level names without connecting at import time.
+    """
+
+    def __init__(self, factory, label=None):
+        self._factory = factory
+        self._label = label
+        self._target = None
+        self._target_generation = None
+        self._target_lock = threading.Lock()
+
+    def resolve(self):
+        generation = client_generation()
+        with self._target_lock:
+            if self._target is None or self._target_generation != generation:
+                self._target = self._factory()
+                self._target_generation = generation
+            return self._target
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __getitem__(self, key):
+        return self.resolve()[key]
+
+    def __repr__(self):
+        return f"<LazyResource {self._label or self._factory}>"
+
+
+class LazyDatabase(LazyResource):
+    """Lazy database whose db["name"] returns a lazy collection."""
+
+    def __init__(self):
+        super().__init__(get_db, label=MONGO_DB_NAME)
+
+    def __getitem__(self, name):
+        return collection(name)
+
+
+def lazy_executor(factory):
+    """
+    Getter for a process-local executor (thread or process pool): factory() builds it on
+    first use, and again in a forked child, which inherits the object but not its workers.
+    """
+    lock = threading.Lock()
+    state = {"executor": None, "pid": None}
+
+    def get_executor():
+        with lock:
+            if state["executor"] is None or state["pid"] != os.getpid():
+                state["executor"] = factory()
+                state["pid"] = os.getpid()
+            return state["executor"]
+
+    return get_executor
+
+
+def collection(name):
+    """Lazy handle to a collection of the shared database."""
+    return LazyResource(lambda: get_db()[name], label=f"{MONGO_DB_NAME}.{name}")
+
+
+def async_collection(name):
+    """Lazy handle to a collection of the shared database on the async client."""
+    return LazyResource(lambda: get_async_db()[name], label=f"{MONGO_DB_NAME}.{name} (async)")
+
+
+db = LazyDatabase()
+gemini_client = LazyResource(get_gemini_client, label="gemini")
+
+
+def health_status():
+    """Ping MongoDB and describe the connection pool of this process."""
+    status = {"pid": os.getpid()}
+    mongo = {
+        "config": {
+            "database": MONGO_DB_NAME,
+            "maxPoolSize": MONGO_MAX_POOL_SIZE,
+            "minPoolSize": MONGO_MIN_POOL_SIZE,
+            "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+            "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS or None,
+            "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS or None,
+            "writeConcern": MONGO_WRITE_CONCERN,
+            "readConcern": MONGO_READ_CONCERN,
+            "readPreference": MONGO_READ_PREFERENCE,
+        }
+    }
+    client = get_mongo_client()
+    started = time.perf_counter()
+    try:
+        with pymongo.timeout(HEALTH_PING_TIMEOUT_SECONDS):
+            client.admin.command("ping")
+        mongo["ok"] = True
+        mongo["pingMs"] = round((time.perf_counter() - started) * 1000, 2)
+    except Exception as e:
+        mongo["ok"] = False
+        mongo["error"] = str(e)
+    with _lock:
+        listener = _pool_listener
+        async_listener = _async_pool_listener
+    mongo["pool"] = listener.stats() if listener is not None else None
+    mongo["asyncPool"] = async_listener.stats() if async_listener is not None else None
+    status["mongo"] = mongo
+    with _lock:
+        status["gemini"] = {"initialized": _gemini_client is not None, "timeoutMs": GEMINI_TIMEOUT_MS or None}
+    status["status"] = "ok" if mongo["ok"] else "degraded"
+    return status
+
+
+@health_bp.route("/health", methods=["GET"])
+def health():
+    """Liveness/readiness check with MongoDB pool statistics."""
+    status = health_status()
+    return jsonify(status), 200 if status["status"] == "ok" else 503
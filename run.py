@@ -1,24 +1,70 @@
 from flask import Flask, jsonify
 from flask_cors import CORS
+import os
+import signal
+import socket
+import sys
+import time
 
-from app import analyze_project_bp
+from app import analyze_project_bp, analysis_job_manager
 from chatbot import chatbot_bp
 from chat_with_documents import chat_with_documents_bp
 from task_assignment_automator import assign_tasks_bp
+from task_queries import tasks_bp
+from project_context import project_context_bp
+from indexes import ensure_indexes
+from metrics import metrics_bp
+from llm_cache import llm_cache_bp
+from resources import health_bp, reset_clients
 
 app = Flask(__name__)
 
 # Improved CORS setup with more specific configuration
 CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}}, 
      supports_credentials=True,
-     allow_headers=["Content-Type", "Authorization"],
-     methods=["GET", "POST", "OPTIONS"])
+     allow_headers=["Content-Type", "Authorization", "Cache-Control"],
+     expose_headers=["X-LLM-Cache", "X-LLM-Cache-Calls", "X-Coalesced", "Retry-After", "X-Stage-Timings"],
+     methods=["GET", "POST", "DELETE", "OPTIONS"])
 
 # Register Blueprints
 app.register_blueprint(analyze_project_bp)           # For project analysis
 app.register_blueprint(chatbot_bp)                   # For chatbot functionality
 app.register_blueprint(chat_with_documents_bp)       # For chat-with-documents API
 app.register_blueprint(assign_tasks_bp)              # For task assignment automation
+app.register_blueprint(tasks_bp)                     # For task queries by member / project
+app.register_blueprint(project_context_bp)           # For project context cache stats
+app.register_blueprint(metrics_bp)                   # For /stats, Prometheus /metrics and X-Stage-Timings
+app.register_blueprint(llm_cache_bp)                 # For LLM response cache headers
+app.register_blueprint(health_bp)                    # For /health with Mongo pool stats
+
+# Serving configuration. WEB_WORKERS > 1 pre-forks that many processes sharing one socket.
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "5000"))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+WEB_THREADS = int(os.getenv("WEB_THREADS", "4"))
+WEB_BACKLOG = int(os.getenv("WEB_BACKLOG", "1024"))
+# A worker that exits sooner than this after starting is restarted with a growing delay
+WEB_WORKER_MIN_UPTIME = float(os.getenv("WEB_WORKER_MIN_UPTIME", "5"))
+WEB_WORKER_MAX_RESTART_DELAY = float(os.getenv("WEB_WORKER_MAX_RESTART_DELAY", "30"))
+
+
+def start_worker():
+    """Per-process startup: pick up async analysis jobs left queued by a previous process."""
+    analysis_job_manager.recover_pending_jobs()
+
+
+def create_app():
+    """
+    App factory for WSGI servers (e.g. waitress-serve --call run:create_app): makes sure the
+    indexes exist, runs this process's startup and returns the app.
+
+    Importing run.py has no side effects: the PDF extraction pool uses "spawn", whose
+    workers re-import the main script (as __mp_main__) under `python run.py`, and they must
+    not touch Mongo or pick up analysis jobs.
+    """
+    ensure_indexes()
+    start_worker()
+    return app
 
 # Global error handler for CORS preflight requests
 @app.route('/', defaults={'path': ''}, methods=['OPTIONS'])
@@ -31,6 +77,99 @@ def handle_options(path):
     response.headers.add('Access-Control-Allow-Credentials', 'true')
     return response
 
-if __name__ == "__main__":
+def listening_socket(host, port, backlog=WEB_BACKLOG):
+    """Bind the socket that all workers accept on."""
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def run_worker(sock, threads):
+    """Body of a forked worker process; never returns."""
     from waitress import serve
-    serve(app, host="0.0.0.0", port=5000)
\ No newline at end of file
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    code = 0
+    try:
+        # Clients inherited from the supervisor are unusable after fork; start fresh.
+        reset_clients()
+        start_worker()
+        serve(app, sockets=[sock], threads=threads)
+    except BaseException as e:
+        print(f"Worker {os.getpid()} exiting after error:", e)
+        code = 1
+    finally:
+        sys.stdout.flush()
+        os._exit(code)
+
+
+def serve_prefork(workers, threads, host=HOST, port=PORT):
+    """
+    Supervisor: bind once, fork `workers` waitress processes that share the socket,
+    and restart any worker that dies until SIGTERM/SIGINT.
+    """
+    sock = listening_socket(host, port)
+    # Do not carry the supervisor's Mongo connections and monitor threads into the workers.
+    reset_clients()
+
+    children = {}       # pid -> slot
+    started_at = {}     # slot -> time the current worker was started
+    restart_delay = {}  # slot -> delay before the next restart after a quick exit
+    stopping = []
+
+    def spawn(slot):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(sock, threads)
+        children[pid] = slot
+        started_at[slot] = time.monotonic()
+        print(f"Started worker {slot} (pid {pid})")
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"Serving on {host}:{port} with {workers} workers x {threads} threads")
+    for slot in range(workers):
+        spawn(slot)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        slot = children.pop(pid, None)
+        if slot is None or stopping:
+            continue
+        uptime = time.monotonic() - started_at[slot]
+        print(f"Worker {slot} (pid {pid}) exited with status {status} after {uptime:.1f}s; restarting")
+        if uptime < WEB_WORKER_MIN_UPTIME:
+            delay = min(WEB_WORKER_MAX_RESTART_DELAY, restart_delay.get(slot, 0.5) * 2)
+            restart_delay[slot] = delay
+            time.sleep(delay)
+        else:
+            restart_delay.pop(slot, None)
+        if not stopping:
+            spawn(slot)
+    sock.close()
+
+
+if __name__ == "__main__":
+    if WEB_WORKERS > 1 and hasattr(os, "fork"):
+        # Indexes once in the supervisor; each worker recovers jobs in run_worker.
+        ensure_indexes()
+        serve_prefork(WEB_WORKERS, WEB_THREADS)
+    else:
+        from waitress import serve
+        serve(create_app(), host=HOST, port=PORT, threads=WEB_THREADS)
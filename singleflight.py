@@ -0,0 +1,75 @@
+# singleflight.py
+import hashlib
+import json
+import os
+import threading
+
+from metrics import metrics
+
+# How long a follower waits for the leader's result before giving up (seconds)
+SINGLE_FLIGHT_WAIT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_WAIT_TIMEOUT", "180"))
+
+
+class SingleFlightTimeout(Exception):
+    """Raised to a follower when the leader's call has not finished within the wait timeout."""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller (leader) runs the function,
+    later callers (followers) block until it finishes and receive the same result or exception.
+    Only in-flight calls are shared; nothing is cached once the leader returns.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, timeout=None):
+        """
+        Run fn() once per key among concurrent callers.
+        Returns (result, shared) where shared is True for followers.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            metrics.increment("single_flight_requests_total", group=self.name, role="follower")
+            wait = SINGLE_FLIGHT_WAIT_TIMEOUT if timeout is None else timeout
+            if not call.done.wait(wait):
+                metrics.increment("single_flight_timeouts_total", group=self.name)
+                raise SingleFlightTimeout(f"Identical {self.name} request still in progress after {wait}s")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        metrics.increment("single_flight_requests_total", group=self.name, role="leader")
+        try:
+            call.result = fn()
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+
+def request_key(endpoint, project_id, payload):
+    """Coalescing key: endpoint + projectId + SHA-256 of the canonical JSON payload."""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    digest = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+    return f"{endpoint}:{project_id}:{digest}"
@@ -0,0 +1,124 @@
+# streaming.py
+import json
+import re
+
+FENCE = "```"
+
+# How fenced code is treated by the cleaner being wrapped:
+#   "block" - whole ```...``` blocks are dropped, so an open block must be held back until it closes.
+#   "line"  - only the fence line itself is dropped, so text is held until the fence line ends.
+FENCE_BLOCK = "block"
+FENCE_LINE = "line"
+
+
+class StreamingCleaner:
+    """
+    Incremental wrapper around a response-cleaning function for streamed model output.
+
+    clean_segment(text) must apply the same substitutions as the module's clean_response
+    but without the final strip(). Text is only handed to it in pieces that end on a line
+    break (or on whitespace for long lines), never inside an open code fence, so patterns
+    such as ``` fences and ** markers are never split across chunks. Patterns listed in
+    line_patterns (removed up to the end of their line) hold the rest of that line back.
+    Leading/trailing whitespace of the whole answer is trimmed like clean_response does.
+    """
+
+    def __init__(self, clean_segment, fence_mode=FENCE_BLOCK, line_patterns=(), flush_threshold=80):
+        self.clean_segment = clean_segment
+        self.fence_mode = fence_mode
+        # Patterns whose removal runs to the end of the line (e.g. "disclaimer:").
+        self.line_patterns = [re.compile(p, re.IGNORECASE) for p in line_patterns]
+        self.flush_threshold = flush_threshold
+        self._buffer = ""
+        self._pending_whitespace = ""
+        self._started = False
+
+    def _line_end(self, line):
+        """Index where line_patterns start consuming the rest of the line (len(line) if none)."""
+        end = len(line)
+        for pattern in self.line_patterns:
+            match = pattern.search(line, 0, end)
+            if match:
+                end = match.start()
+        return end
+
+    def _fences_open(self, line, end):
+        """True if line[:end] leaves an odd number of fences (only relevant in block mode)."""
+        return self.fence_mode == FENCE_BLOCK and line.count(FENCE, 0, end) % 2 == 1
+
+    def _safe_length(self):
+        """Length of the buffer prefix that can be cleaned and emitted now."""
+        buf = self._buffer
+        safe = 0
+        in_block = False
+        start = 0
+        # Complete lines: safe to cut after any line that does not leave a fence block open.
+        while True:
+            newline = buf.find("\n", start)
+            if newline < 0:
+                break
+            line = buf[start:newline]
+            if self._fences_open(line, self._line_end(line)):
+                in_block = not in_block
+            start = newline + 1
+            if not in_block:
+                safe = start
+
+        # Long unfinished line: flush up to the last whitespace that is safe to cut at.
+        tail = buf[start:]
+        if in_block or len(tail) < self.flush_threshold:
+            return safe
+        if self.fence_mode == FENCE_LINE and FENCE in tail:
+            return safe
+        end = self._line_end(tail)
+        while True:
+            space = max(tail.rfind(" ", 0, end), tail.rfind("\t", 0, end))
+            if space <= 0:
+                return safe
+            if not self._fences_open(tail, space):
+                return start + space + 1
+            end = tail.rfind(FENCE, 0, space)
+
+    def _emit(self, text):
+        cleaned = self.clean_segment(text)
+        if not self._started:
+            cleaned = cleaned.lstrip()
+            if not cleaned:
+                return ""
+            self._started = True
+        stripped = cleaned.rstrip()
+        if not stripped:
+            self._pending_whitespace += cleaned
+            return ""
+        out = self._pending_whitespace + stripped
+        self._pending_whitespace = cleaned[len(stripped):]
+        return out
+
+    def feed(self, text):
+        """Add a chunk of raw model output; returns cleaned text that is safe to send now."""
+        if not text:
+            return ""
+        self._buffer += text
+        cut = self._safe_length()
+        if cut <= 0:
+            return ""
+        ready, self._buffer = self._buffer[:cut], self._buffer[cut:]
+        return self._emit(ready)
+
+    def finish(self):
+        """Flush whatever is left once the stream has ended."""
+        ready, self._buffer = self._buffer, ""
+        return self._emit(ready) if ready else ""
+
+
+def sse_event(event, data):
+    """Format one Server-Sent-Events message with a JSON payload."""
+    payload = json.dumps(data, default=str)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+# Headers that keep proxies from buffering an event stream
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
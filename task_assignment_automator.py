@@ -1,34 +1,54 @@
 # assign_tasks_module.py
 
 from flask import Blueprint, request, jsonify
-from pymongo import MongoClient
 from bson.objectid import ObjectId
-import os
+import contextvars
 import json
-import re
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
-load_dotenv(".env.local")
-from google import genai
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from resources import db, gemini_client, get_mongo_client, lazy_executor
 from flask_cors import CORS  # ✅ Added CORS import
+from project_context import get_project_context
+from llm_cache import bypass_requested, generate_text
+from json_extraction import extract_json_from_text
+from gemini_gateway import GeminiUnavailable, unavailable_response
+from task_scheduler import schedule_assignments, replan_assignments
+from metrics import metrics
+from singleflight import SingleFlight, SingleFlightTimeout, request_key
 
 assign_tasks_bp = Blueprint("assign_tasks_bp", __name__)
 CORS(assign_tasks_bp, resources={r"/*": {"origins": "http://localhost:3000"}}, supports_credentials=True)  # ✅ Updated CORS with specific origin
 
-# MongoDB configuration: using your database (e.g., "ProjectAutomation")
-MONGO_URI = os.getenv("MONGO_URI")
-client = MongoClient(MONGO_URI)
-db = client["ProjectAutomation"]
-
 # Collections
 projects_collection = db["projects"]
-analysis_collection = db["analysis"]
-raw_collection = db["rawAnalysis"]
 team_assignments_collection = db["teamAssignments"]
 
-# Google Gemini API configuration
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-gemini_client = genai.Client(api_key=GEMINI_API_KEY)
+# Sharded generation for large teams: teams of at least ASSIGNMENT_SHARD_THRESHOLD members
+# (0 disables) get one shared task breakdown, then assignments for groups of at most
+# ASSIGNMENT_SHARD_SIZE members (same role together), ASSIGNMENT_SHARD_CONCURRENCY at a time.
+ASSIGNMENT_SHARD_THRESHOLD = int(os.getenv("ASSIGNMENT_SHARD_THRESHOLD", "12"))
+ASSIGNMENT_SHARD_SIZE = int(os.getenv("ASSIGNMENT_SHARD_SIZE", "6"))
+ASSIGNMENT_SHARD_CONCURRENCY = int(os.getenv("ASSIGNMENT_SHARD_CONCURRENCY", "4"))
+# Attempts per shard (and for the breakdown); a retry only asks for the members still missing
+ASSIGNMENT_SHARD_ATTEMPTS = int(os.getenv("ASSIGNMENT_SHARD_ATTEMPTS", "3"))
+
+# Write a plan's upserts in one transaction (needs a replica set); requests can also ask for it
+ASSIGNMENT_WRITE_TRANSACTIONS = os.getenv("ASSIGNMENT_WRITE_TRANSACTIONS", "false").lower() in ("1", "true", "yes")
+# /assign_tasks/batch: projects planned at the same time, and projects per request
+ASSIGNMENT_BATCH_CONCURRENCY = int(os.getenv("ASSIGNMENT_BATCH_CONCURRENCY", "2"))
+ASSIGNMENT_BATCH_MAX_PROJECTS = int(os.getenv("ASSIGNMENT_BATCH_MAX_PROJECTS", "20"))
+
+MEMBER_ASSIGNED = "assigned"
+MEMBER_FAILED = "failed"
+# Members without an email cannot be planned or stored; they are reported under confirmedTeam[<index>]
+MEMBER_SKIPPED = "skipped"
+
+WRITE_INSERTED = "inserted"
+WRITE_UPDATED = "updated"
+WRITE_FAILED = "failed"
 
 def generate_long_response(project_data):
     """Call Gemini API to generate a detailed long analysis text."""
@@ -41,31 +61,18 @@ def generate_long_response(project_data):
         f"Project details:\n{project_details}\n\n"
         "Be as thorough as possible. No strict format is required."
     )
-    response = gemini_client.models.generate_content(
+    return generate_text(
+        gemini_client,
         model="gemini-2.0-flash",
         contents=prompt,
+        endpoint="assign_tasks",
     )
-    return response.text
-
-def extract_json_from_text(text):
-    """Try to extract a JSON object from the provided text using regex."""
-    # Remove markdown code block markers if present
-    cleaned_text = re.sub(r'```(json)?|```', '', text)
-    
-    # Try to extract JSON object
-    match = re.search(r'(\{.*\})', cleaned_text, re.DOTALL)
-    if match:
-        json_str = match.group(1)
-        try:
-            return json.loads(json_str)
-        except Exception as e:
-            print("Error parsing extracted JSON:", e)
-    return None
 
 def parse_into_structured_json(raw_text):
     """
     Call Gemini API to transform the raw text into a structured JSON.
-    If direct parsing fails, use regex extraction as fallback.
+    extract_json_from_text parses it directly when possible and otherwise falls back to the
+    largest (repairable) JSON object in the text.
     """
     parse_prompt = (
         "You are an assistant that converts long text into a rich JSON structure.\n"
@@ -84,45 +91,26 @@ def parse_into_structured_json(raw_text):
         "Return ONLY valid JSON without extra text.\n\n"
         f"Raw text:\n{raw_text}\n"
     )
-    parse_response = gemini_client.models.generate_content(
+    # Only responses that yield a JSON object are cached.
+    structured_text, extracted = generate_text(
+        gemini_client,
         model="gemini-2.0-flash",
         contents=parse_prompt,
+        endpoint="assign_tasks",
+        parse=lambda text: extract_json_from_text(text, endpoint="assign_tasks"),
     )
-    structured_text = parse_response.text
     print("Structured text from Gemini:", structured_text)
-    try:
-        # Remove markdown code block markers if present
-        cleaned_text = re.sub(r'```(json)?|```', '', structured_text)
-        structured_data = json.loads(cleaned_text)
-        if isinstance(structured_data, dict):
-            return structured_data
-    except Exception as e:
-        print("Direct JSON parsing failed:", e)
-    extracted = extract_json_from_text(structured_text)
     if extracted:
         return extracted
     return {"error": "Second-pass parsing failed", "raw": structured_text}
 
-def get_combined_context(project_id):
-    """Retrieve and merge details from the project, analysis, and rawAnalysis collections."""
-    context_parts = []
-    project = projects_collection.find_one({"_id": ObjectId(project_id)})
-    if project:
-        proj_copy = dict(project)
-        proj_copy.pop("_id", None)
-        context_parts.append("Project Details:\n" + json.dumps(proj_copy, default=str, indent=2))
-    analysis = analysis_collection.find_one({"projectId": ObjectId(project_id)}, sort=[("analysisTimestamp", -1)])
-    if analysis and analysis.get("analysis"):
-        context_parts.append("Structured Analysis:\n" + json.dumps(analysis.get("analysis"), default=str, indent=2))
-    raw_analysis = raw_collection.find_one({"projectId": ObjectId(project_id)}, sort=[("createdAt", -1)])
-    if raw_analysis and raw_analysis.get("rawAnalysis"):
-        context_parts.append("Raw Analysis:\n" + raw_analysis.get("rawAnalysis"))
-    return "\n\n".join(context_parts)
-
-def generate_assignment_with_gemini(project_id, confirmed_team, start_date=None, total_days=None):
-    """
-    Use Gemini to generate a detailed assignment for each confirmed team member.
-    The prompt includes the combined context, confirmed team details, and timeline info (if available).
+def generate_assignment_with_gemini(project_id, confirmed_team, start_date=None, total_days=None, bypass=None):
+    """
+    Use Gemini to break the project into tasks for each confirmed team member
+    (bypass=True skips cached answers).
+    The model only returns what to do: task ids, descriptions, relative effort and
+    dependencies. Deadlines, status, progress and assignedAt are filled in afterwards by
+    task_scheduler.schedule_assignments.
     Expected JSON output format:
     {
       "assignments": {
@@ -130,52 +118,518 @@ def generate_assignment_with_gemini(project_id, confirmed_team, start_date=None,
           "teamMemberName": "Name",
           "role": "Role",
           "tasks": [
-             {"description": "Task description", "deadline": "YYYY-MM-DD", "status": "Pending", "progress": 0}
+             {"id": "T1", "description": "Task description", "effort": 2, "dependsOn": []}
           ]
         },
         "email2": { ... }
       }
     }
     """
-    combined_context = get_combined_context(project_id)
+    combined_context = get_project_context(project_id, endpoint="assign_tasks")
     prompt = (
         "You are an expert project management advisor. Based on the following project context and confirmed team details, "
         "generate a detailed task assignment plan for each team member in JSON format. For each team member, include their email, name, role, and an array of tasks. "
-        "Each task should have a 'description', a 'deadline' (YYYY-MM-DD format), a 'status' (set to 'Pending'), 'progress' (0), and 'assignedAt' timestamp in ISO format. "
-        "Distribute deadlines evenly over the project's timeline if timeline information is provided. "
-        "If timeline information is not provided, leave deadlines as null.\n\n"
+        "Each task should have an 'id' unique across the whole plan (T1, T2, ...), a 'description', an 'effort' "
+        "(relative effort as a number, 1 for the smallest task), and 'dependsOn' (ids of the tasks, of any member, "
+        "that must be finished first; empty if none). Do not include dates, status or progress; they are scheduled separately.\n\n"
         "Project Context:\n" + combined_context + "\n\n"
         "Confirmed Team Details:\n" + json.dumps(confirmed_team, indent=2) + "\n\n"
     )
-    if start_date and total_days:
-        prompt += (
-            f"Project Timeline: Start date is {start_date.isoformat()} and total project duration is {total_days} days.\n\n"
-        )
+    if total_days:
+        prompt += f"Project Timeline: the project runs for {total_days} days; size the tasks accordingly.\n\n"
     prompt += (
         "Generate a JSON object with an 'assignments' key mapping each team member's email to their assignment details. "
         "Return ONLY the valid JSON without any markdown code block markers (like ```json or ```) or other text."
     )
-    response = gemini_client.models.generate_content(
+    generated_text, assignments = generate_text(
+        gemini_client,
         model="gemini-2.0-flash",
         contents=prompt,
+        endpoint="assign_tasks",
+        bypass=bypass,
+        parse=parse_assignments,
     )
-    generated_text = response.text
     print("Generated assignment text from Gemini:", generated_text)
-    
-    # Remove any markdown code block markers
-    cleaned_text = re.sub(r'```(json)?|```', '', generated_text)
-    
+    return assignments or {}
+
+def parse_assignments(generated_text):
+    """The 'assignments' object of a model response, or None (the response is then not cached)."""
+    extracted = extract_json_from_text(generated_text, required_key="assignments", endpoint="assign_tasks")
+    assignments = extracted["assignments"] if extracted else None
+    return assignments if isinstance(assignments, dict) and assignments else None
+
+def parse_task_breakdown(generated_text):
+    """The usable tasks (dicts with an id) of a breakdown response, or None."""
+    extracted = extract_json_from_text(generated_text, required_key="tasks", endpoint="assign_tasks")
+    tasks = extracted["tasks"] if extracted else None
+    if not isinstance(tasks, list):
+        return None
+    tasks = [t for t in tasks if isinstance(t, dict) and t.get("id") not in (None, "")]
+    for task in tasks:
+        task["id"] = str(task["id"])
+    return tasks or None
+
+def member_email(member):
+    """Email of a confirmedTeam entry, or None."""
+    if not isinstance(member, dict):
+        return None
+    return member.get("email") or member.get("userEmail")
+
+def skipped_member_status(confirmed_team, mode):
+    """Status entries for confirmedTeam members without an email, keyed by their position."""
+    member_status = {}
+    for i, member in enumerate(confirmed_team):
+        if member_email(member):
+            continue
+        print("Skipping confirmed team member without an email:", member)
+        status = {"status": MEMBER_SKIPPED, "error": "missing email"}
+        if isinstance(member, dict) and member.get("name"):
+            status["name"] = member["name"]
+        member_status[f"confirmedTeam[{i}]"] = status
+        metrics.increment("assignment_members_total", mode=mode, status=MEMBER_SKIPPED)
+    return member_status
+
+def use_sharding(confirmed_team, sharded=None):
+    """Explicit request flag first, otherwise team size against ASSIGNMENT_SHARD_THRESHOLD."""
+    if sharded is not None:
+        return bool(sharded)
+    return ASSIGNMENT_SHARD_THRESHOLD > 0 and len(confirmed_team) >= ASSIGNMENT_SHARD_THRESHOLD
+
+def shard_team(confirmed_team):
+    """
+    Split the team into shards of at most ASSIGNMENT_SHARD_SIZE members, keeping members of
+    the same role together. Returns (shards, members without an email).
+    """
+    groups = {}
+    invalid = []
+    for member in confirmed_team:
+        if not member_email(member):
+            invalid.append(member)
+            continue
+        role = str(member.get("role") or "").strip().lower()
+        groups.setdefault(role, []).append(member)
+    size = max(1, ASSIGNMENT_SHARD_SIZE)
+    shards = [members[i:i + size] for members in groups.values() for i in range(0, len(members), size)]
+    return shards, invalid
+
+# Thread pool that caps concurrent shard generations
+get_shard_executor = lazy_executor(
+    lambda: ThreadPoolExecutor(max_workers=ASSIGNMENT_SHARD_CONCURRENCY, thread_name_prefix="assign-shard")
+)
+
+def generate_task_breakdown(project_id, confirmed_team, total_days=None, bypass=None):
+    """
+    One Gemini call for the whole project's task breakdown, without assigning anyone:
+    [{"id", "description", "effort", "dependsOn", "role"}]. Only the team's role counts are
+    sent, not the members. Raises ValueError if no usable breakdown is produced.
+    """
+    combined_context = get_project_context(project_id, endpoint="assign_tasks")
+    roles = {}
+    for member in confirmed_team:
+        role = (member.get("role") if isinstance(member, dict) else None) or "Unspecified"
+        roles[role] = roles.get(role, 0) + 1
+    prompt = (
+        "You are an expert project management advisor. Based on the following project context and team composition, "
+        "break the whole project down into tasks. Each task should have an 'id' (T1, T2, ...), a 'description', "
+        "an 'effort' (relative effort as a number, 1 for the smallest task), 'dependsOn' (ids of the tasks that must be "
+        "finished first; empty if none) and the 'role' best suited to it. Create enough tasks to keep every team member busy. "
+        "Do not assign people and do not include dates.\n\n"
+        "Project Context:\n" + combined_context + "\n\n"
+        "Team Composition (role: number of members):\n" + json.dumps(roles, indent=2) + "\n\n"
+    )
+    if total_days:
+        prompt += f"Project Timeline: the project runs for {total_days} days; size the tasks accordingly.\n\n"
+    prompt += "Return ONLY a valid JSON object with a 'tasks' array, without markdown code block markers or other text."
+
+    for attempt in range(max(1, ASSIGNMENT_SHARD_ATTEMPTS)):
+        _, tasks = generate_text(
+            gemini_client,
+            model="gemini-2.0-flash",
+            contents=prompt,
+            endpoint="assign_tasks",
+            bypass=True if attempt else bypass,
+            parse=parse_task_breakdown,
+        )
+        if tasks:
+            return tasks
+        print(f"Task breakdown attempt {attempt + 1} produced no usable tasks")
+    raise ValueError("Could not generate a task breakdown")
+
+def generate_shard_assignments(breakdown, members, bypass=None):
+    """
+    Gemini call that assigns breakdown tasks to one shard of members. Each returned task
+    references its breakdown task through 'taskId'. Returns {email: assignment} (possibly
+    incomplete).
+    """
+    compact_breakdown = [
+        {"id": t["id"], "description": t.get("description"), "effort": t.get("effort"), "role": t.get("role")}
+        for t in breakdown
+    ]
+    prompt = (
+        "You are an expert project management advisor. Below is the task breakdown of a project and a group of its team members. "
+        "Assign each of these members the tasks that fit their role and skills; a breakdown task may be split into member-specific "
+        "subtasks. Other members of the team are planned separately, so only assign what this group should do.\n"
+        "For each member return their teamMemberName, role and an array of tasks. Each task has 'taskId' (the id of the breakdown "
+        "task it comes from), a 'description' specific to the member, and an 'effort' (relative, on the breakdown's scale).\n\n"
+        "Task Breakdown:\n" + json.dumps(compact_breakdown, separators=(",", ":")) + "\n\n"
+        "Team Members:\n" + json.dumps(members, indent=2) + "\n\n"
+        "Generate a JSON object with an 'assignments' key mapping each of these members' emails to their assignment details. "
+        "Return ONLY the valid JSON without any markdown code block markers or other text."
+    )
+    _, assignments = generate_text(
+        gemini_client,
+        model="gemini-2.0-flash",
+        contents=prompt,
+        endpoint="assign_tasks",
+        bypass=bypass,
+        parse=parse_assignments,
+    )
+    return assignments or {}
+
+def run_shard(breakdown, members, bypass=None):
+    """
+    Generate one shard, retrying (without the cache) only for members the previous attempt
+    did not return. Returns ({email: assignment}, {email: error}).
+    """
+    pending = {member_email(m): m for m in members}
+    assignments = {}
+    last_error = "not returned by the model"
+    for attempt in range(max(1, ASSIGNMENT_SHARD_ATTEMPTS)):
+        try:
+            returned = generate_shard_assignments(breakdown, list(pending.values()), bypass=True if attempt else bypass)
+        except GeminiUnavailable as e:
+            # Retrying now would be rejected as well.
+            last_error = str(e)
+            metrics.increment("assignment_shard_attempts_total", outcome="unavailable")
+            break
+        except Exception as e:
+            last_error = str(e)
+            metrics.increment("assignment_shard_attempts_total", outcome="error")
+            print(f"Assignment shard attempt {attempt + 1} failed:", e)
+            continue
+        for email in list(pending):
+            assign = returned.get(email)
+            if isinstance(assign, dict) and isinstance(assign.get("tasks"), list):
+                assignments[email] = assign
+                del pending[email]
+        metrics.increment("assignment_shard_attempts_total", outcome="complete" if not pending else "partial")
+        if not pending:
+            break
+        last_error = "not returned by the model"
+    return assignments, {email: last_error for email in pending}
+
+def link_shard_tasks(breakdown, assignments):
+    """
+    Give member tasks ids derived from their breakdown task (T3 -> T3.1, T3.2, ...) and
+    translate breakdown dependencies into dependencies between member tasks.
+    """
+    by_id = {t["id"]: t for t in breakdown}
+    derived = {}
+    for assign in assignments.values():
+        for task in assign["tasks"]:
+            source = str(task.get("taskId") or "")
+            if source not in by_id:
+                task["id"] = None
+                continue
+            derived.setdefault(source, []).append(task)
+            task["id"] = f"{source}.{len(derived[source])}"
+            task.setdefault("effort", by_id[source].get("effort"))
+    for assign in assignments.values():
+        for task in assign["tasks"]:
+            source = by_id.get(str(task.get("taskId") or ""))
+            depends_on = source.get("dependsOn") if source else None
+            if not isinstance(depends_on, list):
+                depends_on = []
+            task["dependsOn"] = [t["id"] for dep in depends_on for t in derived.get(str(dep), [])]
+    return assignments
+
+def generate_sharded_assignments(project_id, confirmed_team, total_days=None, bypass=None):
+    """
+    Sharded mode: a shared task breakdown, then per-shard assignments generated in parallel
+    and merged. Returns (assignments, {email: member status}); members whose shard failed
+    are reported as failed and left out of the assignments, members without an email as
+    skipped.
+    """
+    shards, _ = shard_team(confirmed_team)
+    member_status = {}
+
+    breakdown = generate_task_breakdown(project_id, confirmed_team, total_days, bypass)
+    print(f"Task breakdown: {len(breakdown)} tasks; assigning {len(shards)} shard(s)")
+
+    # Each shard runs in a copy of the caller's context, so its LLM cache results and stage
+    # timings are reported in this request's X-LLM-Cache / X-Stage-Timings headers.
+    futures = {
+        get_shard_executor().submit(contextvars.copy_context().run, run_shard, breakdown, members, bypass): i
+        for i, members in enumerate(shards)
+    }
+    assignments = {}
+    for future in as_completed(futures):
+        i = futures[future]
+        try:
+            shard_assignments, errors = future.result()
+        except Exception as e:
+            shard_assignments, errors = {}, {member_email(m): str(e) for m in shards[i]}
+        for email, assign in shard_assignments.items():
+            assignments[email] = assign
+            member_status[email] = {"status": MEMBER_ASSIGNED, "shard": i}
+        for email, error in errors.items():
+            member_status[email] = {"status": MEMBER_FAILED, "shard": i, "error": error}
+
+    # Merge in team order so the stored plan does not depend on which shard finished first.
+    order = [member_email(m) for members in shards for m in members]
+    assignments = {email: assignments[email] for email in order if email in assignments}
+    link_shard_tasks(breakdown, assignments)
+    for status in member_status.values():
+        metrics.increment("assignment_members_total", mode="sharded", status=status["status"])
+    member_status.update(skipped_member_status(confirmed_team, "sharded"))
+    return assignments, member_status
+
+def single_call_member_status(confirmed_team, assignments):
+    """Member status for the single-call mode: assigned if the plan has the member."""
+    member_status = skipped_member_status(confirmed_team, "single")
+    for member in confirmed_team:
+        email = member_email(member)
+        if not email:
+            continue
+        if email in assignments:
+            member_status[email] = {"status": MEMBER_ASSIGNED}
+        else:
+            member_status[email] = {"status": MEMBER_FAILED, "error": "not returned by the model"}
+        metrics.increment("assignment_members_total", mode="single", status=member_status[email]["status"])
+    return member_status
+
+def get_project_timeline(project_id):
+    """
+    Fetch the project to obtain timeline information (if available).
+    Returns (start_date, total_days); both are None when the project has no usable timeline.
+    """
+    with metrics.stage("mongo"):
+        project = projects_collection.find_one({"_id": ObjectId(project_id)})
+    start_date = None
+    total_days = None
+    if project and project.get("timeline"):
+        try:
+            timeline_weeks = int(project.get("timeline"))
+            total_days = timeline_weeks * 7
+            start_date = project.get("createdAt")
+            # Ensure start_date is a datetime object:
+            if not isinstance(start_date, datetime):
+                start_date = datetime.strptime(start_date, "%Y-%m-%dT%H:%M:%S.%fZ")
+        except Exception as ex:
+            print("Error parsing timeline:", ex)
+    return start_date, total_days
+
+def assignment_upsert(project_id, email, assign, now):
+    """UpdateOne upserting one member's assignment document."""
+    return UpdateOne(
+        {"email": email, "projectId": ObjectId(project_id)},
+        {"$set": {
+            "teamMemberName": assign.get("teamMemberName", ""),
+            "role": assign.get("role", ""),
+            "tasks": assign.get("tasks", []),
+            "updatedAt": now
+        }},
+        upsert=True
+    )
+
+def bulk_upsert_assignments(entries, transactional=False):
+    """
+    Write (project_id, email, assignment) entries with one bulk_write of UpdateOne upserts.
+    Unordered by default, so one failed upsert does not stop the others. In transactional
+    mode the writes are ordered and committed together: all of them or none.
+    Returns one {"write": inserted | updated | failed[, "error"]} per entry, in order.
+    """
+    if not entries:
+        return []
+    now = datetime.utcnow()
+    operations = [assignment_upsert(project_id, email, assign, now) for project_id, email, assign in entries]
+    errors = {}
     try:
-        assignment_data = json.loads(cleaned_text)
-        if "assignments" in assignment_data:
-            return assignment_data["assignments"]
+        with metrics.stage("mongo"):
+            if transactional:
+                with get_mongo_client().start_session() as session:
+                    result = session.with_transaction(
+                        lambda s: team_assignments_collection.bulk_write(operations, ordered=True, session=s)
+                    )
+            else:
+                result = team_assignments_collection.bulk_write(operations, ordered=False)
+        upserted = result.upserted_ids
+    except BulkWriteError as e:
+        write_errors = e.details.get("writeErrors", [])
+        if transactional:
+            # The transaction was aborted, so nothing was written.
+            message = write_errors[0].get("errmsg", "Write failed") if write_errors else str(e)
+            errors = {i: f"Transaction aborted: {message}" for i in range(len(entries))}
+            upserted = {}
+        else:
+            upserted = {u["index"]: u["_id"] for u in e.details.get("upserted", [])}
+            errors = {err["index"]: err.get("errmsg", "Write failed") for err in write_errors}
     except Exception as e:
-        print("Error parsing generated assignment JSON:", e)
-    
-    extracted = extract_json_from_text(generated_text)
-    if extracted and "assignments" in extracted:
-        return extracted["assignments"]
-    return {}
+        print("Error writing assignments:", e)
+        upserted = {}
+        errors = {i: str(e) for i in range(len(entries))}
+
+    results = []
+    for i in range(len(entries)):
+        if i in errors:
+            results.append({"write": WRITE_FAILED, "error": errors[i]})
+        else:
+            results.append({"write": WRITE_INSERTED if i in upserted else WRITE_UPDATED})
+        metrics.increment("assignment_writes_total", result=results[-1]["write"], transactional=str(bool(transactional)).lower())
+    return results
+
+def store_assignments(project_id, assignments, transactional=False):
+    """Upsert one teamAssignments document per member in one bulk write. Returns {email: write result}."""
+    entries = [(project_id, email, assign) for email, assign in assignments.items()]
+    writes = bulk_upsert_assignments(entries, transactional)
+    return {email: write for (_, email, _), write in zip(entries, writes)}
+
+def merge_write_results(member_status, writes):
+    """Add the write result to each member's status; a failed write makes the member failed."""
+    for email, write in writes.items():
+        status = member_status.setdefault(email, {"status": MEMBER_ASSIGNED})
+        status["write"] = write["write"]
+        if write["write"] == WRITE_FAILED:
+            status["status"] = MEMBER_FAILED
+            status["error"] = write.get("error")
+    return member_status
+
+def plan_assignments(project_id, confirmed_team, sharded=None, bypass=None):
+    """
+    Generate the task breakdown with Gemini (in one call, or sharded for large teams) and
+    schedule its deadlines locally, without storing it. bypass=True skips cached answers.
+    Returns {"assignments": {email: assignment}, "memberStatus": {email: status}}.
+    """
+    start_date, total_days = get_project_timeline(project_id)
+
+    # Use Gemini to break the project into tasks, then compute the deadlines here.
+    if use_sharding(confirmed_team, sharded):
+        assignments, member_status = generate_sharded_assignments(project_id, confirmed_team, total_days, bypass)
+    else:
+        assignments = generate_assignment_with_gemini(project_id, confirmed_team, start_date, total_days, bypass)
+        assignments = {email: assign for email, assign in assignments.items() if isinstance(assign, dict)}
+        member_status = single_call_member_status(confirmed_team, assignments)
+    schedule_assignments(assignments, start_date, total_days)
+    print("Final Assignments:", assignments)
+    return {"assignments": assignments, "memberStatus": member_status}
+
+def plan_and_store_assignments(project_id, confirmed_team, sharded=None, transactional=False, bypass=None):
+    """plan_assignments, then store the plan; memberStatus includes each member's write result."""
+    plan = plan_assignments(project_id, confirmed_team, sharded, bypass)
+    writes = store_assignments(project_id, plan["assignments"], transactional)
+    merge_write_results(plan["memberStatus"], writes)
+    return plan
+
+def replan_stored_assignments(project_id, start_date=None, total_days=None, transactional=False):
+    """
+    Recompute the deadlines of a project's stored assignments without calling the model.
+    start_date / total_days override the project's timeline. Returns
+    {"assignments", "memberStatus"} (write results), or None if the project has no
+    assignments; raises ValueError if there is no timeline to plan against.
+    """
+    project_start, project_days = get_project_timeline(project_id)
+    start_date = start_date or project_start
+    total_days = total_days or project_days
+    if not start_date or not total_days:
+        raise ValueError("Project has no timeline; provide startDate and totalDays")
+
+    with metrics.stage("mongo"):
+        docs = list(team_assignments_collection.find(
+            {"projectId": ObjectId(project_id)},
+            {"email": 1, "teamMemberName": 1, "role": 1, "tasks": 1}
+        ))
+    if not docs:
+        return None
+    assignments = {
+        doc["email"]: {
+            "teamMemberName": doc.get("teamMemberName", ""),
+            "role": doc.get("role", ""),
+            "tasks": doc.get("tasks") or []
+        }
+        for doc in docs
+    }
+    replan_assignments(assignments, start_date, total_days)
+    writes = store_assignments(project_id, assignments, transactional)
+    return {"assignments": assignments, "memberStatus": merge_write_results({}, writes)}
+
+# Thread pool that caps concurrent project plans of /assign_tasks/batch. Separate from the
+# shard pool, whose tasks the plans wait on.
+get_assignment_batch_executor = lazy_executor(
+    lambda: ThreadPoolExecutor(max_workers=ASSIGNMENT_BATCH_CONCURRENCY, thread_name_prefix="assign-batch")
+)
+
+def project_result_status(member_status):
+    """completed if every member was planned and written, partial if some were, else failed."""
+    statuses = [status["status"] for status in member_status.values()]
+    assigned = statuses.count(MEMBER_ASSIGNED)
+    if assigned and assigned == len(statuses):
+        return "completed"
+    return "partial" if assigned else "failed"
+
+def run_assignment_batch(items, transactional=False, bypass=False):
+    """
+    Plan several projects concurrently (on the batch pool), then write the upserts of all of
+    them with a single bulk write. Returns one result per item, in input order; a failed
+    project never fails the batch. bypass=True skips cached answers for every project.
+    """
+    results = [None] * len(items)
+    seen = set()
+
+    def failed(i, project_id, error):
+        metrics.increment("assignment_batch_items_total", status="failed")
+        results[i] = {"index": i, "projectId": project_id, "status": "failed", "error": error}
+
+    futures = {}
+    for i, item in enumerate(items):
+        project_id = item.get("projectId") if isinstance(item, dict) else None
+        confirmed_team = item.get("confirmedTeam") if isinstance(item, dict) else None
+        if not project_id or not ObjectId.is_valid(project_id) or not isinstance(confirmed_team, list) or not confirmed_team:
+            failed(i, project_id, "A valid projectId and a non-empty confirmedTeam are required")
+            continue
+        if project_id in seen:
+            failed(i, project_id, "Duplicate projectId in batch")
+            continue
+        seen.add(project_id)
+        # Run in a copy of the caller's context so cache results and stage timings reach the response.
+        future = get_assignment_batch_executor().submit(
+            contextvars.copy_context().run, plan_assignments, project_id, confirmed_team, item.get("sharded"), bypass
+        )
+        futures[future] = i
+
+    planned = []
+    for future in as_completed(futures):
+        i = futures[future]
+        project_id = items[i]["projectId"]
+        try:
+            planned.append((i, project_id, future.result()))
+        except Exception as e:
+            print(f"Assignment batch item {i} failed:", e)
+            failed(i, project_id, str(e))
+    planned.sort(key=lambda entry: entry[0])
+
+    # One bulk write for every member of every planned project.
+    entries = [
+        (project_id, email, assign)
+        for _, project_id, plan in planned
+        for email, assign in plan["assignments"].items()
+    ]
+    writes = iter(bulk_upsert_assignments(entries, transactional))
+    for i, project_id, plan in planned:
+        project_writes = {email: next(writes) for email in plan["assignments"]}
+        member_status = merge_write_results(plan["memberStatus"], project_writes)
+        status = project_result_status(member_status)
+        metrics.increment("assignment_batch_items_total", status=status)
+        results[i] = {
+            "index": i,
+            "projectId": project_id,
+            "status": status,
+            "assignments": plan["assignments"],
+            "memberStatus": member_status
+        }
+    return results
+
+# Coalesces concurrent identical assignment requests (same project and team) in this process
+assignment_flight = SingleFlight("assign_tasks")
 
 # Fix route path to match what's used in the frontend
 @assign_tasks_bp.route("/assign_tasks", methods=["POST", "OPTIONS"])
@@ -185,11 +639,18 @@ def assign_tasks():
     Expects a JSON payload with:
       - projectId (string)
       - confirmedTeam (array of team member objects with required fields)
+      - sharded (optional bool): force or disable sharded generation (default: by team size)
+      - transactional (optional bool): write the whole plan in one transaction
     This endpoint:
       1. Retrieves combined context from project, analysis, and rawAnalysis collections.
-      2. Uses the Gemini API to generate a detailed assignment plan for each confirmed team member.
-      3. Distributes deadlines evenly if timeline information is available.
-      4. Upserts each team member's assignment document in the teamassignments collection.
+      2. Uses the Gemini API to generate a detailed assignment plan for each confirmed team member
+         (for large teams: a shared task breakdown, then member shards in parallel).
+      3. Schedules deadlines locally (task_scheduler) if timeline information is available.
+      4. Upserts each team member's assignment document in the teamassignments collection
+         (one bulk write).
+    Returns the assignments plus a memberStatus entry (assigned / failed, and the write
+    result: inserted / updated / failed) per member; members without an email are reported
+    as skipped under confirmedTeam[<index>].
     """
     # Handle preflight OPTIONS request explicitly
     if request.method == "OPTIONS":
@@ -209,48 +670,120 @@ def assign_tasks():
         if not project_id or not confirmed_team:
             return jsonify({"message": "Project ID and confirmed team details are required"}), 400
 
-        # Fetch project to obtain timeline information (if available)
-        project = projects_collection.find_one({"_id": ObjectId(project_id)})
-        start_date = None
-        total_days = None
-        if project and project.get("timeline"):
-            try:
-                timeline_weeks = int(project.get("timeline"))
-                total_days = timeline_weeks * 7
-                start_date = project.get("createdAt")
-                # Ensure start_date is a datetime object:
-                if not isinstance(start_date, datetime):
-                    start_date = datetime.strptime(start_date, "%Y-%m-%dT%H:%M:%S.%fZ")
-            except Exception as ex:
-                print("Error parsing timeline:", ex)
-
-        # Use Gemini to generate a detailed assignment plan.
-        assignments = generate_assignment_with_gemini(project_id, confirmed_team, start_date, total_days)
-        print("Final Assignments from Gemini:", assignments)
-
-        # Upsert each team member's assignment document in the teamassignments collection.
-        for email, assign in assignments.items():
-            team_assignments_collection.update_one(
-                {"email": email, "projectId": ObjectId(project_id)},
-                {"$set": {
-                    "teamMemberName": assign.get("teamMemberName", ""),
-                    "role": assign.get("role", ""),
-                    "tasks": assign.get("tasks", []),
-                    "updatedAt": datetime.utcnow()
-                }},
-                upsert=True
+        sharded = data.get("sharded")  # true / false forces the mode; default depends on team size
+        transactional = bool(data.get("transactional", ASSIGNMENT_WRITE_TRANSACTIONS))
+        # Resolved here: shard generations run on pool threads, outside this request.
+        bypass = bypass_requested()
+
+        try:
+            result, shared = assignment_flight.do(
+                request_key("assign_tasks", project_id, {"confirmedTeam": confirmed_team, "sharded": sharded, "transactional": transactional, "bypass": bypass}),
+                lambda: plan_and_store_assignments(project_id, confirmed_team, sharded, transactional, bypass)
             )
+        except SingleFlightTimeout as e:
+            print("Coalesced assignment timed out:", e)
+            return jsonify({"message": "An identical assignment request is still in progress, please retry later"}), 503
 
+        member_status = result["memberStatus"]
+        failed = sum(1 for status in member_status.values() if status["status"] != MEMBER_ASSIGNED)
         response = jsonify({
-            "message": "Tasks assigned successfully",
-            "assignments": assignments
+            "message": "Tasks assigned successfully" if not failed else f"Tasks assigned; {failed} member(s) could not be planned",
+            "assignments": result["assignments"],
+            "memberStatus": member_status
         })
+        if shared:
+            response.headers["X-Coalesced"] = "true"
         return response, 200
 
+    except GeminiUnavailable as e:
+        print("Gemini unavailable:", e)
+        return unavailable_response(e)
     except Exception as e:
         print("Error in assign_tasks:", e)
         return jsonify({"message": "Internal Server Error", "error": str(e)}), 500
 
+@assign_tasks_bp.route("/assign_tasks/replan", methods=["POST"])
+def replan_tasks():
+    """
+    Re-schedule a project's stored assignments without calling Gemini.
+    Expects a JSON payload with:
+      - projectId (string)
+      - startDate (optional, YYYY-MM-DD) and totalDays (optional) to override the project's timeline
+      - transactional (optional bool): write the re-planned tasks in one transaction
+    Completed tasks keep their deadlines; open tasks are spread over the rest of the timeline.
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"message": "No data provided"}), 400
+        project_id = data.get("projectId")
+        if not project_id or not ObjectId.is_valid(project_id):
+            return jsonify({"message": "A valid projectId is required"}), 400
+        try:
+            start_date = datetime.strptime(data["startDate"], "%Y-%m-%d") if data.get("startDate") else None
+            total_days = int(data["totalDays"]) if data.get("totalDays") else None
+        except (TypeError, ValueError):
+            return jsonify({"message": "startDate must be YYYY-MM-DD and totalDays a number of days"}), 400
+        if total_days is not None and total_days <= 0:
+            return jsonify({"message": "totalDays must be positive"}), 400
+
+        try:
+            result = replan_stored_assignments(
+                project_id, start_date, total_days,
+                bool(data.get("transactional", ASSIGNMENT_WRITE_TRANSACTIONS))
+            )
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        if result is None:
+            return jsonify({"message": "No assignments found for this project"}), 404
+
+        return jsonify({
+            "message": "Tasks re-planned successfully",
+            "assignments": result["assignments"],
+            "memberStatus": result["memberStatus"]
+        }), 200
+
+    except Exception as e:
+        print("Error in replan_tasks:", e)
+        return jsonify({"message": "Internal Server Error", "error": str(e)}), 500
+
+@assign_tasks_bp.route("/assign_tasks/batch", methods=["POST"])
+def assign_tasks_batch():
+    """
+    Batch variant of /assign_tasks. Accepts {"projects": [{"projectId", "confirmedTeam",
+    "sharded"?}, ...], "transactional"?: bool} or a bare array of such items. Projects are
+    planned concurrently, at most ASSIGNMENT_BATCH_CONCURRENCY at a time, and all their
+    upserts are flushed in one bulk write (one transaction in transactional mode).
+    Returns a status per project (completed / partial / failed) plus a summary.
+    """
+    try:
+        data = request.get_json()
+        transactional = ASSIGNMENT_WRITE_TRANSACTIONS
+        if isinstance(data, dict):
+            transactional = bool(data.get("transactional", transactional))
+            data = data.get("projects")
+        if not isinstance(data, list) or not data:
+            return jsonify({"message": "A non-empty array of projects is required"}), 400
+        if len(data) > ASSIGNMENT_BATCH_MAX_PROJECTS:
+            return jsonify({"message": f"At most {ASSIGNMENT_BATCH_MAX_PROJECTS} projects per batch"}), 413
+
+        print(f"Received batch assignment of {len(data)} project(s)")
+        # Resolved here: projects are planned on pool threads, outside this request.
+        results = run_assignment_batch(data, transactional, bypass_requested())
+
+        summary = {"total": len(results)}
+        for status in ("completed", "partial", "failed"):
+            summary[status] = sum(1 for r in results if r["status"] == status)
+        return jsonify({
+            "message": "Batch assignment finished",
+            "summary": summary,
+            "results": results
+        }), 200
+
+    except Exception as e:
+        print("Error in assign_tasks_batch:", e)
+        return jsonify({"message": "Internal Server Error", "error": str(e)}), 500
+
 # Keep the original route as well for backward compatibility
 @assign_tasks_bp.route("/assignTasks", methods=["POST", "OPTIONS"])
 def assign_tasks_original():
@@ -0,0 +1,192 @@
+# task_queries.py
+from flask import Blueprint, request, jsonify
+from bson.objectid import ObjectId
+from datetime import datetime
+from metrics import metrics
+from resources import db
+
+tasks_bp = Blueprint('tasks', __name__)
+
+team_assignments_collection = db["teamAssignments"]
+
+TASK_PAGE_DEFAULT = 50
+TASK_PAGE_MAX = 200
+STATUS_COMPLETED = "Completed"
+
+# Task fields returned by the query endpoints
+TASK_FIELDS = ("id", "description", "deadline", "status", "progress", "effort", "dependsOn")
+
+
+class InvalidTaskQuery(ValueError):
+    """A query parameter of a task endpoint is invalid."""
+
+
+def _date_param(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date().isoformat()
+    except ValueError:
+        raise InvalidTaskQuery(f"{name} must be YYYY-MM-DD")
+
+
+def task_filter_from_args():
+    """
+    Task conditions from the query string: status (comma-separated), deadlineFrom and
+    deadlineTo (YYYY-MM-DD, inclusive), overdue=true (deadline before today, not completed).
+    Returns {field: condition} on task fields, e.g. {"status": {"$in": [...]}}.
+    """
+    conditions = {}
+    statuses = [s.strip() for s in request.args.get("status", "").split(",") if s.strip()]
+    if statuses:
+        conditions["status"] = {"$in": statuses}
+
+    deadline = {}
+    deadline_from = _date_param("deadlineFrom")
+    deadline_to = _date_param("deadlineTo")
+    if deadline_from:
+        deadline["$gte"] = deadline_from
+    if deadline_to:
+        deadline["$lte"] = deadline_to
+    if request.args.get("overdue", "").lower() in ("1", "true", "yes"):
+        today = datetime.utcnow().date().isoformat()
+        if not deadline_to or deadline_to >= today:
+            deadline.pop("$lte", None)
+            deadline["$lt"] = today
+        conditions.setdefault("status", {})["$ne"] = STATUS_COMPLETED
+    if deadline:
+        conditions["deadline"] = deadline
+    return conditions
+
+
+def _task_condition(field, condition):
+    """One {field: {op: value}} task condition as an aggregation expression on $$task."""
+    path = f"$$task.{field}"
+    # $in, $gte, $lte, $lt and $ne have aggregation counterparts of the same name.
+    expressions = [{op: [path, value]} for op, value in condition.items()]
+    if field == "deadline":
+        # Range comparisons in expressions also match missing/null deadlines; the query does not.
+        expressions.append({"$eq": [{"$type": path}, "string"]})
+    return expressions
+
+
+def task_query_pipeline(match, conditions, after=None, limit=TASK_PAGE_DEFAULT):
+    """
+    Aggregation for one page of assignment documents with their matching tasks.
+
+    The $elemMatch on tasks.status / tasks.deadline uses the compound multikey indexes
+    (email or projectId first, see indexes.py); only the requested task fields of the
+    matching tasks are returned. Pages are ordered by _id and continue after the
+    `after` cursor.
+    """
+    match = dict(match)
+    if conditions:
+        match["tasks"] = {"$elemMatch": conditions}
+    if after is not None:
+        match["_id"] = {"$gt": after}
+
+    expressions = [e for field, condition in conditions.items() for e in _task_condition(field, condition)]
+    tasks = {"$ifNull": ["$tasks", []]}
+    if expressions:
+        tasks = {"$filter": {"input": tasks, "as": "task", "cond": {"$and": expressions}}}
+    return [
+        {"$match": match},
+        {"$sort": {"_id": 1}},
+        {"$limit": limit + 1},
+        {"$project": {
+            "_id": 1,
+            "projectId": 1,
+            "email": 1,
+            "teamMemberName": 1,
+            "role": 1,
+            "updatedAt": 1,
+            "tasks": {"$map": {
+                "input": tasks,
+                "as": "task",
+                "in": {field: f"$$task.{field}" for field in TASK_FIELDS}
+            }}
+        }}
+    ]
+
+
+def query_tasks(match, conditions, after=None, limit=TASK_PAGE_DEFAULT):
+    """Run task_query_pipeline. Returns (documents, next_cursor)."""
+    limit = max(1, min(limit, TASK_PAGE_MAX))
+    with metrics.stage("mongo"):
+        docs = list(team_assignments_collection.aggregate(task_query_pipeline(match, conditions, after, limit)))
+    next_cursor = str(docs[limit - 1]["_id"]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+
+def serialize_assignment(doc):
+    return {
+        "assignmentId": str(doc["_id"]),
+        "projectId": str(doc.get("projectId")) if doc.get("projectId") is not None else None,
+        "email": doc.get("email"),
+        "teamMemberName": doc.get("teamMemberName"),
+        "role": doc.get("role"),
+        "updatedAt": doc["updatedAt"].isoformat() + "Z" if isinstance(doc.get("updatedAt"), datetime) else doc.get("updatedAt"),
+        "tasks": [{k: v for k, v in task.items() if v is not None} for task in doc.get("tasks", [])]
+    }
+
+
+def _page_args():
+    limit = request.args.get("limit", TASK_PAGE_DEFAULT, type=int)
+    after = request.args.get("after")
+    if after is not None:
+        if not ObjectId.is_valid(after):
+            raise InvalidTaskQuery("Invalid cursor")
+        after = ObjectId(after)
+    return after, limit
+
+
+def _task_page_response(match):
+    conditions = task_filter_from_args()
+    after, limit = _page_args()
+    docs, next_cursor = query_tasks(match, conditions, after, limit)
+    with metrics.stage("serialize"):
+        response = jsonify({
+            "assignments": [serialize_assignment(doc) for doc in docs],
+            "taskCount": sum(len(doc.get("tasks", [])) for doc in docs),
+            "nextCursor": next_cursor
+        })
+    return response, 200
+
+
+@tasks_bp.route("/tasks/by_member", methods=["GET"])
+def tasks_by_member():
+    """
+    A member's tasks across all projects, one entry per project assignment.
+    Query params: email (required), status, deadlineFrom, deadlineTo, overdue,
+    limit (default 50), after (cursor from a previous page).
+    """
+    try:
+        email = request.args.get("email")
+        if not email:
+            return jsonify({"message": "email is required"}), 400
+        return _task_page_response({"email": email})
+    except InvalidTaskQuery as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        print("Error fetching tasks by member:", e)
+        return jsonify({"message": "Internal Server Error"}), 500
+
+
+@tasks_bp.route("/tasks/by_project", methods=["GET"])
+def tasks_by_project():
+    """
+    A project's tasks, one entry per team member.
+    Query params: projectId (required), status, deadlineFrom, deadlineTo, overdue,
+    limit (default 50), after (cursor from a previous page).
+    """
+    try:
+        project_id = request.args.get("projectId")
+        if not project_id or not ObjectId.is_valid(project_id):
+            return jsonify({"message": "A valid projectId is required"}), 400
+        return _task_page_response({"projectId": ObjectId(project_id)})
+    except InvalidTaskQuery as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        print("Error fetching tasks by project:", e)
+        return jsonify({"message": "Internal Server Error"}), 500
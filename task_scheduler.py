@@ -0,0 +1,171 @@
+# task_scheduler.py
+"""
+Deterministic deadline scheduling for task assignments.
+
+The model only decides what the tasks are: a description, a relative effort and the ids
+of the tasks each one depends on. Deadlines are computed here by list scheduling: every
+member works through their own tasks one at a time, a task starts once its dependencies
+(possibly another member's tasks) are done, and the finished plan is scaled onto the
+project's timeline so the last task ends on the last day.
+"""
+from datetime import date, datetime, timedelta
+import math
+
+DEFAULT_EFFORT = 1.0
+MAX_EFFORT = 100.0
+STATUS_PENDING = "Pending"
+STATUS_COMPLETED = "Completed"
+
+
+def _effort(task):
+    try:
+        effort = float(task.get("effort", DEFAULT_EFFORT))
+    except (TypeError, ValueError):
+        return DEFAULT_EFFORT
+    if not math.isfinite(effort) or effort <= 0:
+        return DEFAULT_EFFORT
+    return min(effort, MAX_EFFORT)
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+
+
+def _is_completed(task):
+    return str(task.get("status", "")).lower() == STATUS_COMPLETED.lower()
+
+
+def normalize_tasks(assignments):
+    """
+    Give every task a unique string id and sanitized effort/dependsOn fields, in place.
+    Ids the model reused or left out are replaced; dependencies on unknown ids are dropped.
+    Bare strings become {"description": ...} tasks; other non-dict entries are dropped.
+    """
+    seen = set()
+    renamed = {}
+    counter = 0
+    for assign in assignments.values():
+        tasks = assign.get("tasks")
+        if not isinstance(tasks, list):
+            tasks = []
+        assign["tasks"] = tasks = [
+            {"description": t} if isinstance(t, str) else t
+            for t in tasks
+            if isinstance(t, (dict, str))
+        ]
+        for task in tasks:
+            original = task.get("id")
+            task_id = str(original) if original not in (None, "") else None
+            if task_id is None or task_id in seen:
+                counter += 1
+                while f"T{counter}" in seen:
+                    counter += 1
+                task_id = f"T{counter}"
+            if original not in (None, "") and str(original) not in renamed:
+                renamed[str(original)] = task_id
+            seen.add(task_id)
+            task["id"] = task_id
+            task["effort"] = _effort(task)
+    for assign in assignments.values():
+        for task in assign["tasks"]:
+            depends_on = task.get("dependsOn") or []
+            if not isinstance(depends_on, list):
+                depends_on = [depends_on]
+            resolved = [renamed.get(str(d), str(d)) for d in depends_on]
+            task["dependsOn"] = [d for d in dict.fromkeys(resolved) if d in seen and d != task["id"]]
+    return assignments
+
+
+def plan_finish_times(assignments):
+    """
+    Finish time of every open task in effort units, {task id: finish}.
+
+    List scheduling: repeatedly place, among the tasks whose dependencies are placed, the one
+    that can start earliest (its member is free and its dependencies are finished), ties going
+    to the order the model listed the tasks. Completed tasks take no time, open tasks take
+    their effort reduced by their progress. Tasks on a dependency cycle are placed in listed
+    order once nothing else is ready.
+    """
+    tasks = [
+        (email, task)
+        for email, assign in assignments.items()
+        for task in assign["tasks"]
+        if not _is_completed(task)
+    ]
+    open_ids = {task["id"] for _, task in tasks}
+    member_free = {email: 0.0 for email in assignments}
+    finish = {}
+    remaining = list(range(len(tasks)))
+    while remaining:
+        best = None
+        for i in remaining:
+            email, task = tasks[i]
+            deps = [d for d in task["dependsOn"] if d in open_ids]
+            if any(d not in finish for d in deps):
+                continue
+            start = max([member_free[email]] + [finish[d] for d in deps])
+            if best is None or start < best[0]:
+                best = (start, i)
+        if best is None:
+            # Only cyclic tasks are left: ignore their unplaced dependencies.
+            i = remaining[0]
+            email, task = tasks[i]
+            ready_at = max((finish[d] for d in task["dependsOn"] if d in finish), default=0.0)
+            best = (max(member_free[email], ready_at), i)
+        start, i = best
+        email, task = tasks[i]
+        progress = min(max(float(task.get("progress") or 0), 0.0), 100.0)
+        finish[task["id"]] = start + task["effort"] * (1 - progress / 100)
+        member_free[email] = finish[task["id"]]
+        remaining.remove(i)
+    return finish
+
+
+def schedule_assignments(assignments, start_date=None, total_days=None, assigned_at=None):
+    """
+    Fill in deadline (YYYY-MM-DD), status, progress and assignedAt for every task of
+    {email: {"teamMemberName", "role", "tasks": [...]}} and return it.
+    Open tasks are spread over total_days from start_date; without a timeline deadlines
+    are left as None. Completed tasks keep their deadline, and existing status, progress
+    and assignedAt values are kept.
+    """
+    normalize_tasks(assignments)
+    assigned_at = assigned_at or datetime.utcnow().isoformat() + "Z"
+    finish = plan_finish_times(assignments)
+    makespan = max(finish.values(), default=0.0)
+    start = _as_date(start_date) if start_date and total_days else None
+
+    for assign in assignments.values():
+        for task in assign["tasks"]:
+            task.setdefault("status", STATUS_PENDING)
+            task.setdefault("progress", 0)
+            task.setdefault("assignedAt", assigned_at)
+            if task["id"] not in finish:
+                task.setdefault("deadline", None)
+                continue
+            if start is None or makespan <= 0:
+                task["deadline"] = None
+                continue
+            day = max(1, math.ceil(round(finish[task["id"]] / makespan * total_days, 6)))
+            task["deadline"] = (start + timedelta(days=day)).isoformat()
+    return assignments
+
+
+def replan_assignments(assignments, project_start, total_days, today=None):
+    """
+    Re-schedule an existing plan without the model: open tasks are spread over what is left
+    of the project (from today, or from the project start if that is later) to its end date.
+    If the end date has passed, open tasks are planned over the next day.
+    """
+    today = _as_date(today or datetime.utcnow())
+    if not project_start or not total_days:
+        return schedule_assignments(assignments)
+    project_start = _as_date(project_start)
+    project_end = project_start + timedelta(days=total_days)
+    window_start = max(project_start, today)
+    remaining_days = max(1, (project_end - window_start).days)
+    return schedule_assignments(assignments, window_start, remaining_days)
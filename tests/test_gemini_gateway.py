@@ -0,0 +1,122 @@
+# tests/test_gemini_gateway.py
+"""
+The circuit breaker's half-open trial slot must be freed when a trial call ends without an
+outcome: an SSE client disconnecting mid-stream (GeneratorExit) or a cancelled task.
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from gemini_gateway import BREAKER_HALF_OPEN, BREAKER_OPEN, GeminiGateway, GeminiUnavailable
+
+
+def chunk(text):
+    return SimpleNamespace(text=text, usage_metadata=None)
+
+
+class FakeModels:
+    def generate_content(self, model, contents, config=None):
+        return chunk("ok")
+
+    def generate_content_stream(self, model, contents, config=None):
+        return iter([chunk("a"), chunk("b"), chunk("c")])
+
+
+class FakeAsyncModels:
+    """Async calls that never finish, so the calling task has to be cancelled."""
+
+    def __init__(self):
+        self.started = asyncio.Event()
+
+    async def generate_content(self, model, contents, config=None):
+        self.started.set()
+        await asyncio.Event().wait()
+
+    async def generate_content_stream(self, model, contents, config=None):
+        async def stream():
+            yield chunk("a")
+            self.started.set()
+            await asyncio.Event().wait()
+        return stream()
+
+
+def fake_client():
+    return SimpleNamespace(models=FakeModels(), aio=SimpleNamespace(models=FakeAsyncModels()))
+
+
+@pytest.fixture
+def gateway():
+    """A gateway whose breaker is open with its cool-down over: the next call is the trial."""
+    gateway = GeminiGateway()
+    gateway.breaker.state = BREAKER_OPEN
+    gateway.breaker.opened_at = time.monotonic() - gateway.breaker.cooldown - 1
+    return gateway
+
+
+def assert_trial_released(gateway, client):
+    assert gateway.breaker.state == BREAKER_HALF_OPEN
+    assert not gateway.breaker.trial_in_flight
+    # The next call becomes the trial and closes the circuit.
+    assert gateway.generate_content(client, "model", "prompt").text == "ok"
+    assert gateway.breaker.state != BREAKER_HALF_OPEN
+
+
+def test_stream_closed_by_consumer_releases_trial(gateway):
+    client = fake_client()
+    stream = gateway.generate_content_stream(client, "model", "prompt")
+    assert next(stream).text == "a"
+    assert gateway.breaker.trial_in_flight
+    with pytest.raises(GeminiUnavailable):
+        gateway.generate_content(client, "model", "prompt")
+
+    stream.close()      # client disconnected
+
+    assert_trial_released(gateway, client)
+
+
+def test_async_stream_cancelled_releases_trial(gateway):
+    client = fake_client()
+
+    async def consume():
+        async for _ in gateway.generate_content_stream_async(client, "model", "prompt"):
+            pass
+
+    async def main():
+        task = asyncio.create_task(consume())
+        await client.aio.models.started.wait()
+        assert gateway.breaker.trial_in_flight
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert_trial_released(gateway, client)
+
+
+def test_async_stream_closed_by_consumer_releases_trial(gateway):
+    client = fake_client()
+
+    async def main():
+        stream = gateway.generate_content_stream_async(client, "model", "prompt")
+        assert (await anext(stream)).text == "a"
+        await stream.aclose()
+
+    asyncio.run(main())
+    assert_trial_released(gateway, client)
+
+
+def test_async_call_cancelled_releases_trial(gateway):
+    client = fake_client()
+
+    async def main():
+        task = asyncio.create_task(gateway.generate_content_async(client, "model", "prompt"))
+        await client.aio.models.started.wait()
+        assert gateway.breaker.trial_in_flight
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert_trial_released(gateway, client)
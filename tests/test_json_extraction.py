@@ -0,0 +1,39 @@
+# tests/test_json_extraction.py
+import pytest
+
+from json_extraction import extract_json_from_text
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"summary": "ok", "score": 3}', {"summary": "ok", "score": 3}),
+    ('```json\n{"summary": "ok"}\n```', {"summary": "ok"}),
+    ('Here is the analysis: {"summary": "ok", "risks": ["a"]} Hope this helps.', {"summary": "ok", "risks": ["a"]}),
+    ('{"summary": "ok", "risks": ["a", "b",],}', {"summary": "ok", "risks": ["a", "b"]}),
+    ('{“summary”: “ok”, “done”: True}', {"summary": "ok", "done": True}),
+    ('{"summary": "ok", "risks": ["a", "b', {"summary": "ok", "risks": ["a"]}),
+    ('{"summary": "ok", "details": {"team": 3,', {"summary": "ok", "details": {"team": 3}}),
+])
+def test_extracts_object(text, expected):
+    assert extract_json_from_text(text) == expected
+
+
+def test_prefers_largest_object():
+    text = 'First {"a": 1} then {"a": 1, "b": {"c": 2}}'
+    assert extract_json_from_text(text) == {"a": 1, "b": {"c": 2}}
+
+
+def test_required_key():
+    text = '{"other": 1} and {"tasks": []}'
+    assert extract_json_from_text(text, required_key="tasks") == {"tasks": []}
+    assert extract_json_from_text('{"other": 1}', required_key="tasks") is None
+
+
+@pytest.mark.parametrize("text", ["", "no json here", "[1, 2, 3]", "{}"])
+def test_no_object(text):
+    assert extract_json_from_text(text) is None
+
+
+def test_deeply_nested_output_does_not_raise():
+    # json.loads raises RecursionError here; only the small nested objects can be parsed.
+    text = '{"a":' + '{"b":[1,2,{"c":"x"},' * 3000
+    assert extract_json_from_text(text) == {"c": "x"}
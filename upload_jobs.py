@@ -0,0 +1,99 @@
+# upload_jobs.py
+from bson.objectid import ObjectId
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import os
+from resources import db, lazy_executor
+from metrics import metrics
+from document_store import save_document
+from pdf_extraction import extract_text_from_pdf_file, remove_spooled
+
+# Progress of background PDF uploads, polled by clients
+upload_jobs_collection = db["uploadJobs"]
+
+UPLOAD_JOB_WORKERS = int(os.getenv("UPLOAD_JOB_WORKERS", "2"))
+# A job that has not reported progress for this long is reported as interrupted
+UPLOAD_JOB_STALE_SECONDS = int(os.getenv("UPLOAD_JOB_STALE_SECONDS", "600"))
+
+# Thread pool that drives upload jobs
+get_executor = lazy_executor(
+    lambda: ThreadPoolExecutor(max_workers=UPLOAD_JOB_WORKERS, thread_name_prefix="upload-job")
+)
+
+
+def start_pdf_upload_job(path, filename, user_email, project_id):
+    """
+    Register a job for a spooled PDF and extract it in the background.
+    The spooled file is removed when the job ends. Returns the job id as a string.
+    """
+    now = datetime.utcnow()
+    job_id = upload_jobs_collection.insert_one({
+        "userEmail": user_email,
+        "projectId": project_id,
+        "filename": filename,
+        "status": "queued",
+        "pagesDone": 0,
+        "pageCount": None,
+        "documentId": None,
+        "error": None,
+        "createdAt": now,
+        "updatedAt": now
+    }).inserted_id
+    get_executor().submit(_run_job, job_id, path, filename, user_email, project_id)
+    return str(job_id)
+
+
+def _run_job(job_id, path, filename, user_email, project_id):
+    def on_progress(pages_done, page_count):
+        upload_jobs_collection.update_one(
+            {"_id": job_id},
+            {"$set": {"status": "running", "pagesDone": pages_done, "pageCount": page_count, "updatedAt": datetime.utcnow()}}
+        )
+
+    try:
+        with metrics.stage("pdf_extract"):
+            document_text = extract_text_from_pdf_file(path, on_progress=on_progress)
+        document = save_document(user_email, project_id, filename, document_text)
+        upload_jobs_collection.update_one(
+            {"_id": job_id},
+            {"$set": {
+                "status": "completed",
+                "documentId": document.document_id,
+                "documentLength": len(document_text),
+                "chunkCount": len(document.index.chunks),
+                "updatedAt": datetime.utcnow()
+            }}
+        )
+    except Exception as e:
+        print(f"Upload job {job_id} failed:", e)
+        upload_jobs_collection.update_one(
+            {"_id": job_id},
+            {"$set": {"status": "failed", "error": str(e), "updatedAt": datetime.utcnow()}}
+        )
+    finally:
+        remove_spooled(path)
+
+
+def get_upload_job(job_id, user_email):
+    """Status of one of the user's upload jobs as a JSON-friendly dict, or None."""
+    if not ObjectId.is_valid(job_id):
+        return None
+    job = upload_jobs_collection.find_one({"_id": ObjectId(job_id), "userEmail": user_email})
+    if not job:
+        return None
+    status = job.get("status")
+    error = job.get("error")
+    stale_before = datetime.utcnow() - timedelta(seconds=UPLOAD_JOB_STALE_SECONDS)
+    if status in ("queued", "running") and job.get("updatedAt") and job["updatedAt"] < stale_before:
+        status, error = "failed", "Upload was interrupted"
+    return {
+        "jobId": str(job["_id"]),
+        "filename": job.get("filename"),
+        "status": status,
+        "pagesDone": job.get("pagesDone"),
+        "pageCount": job.get("pageCount"),
+        "documentId": job.get("documentId"),
+        "documentLength": job.get("documentLength"),
+        "chunkCount": job.get("chunkCount"),
+        "error": error
+    }